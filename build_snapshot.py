@@ -0,0 +1,61 @@
+# -------------------------------
+# 🏗 スナップショットのビルド
+# -------------------------------
+# 使い方:
+#   python build_snapshot.py                  # 同梱の faq.xlsx / faq2.xlsx / other_faq.xlsx から作成
+#                                             （FAQ_XLSX_DIR があればそのフォルダのブックから）
+#   python build_snapshot.py --source sheets  # Googleスプレッドシートから作成
+#   python build_snapshot.py --out snapshot --workers 4
+# アプリは起動時に snapshot/manifest.json を見つけると、それを mmap して即座に利用する。
+import argparse
+import os
+import sys
+import time
+
+from faq_snapshot import ALL_CATEGORIES, snapshot_from_values
+from sheet_backend import BASE_DIR, LOCAL_WORKBOOKS, read_workbook_values
+from snapshot_store import snapshot_dir, write_snapshot_artifact
+
+
+def load_from_xlsx(category, workers):
+    path = os.path.join(os.getenv("FAQ_XLSX_DIR", BASE_DIR), LOCAL_WORKBOOKS[category])
+    if not os.path.exists(path):
+        return None
+    return snapshot_from_values(category, read_workbook_values(path), workers)
+
+
+def load_from_sheets(category, workers):
+    from faq_app import get_worksheet
+
+    return snapshot_from_values(category, get_worksheet(category).get_all_values(), workers)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="FAQ スナップショットをビルドする")
+    parser.add_argument("--source", choices=("xlsx", "sheets"), default="xlsx")
+    parser.add_argument("--out", default=snapshot_dir())
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    loader = load_from_xlsx if args.source == "xlsx" else load_from_sheets
+    snapshots = {}
+    for category in ALL_CATEGORIES:
+        start = time.perf_counter()
+        try:
+            snapshot = loader(category, args.workers)
+        except Exception as e:
+            print(f"⚠️ {category}: 読み込み失敗のためスキップ ({e})", file=sys.stderr)
+            continue
+        if snapshot is None:
+            print(f"- {category}: データなし")
+            continue
+        snapshots[category] = snapshot
+        rows = len(snapshot.faqs if snapshot.kind == "faq" else snapshot.rows)
+        print(f"- {category}: {rows}件 ({time.perf_counter() - start:.2f}s)")
+
+    version = write_snapshot_artifact(snapshots, args.out, source=args.source)
+    print(f"✅ スナップショット {version} を {args.out} に書き出しました")
+
+
+if __name__ == "__main__":
+    main()
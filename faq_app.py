@@ -2,9 +2,12 @@ import streamlit as st
 import pandas as pd
 import gspread
 from oauth2client.service_account import ServiceAccountCredentials
-from gspread_dataframe import get_as_dataframe, set_with_dataframe
 import base64
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 import os
+import re
+import time
 import pykakasi
 import unicodedata
 import json
@@ -20,16 +23,21 @@ import json
 import gspread
 from google.oauth2.service_account import Credentials
 
-@st.cache_resource
-def get_worksheet(sheet_name):
+# 認証情報とスプレッドシート ID を読む。部署ごとに別のスプレッドシートを使うときは
+# SPREADSHEET_UNITS（部署 → ID）と SHEET_UNITS（シート名 → 部署）も読む
+def load_credentials():
     creds_info = None
     spreadsheet_id = None
+    units = {}
+    sheet_units = {}
 
     # ✅ 1. Cloud環境：secrets.toml 優先
     try:
         if "GOOGLE_CREDENTIALS" in st.secrets and "SPREADSHEET_ID" in st.secrets:
             creds_info = json.loads(st.secrets["GOOGLE_CREDENTIALS"])
             spreadsheet_id = st.secrets["SPREADSHEET_ID"]
+            units = dict(st.secrets.get("SPREADSHEET_UNITS", {}))
+            sheet_units = dict(st.secrets.get("SHEET_UNITS", {}))
     except json.JSONDecodeError as e:
         st.error(f"❌ Cloud secrets の JSON 構文エラー: {e}")
         st.stop()
@@ -46,6 +54,8 @@ def get_worksheet(sheet_name):
                 st.write(f.read(100))
                 creds_info = json.load(f)
                 spreadsheet_id = creds_info.get("spreadsheet_id")
+                units = creds_info.get("spreadsheet_units", {})
+                sheet_units = creds_info.get("sheet_units", {})
                 st.write(f.read(100))
 
 
@@ -59,83 +69,179 @@ def get_worksheet(sheet_name):
             st.error(f"❌ ローカル認証情報の読み込み失敗: {e}")
             st.stop()
 
-    # ✅ 3. 認証処理
-    try:
-        scopes = [
-            "https://www.googleapis.com/auth/spreadsheets",
-            "https://www.googleapis.com/auth/drive"
-        ]
-        creds = Credentials.from_service_account_info(creds_info, scopes=scopes)
-        gc = gspread.authorize(creds)
-    except Exception as e:
-        st.error(f"❌ 認証情報の読み取りに失敗しました（PEMエラーなど）: {e}")
-        st.stop()
-
-    # ✅ 4. スプレッドシート取得
     if not spreadsheet_id:
         st.error("❌ スプレッドシートIDが見つかりません（secrets または credentials.json に必要）")
         st.stop()
+    return creds_info, spreadsheet_id, units, sheet_units
+
+
+# -------------------------------
+# 🌤 ふりがな変換（漢字→ひらがな）は faq_index に集約
+# -------------------------------
+from faq_index import query_variants, build_faq_search_index
+from faq_snapshot import SnapshotRefresher, ALL_CATEGORIES, display_value, records_from_values, snapshot_from_values, search_all_categories, merge_hits
+from faq_snapshot import category_kind, JOURNAL_ID_COLUMN, SEARCH_MODES, FAQ_SEARCH_MODES
+from snapshot_store import load_mapped_snapshot, mark_stale
+from sheets_client import client_from_env
+from write_journal import WriteJournal, send_journal_rows
+from sheet_backend import SpreadsheetPool, backend_from_env
+from memory_cache import BoundedCache, cache_stats, env_megabytes, env_seconds
+from faq_shards import shard_min_rows, shard_pool_from_env
+from miss_analytics import MissAnalytics, log_file_path, read_log_rows
 
+# -------------------------------
+# 🔑 スプレッドシートへの接続（認証・HTTP の接続プール・開いたスプレッドシートを全シートで共有）
+# -------------------------------
+# 認証は最初にシートを引くときに1回だけ行う（事前ビルドのスナップショットだけなら認証情報は要らない）
+@st.cache_resource
+def get_spreadsheet_pool():
+    return SpreadsheetPool(
+        load_credentials,
+        pool_size=int(os.getenv("FAQ_SHEETS_POOL_SIZE", "10")),
+        ttl=env_seconds("FAQ_WORKSHEET_TTL", 3600),
+    )
+
+def get_worksheet(sheet_name):
     try:
-        spreadsheet = gc.open_by_key(spreadsheet_id)
-        return spreadsheet.worksheet(sheet_name)
+        return get_spreadsheet_pool().worksheet(sheet_name)
     except Exception as e:
         st.error(f"❌ スプレッドシート「{sheet_name}」の読み込み失敗: {e}")
         st.stop()
 
+# -------------------------------
+# 🚦 シート API の共通クライアント（全セッションで共有）
+# -------------------------------
+@st.cache_resource
+def get_sheets_client():
+    return client_from_env()
+
+# 取得先（Googleスプレッドシート / 模擬シート）は FAQ_SHEETS_BACKEND で切り替える
+@st.cache_resource
+def get_backend():
+    return backend_from_env(get_spreadsheet_pool())
 
+# 裏のスレッド（更新・送信・監視）は st.cache_resource を引かず、作成時に受け取った
+# 取得先・クライアントを使う（スクリプト実行の外から Streamlit の API に触れないように）
 
+# -------------------------------
+# 📓 書き込みはジャーナル経由（ローカルに記録した時点で完了とし、シートへは裏でまとめて送る）
+# -------------------------------
+TROUBLE_SHEET_COLUMNS = ['現場名', '設備名', 'トラブル内容', '対処', '詳細機器名', 'カテゴリ']
 
+@st.cache_resource
+def get_journal():
+    return WriteJournal(partial(send_journal_rows, get_backend(), get_sheets_client(), {})).start()
 
+def trouble_row(values, entry_id):
+    return dict(zip(TROUBLE_SHEET_COLUMNS, values), **{JOURNAL_ID_COLUMN: entry_id})
 
+def pending_trouble_rows(journal, category):
+    if category != "トラブル事例":
+        return []
+    return [trouble_row(values, entry_id) for entry_id, values in journal.pending_entries(category)]
 
+# -------------------------------
+# 📸 カテゴリごとのスナップショット（入力候補などの索引を1回だけ構築）
+# -------------------------------
+def build_snapshot(backend, client, category):
+    # セルの表示値をそのまま列ごとの値にする（DataFrame を経由しない）
+    ws = backend.worksheet(category)
+    values = client.read(category, ws.get_all_values)
+    return snapshot_from_values(category, values)
+
+# 再構築はバックグラウンドで周期的に行い、リクエストは手元の最新版を即座に使う
+# 事前ビルド済みのスナップショット（build_snapshot.py）があれば、起動直後はそれを mmap して使い、
+# 裏ですぐシートから読み直す（成果物のあとにシートで直した内容も反映される）
+@st.cache_resource
+def get_refresher():
+    interval = int(os.getenv("FAQ_REFRESH_INTERVAL", "300"))
+    reconcile_after = int(os.getenv("FAQ_RECONCILE_ROWS", "20"))
+    return SnapshotRefresher(
+        partial(build_snapshot, get_backend(), get_sheets_client()), ALL_CATEGORIES,
+        interval=interval, reconcile_after=reconcile_after,
+        pending_rows=partial(pending_trouble_rows, get_journal()),
+        history_bytes=env_megabytes("FAQ_SNAPSHOT_HISTORY_MB", 256),
+        history_ttl=env_seconds("FAQ_SNAPSHOT_HISTORY_TTL", 1800),
+        shard_pool=shard_pool_from_env(), shard_min_rows=shard_min_rows(),
+        seed=load_mapped_snapshot,
+    ).start()
+
+def get_snapshot(category):
+    return get_refresher().get(category)
+
+# .xlsx を正とする運用では、ブックの更新を見張って該当カテゴリだけ反映する
+# 末尾に行が増えただけのトラブル事例は差分で、それ以外はそのカテゴリを読み直す
+def on_workbook_change(refresher, sheet_name, values, appended_from):
+    if sheet_name not in ALL_CATEGORIES:
+        return
+    mark_stale(sheet_name)
+    if appended_from is not None and sheet_name == "トラブル事例":
+        refresher.apply_rows(sheet_name, records_from_values(values, "trouble", appended_from))
+    else:
+        refresher.refresh_async(sheet_name)
+
+@st.cache_resource
+def get_file_watcher():
+    backend = get_backend()
+    if not hasattr(backend, "watch"):
+        return None
+    return backend.watch(partial(on_workbook_change, get_refresher()), ALL_CATEGORIES, interval=float(os.getenv("FAQ_XLSX_POLL", "5")))
 
 # -------------------------------
-# 🌤 ふりがな変換（漢字→ひらがな）
+# 📉 検索ヒットなしの集計（ログの続きだけを裏で定期的に読み、要約を管理画面に出す）
 # -------------------------------
-kakasi = pykakasi.kakasi()
-kakasi.setMode("J", "H")  # 漢字→ひらがな
-kakasi.setMode("K", "H")  # カタカナ→ひらがな
-kakasi.setMode("H", "H")  # ひらがなはそのまま
-converter = kakasi.getConverter()
-
-# 激音・半激音を正規化（例: ば → は）
-def normalize_seion(char):
-    decomposed = unicodedata.normalize('NFD', char)
-    filtered = ''.join(c for c in decomposed if c not in ['゙', '゚'])  # 激音・半激音を除去
-    return unicodedata.normalize('NFC', filtered)
+@st.cache_resource
+def get_miss_analytics():
+    refresher = get_refresher()
+    return MissAnalytics(
+        partial(read_log_rows, get_backend(), get_sheets_client()), log_file_path(),
+        refresher.get, partial(getattr, refresher, "synonyms"),
+    ).start(float(os.getenv("FAQ_MISS_INTERVAL", "600")))
+
+# カテゴリごとの入口のページ（ここに来るたびに最新版に付け替える）
+# パト指摘事項の一覧・検索結果は設備名などの値で持ち回るので、一覧の最初のページも入口にする
+ENTRY_PAGES = {
+    "faq": {"home"},
+    "patrol": {"home", "search", "patrol", "patrol_category"},
+    "trouble": {"home", "trouble_search"},
+}
+
+# 画面遷移の途中は、見始めたときのバージョンで表示し続ける（一覧の番号がずれないように）
+def get_session_snapshot(category):
+    refresher = get_refresher()
+    pins = st.session_state.setdefault("snapshot_versions", {})
+    if st.session_state.page in ENTRY_PAGES[category_kind(category)] or category not in pins:
+        snapshot = refresher.pin(category)
+        pins[category] = snapshot.version
+        return snapshot
+    return refresher.get_version(category, pins[category])
 
 # -------------------------------
-# 📅 スプレッドシートからFAQを読み込む
+# 💡 入力候補の表示
 # -------------------------------
-@st.cache_data
-def load_faq_from_sheet(sheet_name):
-    ws = get_worksheet(sheet_name)
-    df = get_as_dataframe(ws, evaluate_formulas=True).fillna('').astype(str)
-    faqs = []
-    for _, row in df.iterrows():
-        question = row.get('質問', '')
-        reading_raw = converter.do(str(question))
-        normalized_reading = ''.join(normalize_seion(c) for c in reading_raw)
-        faqs.append({
-            '質問': question,
-            '回答': row.get('回答', ''),
-            '関連ワード': row.get('関連ワード', ''),
-            '添付ファイル': row.get('添付ファイル', ''),
-            '読み': normalized_reading
-        })
-    return faqs
+def apply_suggestion(query_key, term):
+    words = st.session_state.get(query_key, "").split()
+    st.session_state[query_key] = " ".join(words[:-1] + [term])
+
+def render_suggestions(suggest, query, query_key, key_prefix):
+    words = query.split()
+    if not words or query.endswith((' ', '　')):
+        return
+    terms = [t for t in suggest.lookup(words[-1]) if t != words[-1]]
+    if not terms:
+        return
+    st.caption("💡 入力候補")
+    cols = st.columns(4)
+    for i, term in enumerate(terms[:8]):
+        with cols[i % 4]:
+            st.button(term, key=f"{key_prefix}_suggest_{i}", on_click=apply_suggestion, args=(query_key, term))
 
 # -------------------------------
 # ❌ 検索ヒットしなかったワードをログに記録
 # -------------------------------
 def log_no_hit(tag, query):
     try:
-        ws = get_worksheet("log")
-        df = get_as_dataframe(ws).fillna('')
-        df.loc[len(df)] = [tag, query]  # 新しい行を追加
-        ws.clear()
-        set_with_dataframe(ws, df)
+        get_journal().append("log", [tag, query, time.strftime('%Y-%m-%d %H:%M:%S')])  # シートへは裏でまとめて追加
     except Exception as e:
         st.warning(f"ログ保存エラー: {e}")
 
@@ -156,16 +262,85 @@ def check_password():
                 st.error("パスワードが違います。")
 
 
+# 完全に同じ FAQ は1件にまとめる（見た行の集合で判定し、グループ内を毎回探さない）
 def gojuon_sort(faqs):
     groups = {}
+    seen = set()
     for faq in faqs:
         initial = faq['読み'][0] if faq['読み'] else ''
         if initial:
             groups.setdefault(initial, [])
-            if faq not in groups[initial]:
+            key = (initial,) + tuple(sorted(faq.items()))
+            if key not in seen:
+                seen.add(key)
                 groups[initial].append(faq)
     return dict(sorted(groups.items()))
 
+# -------------------------------
+# 🖍 一致箇所の強調（検索時に求めた一致位置で太字にし、長文は一致のまわりだけ出す）
+# -------------------------------
+SNIPPET_CHARS = 120  # 一覧で出す長文の文字数（「全文を表示」で全文）
+HIGHLIGHT_ROWS = 50  # 一致位置を求める件数（検索結果の先頭から）
+
+def escape_markdown(text):
+    return re.sub(r'([\\`*_{}\[\]()#+\-.!|~<>$])', r'\\\1', text)
+
+# spans（[(開始, 終了)]）の部分を太字にした markdown。limit があれば最初の一致のまわり limit 文字だけ
+def highlight(text, spans=None, limit=None):
+    text = str(text)
+    spans = spans or []
+    start, end = 0, len(text)
+    if limit is not None and len(text) > limit:
+        first = spans[0][0] if spans else 0
+        start = max(0, min(first - limit // 4, len(text) - limit))
+        end = start + limit
+    pieces = []
+    pos = start
+    for a, b in spans:
+        a, b = max(a, pos), min(b, end)
+        if a >= b:
+            continue
+        pieces.append(escape_markdown(text[pos:a]))
+        pieces.append(f"**{escape_markdown(text[a:b])}**")
+        pos = b
+    pieces.append(escape_markdown(text[pos:end]))
+    return ("…" if start > 0 else "") + "".join(pieces) + ("…" if end < len(text) else "")
+
+def snippet_limit():
+    return None if st.session_state.get("show_full_text") else SNIPPET_CHARS
+
+# 検索結果の先頭 HIGHLIGHT_ROWS 件の一致位置（それ以降は空）
+def result_spans(snapshot, ids, query):
+    return [snapshot.match_spans(i, query) if n < HIGHLIGHT_ROWS else {} for n, i in enumerate(ids)]
+
+# -------------------------------
+# 🧹 重複候補（ほぼ同じ行をまとめて表示する設定と、管理用の一覧）
+# -------------------------------
+def collapse_rows(snapshot, ids):
+    ids = list(ids)
+    if not st.session_state.get("collapse_duplicates"):
+        return ids
+    duplicates = get_refresher().duplicates
+    return [ids[n] for n in duplicates.collapse((snapshot.category, snapshot.version, i) for i in ids)]
+
+def collapse_hits(hits):
+    if not st.session_state.get("collapse_duplicates"):
+        return hits
+    duplicates = get_refresher().duplicates
+    return [hits[n] for n in duplicates.collapse((h['カテゴリ'], h['version'], h['row']) for h in hits)]
+
+def gojuon_faqs(snapshot, initial):
+    return [snapshot.faqs[i] for i in collapse_rows(snapshot, snapshot.gojuon.get(initial, []))]
+
+def render_duplicate_report():
+    report = get_refresher().duplicates.report()
+    with st.sidebar.expander(f"🧹 重複候補（{len(report)}件）"):
+        if not report:
+            st.write("重複候補はありません。")
+            return
+        st.dataframe(pd.DataFrame([dict(row, 塊=n) for n, members in enumerate(report, 1) for row in members],
+                                  columns=['塊', 'カテゴリ', '行', '見出し']), hide_index=True)
+
 # -------------------------------
 # 📌 添付ファイルの表示（Streamlit Cloud対応）
 # -------------------------------
@@ -188,19 +363,31 @@ def display_attachment(file_name):
     else:
         st.markdown(f"[添付ファイルを開く]({file_path})")
 
-def search_faqs(keywords, faqs, search_mode='AND'):
-    results = []
-    for faq in faqs:
-        content = f"{str(faq.get('質問', '')).lower()} {str(faq.get('関連ワード', '')).lower()}"
-        if search_mode == 'AND':
-            if all(keyword in content for keyword in keywords):
-                results.append(faq)
-        elif search_mode == 'OR':
-            if any(keyword in content for keyword in keywords):
-                results.append(faq)
-    return results
-
-def search_ui(faqs, clear_query=False):
+# FAQ で選んだ「類似」はパト指摘事項・トラブル事例には無いので、その画面では AND から始める
+def search_mode_index(modes, mode):
+    return modes.index(mode) if mode in modes else 0
+
+# スナップショットを渡されなかったときの索引（同じ faqs のあいだは作り直さない）
+@st.cache_resource
+def get_fallback_indexes():
+    return BoundedCache("スナップショット外の検索索引", max_entries=2, sizeof=lambda value: 0)
+
+def fallback_search_index(faqs):
+    cache = get_fallback_indexes()
+    owner, index = cache.get_or_create(id(faqs), lambda: (faqs, build_faq_search_index(faqs)))
+    if owner is not faqs:  # 手放された faqs と id が重なった
+        cache.pop(id(faqs))
+        owner, index = cache.get_or_create(id(faqs), lambda: (faqs, build_faq_search_index(faqs)))
+    return index
+
+# 原文と読み（質問・関連ワード）の両方で照合。索引はスナップショット作成時に構築済み
+# （スナップショットが無いときは AND/OR だけ。類似の行列はスナップショットごとにしか作らない）
+def search_faqs(keywords, faqs, search_mode='AND', index=None):
+    if index is None:
+        index = fallback_search_index(faqs)
+    return [faqs[i] for i in index.search(query_variants(keywords), search_mode)]
+
+def search_ui(faqs, clear_query=False, snapshot=None):
     query_key = "temp_query" if clear_query else "query"
     search_mode_key = "temp_search_mode" if clear_query else "search_mode"
 
@@ -209,19 +396,29 @@ def search_ui(faqs, clear_query=False):
         value="" if clear_query else st.session_state.get("query", ""),
         key=query_key
     )
+    if snapshot is not None:
+        render_suggestions(snapshot.suggest, query, query_key, f"faq_{'detail' if clear_query else 'home'}")
+    modes = FAQ_SEARCH_MODES if snapshot is not None else SEARCH_MODES
     search_mode = st.radio(
         "検索モードを選択してください",
-        ('AND', 'OR'),
+        modes,
         key=search_mode_key,
-        index=0 if clear_query else ('AND', 'OR').index(st.session_state.get("search_mode", "AND"))
+        index=0 if clear_query else search_mode_index(modes, st.session_state.get("search_mode", "AND"))
     )
 
     col1, col2 = st.columns(2)
     with col1:
         if st.button("検索", key=f"search_button_{'detail' if clear_query else 'home'}"):
             keywords = query.lower().split()
-            results = search_faqs(keywords, faqs, search_mode)
+            spans = []
+            if snapshot is not None:
+                ids = collapse_rows(snapshot, snapshot.search(query, search_mode, get_refresher().synonyms))
+                results = [faqs[i] for i in ids]
+                spans = result_spans(snapshot, ids, query)
+            else:
+                results = search_faqs(keywords, faqs, search_mode)
             st.session_state.search_results = results
+            st.session_state.search_spans = spans
             st.session_state.selected_faq_index = None
             st.session_state.show_all_questions = False
 
@@ -240,7 +437,8 @@ def search_ui(faqs, clear_query=False):
 
     with col2:
         if st.button("📋 一覧", key=f"list_button_{'detail' if clear_query else 'home'}"):
-            st.session_state.search_results = faqs
+            st.session_state.search_results = [faqs[i] for i in collapse_rows(snapshot, range(len(faqs)))] if snapshot is not None else faqs
+            st.session_state.search_spans = []
             st.session_state.selected_faq_index = None
             st.session_state.show_all_questions = True
             st.session_state.page = "list"
@@ -248,17 +446,23 @@ def search_ui(faqs, clear_query=False):
 
 
 
-def render_home(faqs):
-    search_ui(faqs)
+def render_home(faqs, snapshot=None):
+    search_ui(faqs, snapshot=snapshot)
     if st.session_state.search_results:
         title = "【FAQ一覧】" if st.session_state.show_all_questions else f"【FAQ検索結果 - {st.session_state.search_mode}検索】"
         st.write(f"### {title}")
+        spans = st.session_state.get("search_spans", [])
         for idx, faq in enumerate(st.session_state.search_results):
             question = faq.get('質問', '').strip()
             if st.button(question, key=f"faq_button_{idx}"):
                 st.session_state.selected_faq_index = idx
                 st.session_state.page = "detail"
                 st.rerun()
+            # どこで一致したか（読みでの一致は元の語）を質問・関連ワードの抜粋で示す
+            matched = spans[idx] if idx < len(spans) else {}
+            if matched:
+                st.caption("　/　".join(f"{column}: {highlight(faq.get(column, ''), matched[column], SNIPPET_CHARS)}"
+                                       for column in ('質問', '関連ワード') if column in matched))
 
 def render_list(faqs):
     if st.button("🔠 五十音表示"):
@@ -289,8 +493,8 @@ def chunk_list(lst, n):
     for i in range(0, len(lst), n):
         yield lst[i:i + n]
 
-def render_gojuon(faqs):
-    groups = gojuon_sort(faqs)
+def render_gojuon(faqs, snapshot=None):
+    groups = snapshot.gojuon if snapshot is not None else gojuon_sort(faqs)
 
     row_groups = {
         'あ行': ['あ', 'い', 'う', 'え', 'お'],
@@ -341,10 +545,12 @@ def render_gojuon(faqs):
                         st.session_state.selected_faq_index = None
                         st.rerun()
 
-def render_gojuon_list(faqs):
+def render_gojuon_list(faqs, snapshot=None):
     initial = st.session_state.selected_initial
-    groups = gojuon_sort(faqs)
-    faqs_to_show = groups.get(initial, [])
+    if snapshot is not None:
+        faqs_to_show = gojuon_faqs(snapshot, initial)
+    else:
+        faqs_to_show = gojuon_sort(faqs).get(initial, [])
     st.write(f"### 「{initial}」のFAQ一覧")
     for idx, faq in enumerate(faqs_to_show):
         if st.button(faq['質問'], key=f"gojuon_list_faq_{idx}"):
@@ -358,14 +564,37 @@ def render_gojuon_list(faqs):
         st.session_state.page = "home"
         st.rerun()
 
-def render_detail(faqs):
+# 関連 FAQ を開く（他カテゴリならカテゴリも切り替える）
+def open_related_faq(category, faq):
+    st.session_state.category_select = category
+    st.session_state.search_results = [faq]
+    st.session_state.search_spans = []  # 前の検索結果の一致位置を持ち越さない
+    st.session_state.selected_faq_index = 0
+    st.session_state.page = "detail"
+
+# スナップショットごとに前計算した近傍を引くだけ（表示のたびの類似度計算はしない）
+def render_related_faqs(category, faq):
+    within, across = get_refresher().related.lookup(category, faq)
+    for title, entries, prefix in (("🔗 関連するFAQ", within, "related"), ("🔗 他のカテゴリの関連FAQ", across, "related_other")):
+        if not entries:
+            continue
+        st.write(f"#### {title}")
+        for n, (related_category, item, score) in enumerate(entries):
+            label = item.get('質問', '').strip()
+            if related_category != category:
+                label = f"[{related_category}] {label}"
+            st.button(label, key=f"{prefix}_{n}", on_click=open_related_faq, args=(related_category, item))
+
+def render_detail(faqs, snapshot=None):
     if st.session_state.page == "detail":
         results = st.session_state.search_results if st.session_state.search_results else faqs
         idx = st.session_state.selected_faq_index
     elif st.session_state.page == "detail_gojuon":
-        groups = gojuon_sort(faqs)
         initial = st.session_state.selected_initial
-        faqs_to_show = groups.get(initial, [])
+        if snapshot is not None:
+            faqs_to_show = gojuon_faqs(snapshot, initial)
+        else:
+            faqs_to_show = gojuon_sort(faqs).get(initial, [])
         idx = st.session_state.selected_faq_index
         results = faqs_to_show
     else:
@@ -373,9 +602,11 @@ def render_detail(faqs):
         return
     if idx is not None and 0 <= idx < len(results):
         faq = results[idx]
-        st.write(f"### 質問: {faq.get('質問', '')}")
+        spans = st.session_state.get("search_spans", []) if st.session_state.page == "detail" else []
+        matched = spans[idx] if idx < len(spans) else {}
+        st.markdown(f"### 質問: {highlight(faq.get('質問', ''), matched.get('質問'))}")
         st.write(f"**回答:** {faq.get('回答', '')}")
-        st.write(f"**関連ワード:** {faq.get('関連ワード', 'なし') or 'なし'}")
+        st.markdown(f"**関連ワード:** {highlight(faq.get('関連ワード', ''), matched.get('関連ワード')) if faq.get('関連ワード', '') else 'なし'}")
         attachment = faq.get('添付ファイル', '')
         if attachment:
             for file in map(str.strip, attachment.split(',')):
@@ -383,6 +614,8 @@ def render_detail(faqs):
                     display_attachment(file)
         else:
             st.write("**添付ファイル:** なし")
+        if snapshot is not None:
+            render_related_faqs(snapshot.category, faq)
 
         if st.button("🔙 戻る"):
             if st.session_state.page == "detail":
@@ -400,7 +633,7 @@ def render_detail(faqs):
             st.rerun()
 
     
-def render_patrol(df):
+def render_patrol(df, snapshot=None):
     st.write("### 🚧 パト指摘事項")
 
     def normalize_text(text):
@@ -412,42 +645,25 @@ def render_patrol(df):
     if st.session_state.page != "patrol_detail":
         # 検索フォーム
         with st.form(key="patrol_search_form"):
-            query = st.text_input("🔍 設備名・指摘事項・対応・カテゴリで検索", value=st.session_state.get("query", ""))
-            search_mode = st.radio("検索モードを選択してください", ('AND', 'OR'), index=('AND', 'OR').index(st.session_state.get("search_mode", "AND")))
+            query = st.text_input("🔍 設備名・指摘事項・対応・カテゴリで検索", value=st.session_state.get("query", ""), key="patrol_query")
+            search_mode = st.radio("検索モードを選択してください", SEARCH_MODES, index=search_mode_index(SEARCH_MODES, st.session_state.get("search_mode", "AND")))
             submitted = st.form_submit_button("検索")
+        if snapshot is not None:
+            render_suggestions(snapshot.suggest, query, "patrol_query", "patrol")
 
         if submitted:
-            keywords = [k for k in query.lower().split() if len(k) >= 2]
-            normalized_keywords = [''.join(normalize_seion(c) for c in converter.do(k)) for k in keywords]
-
+            # 原文＋読み（ひらがな化＋濁音正規化）の照合対象はスナップショット作成時に索引化済み
             results = []
-            for _, row in df.iterrows():
-                # 原文テキスト（漢字含む）
-                original_text = f"{row.get('設備名', '')} {row.get('指摘事項', '')} {row.get('対応', '')} {row.get('カテゴリ', '')}".lower()
-                # 正規化テキスト（ひらがな化＋濁音正規化）
-                normalized_text = ''.join(normalize_seion(c) for c in converter.do(original_text))
-
-                # 関連ワード（正規化）
-                related_words_raw = [w.strip().lower() for w in row.get('関連ワード', '').split(',') if w.strip()]
-                related_words = [''.join(normalize_seion(c) for c in converter.do(w)) for w in related_words_raw]
-
-                # 比較対象文字列：原文と正規化文字列を両方含む
-                combined_content = original_text + " " + normalized_text + " " + " ".join(related_words)
-
-                if search_mode == 'AND' and all((k in combined_content or nk in combined_content) for k, nk in zip(keywords, normalized_keywords)):
-                    results.append({
-                        '設備名': row.get('設備名', ''),
-                        'カテゴリ': row.get('カテゴリ', ''),
-                        '指摘事項': row.get('指摘事項', ''),
-                        '対応': row.get('対応', '')
-                    })
-                elif search_mode == 'OR' and any((k in combined_content or nk in combined_content) for k, nk in zip(keywords, normalized_keywords)):
-                    results.append({
-                        '設備名': row.get('設備名', ''),
-                        'カテゴリ': row.get('カテゴリ', ''),
-                        '指摘事項': row.get('指摘事項', ''),
-                        '対応': row.get('対応', '')
-                    })
+            ids = collapse_rows(snapshot, snapshot.search(query, search_mode, get_refresher().synonyms))
+            for i, spans in zip(ids, result_spans(snapshot, ids, query)):
+                row = snapshot.rows[i]
+                results.append({
+                    '設備名': row.get('設備名', ''),
+                    'カテゴリ': row.get('カテゴリ', ''),
+                    '指摘事項': row.get('指摘事項', ''),
+                    '対応': row.get('対応', ''),
+                    '一致': spans,
+                })
 
             if not results:
                 st.info("該当するパト指摘事項は見つかりませんでした。")
@@ -530,10 +746,11 @@ def render_patrol(df):
 
     # カテゴリ一覧ページ（3）
     elif st.session_state.page == "patrol_category":
-        categories = sorted(set(df['カテゴリ']), key=lambda c: len(df[df['カテゴリ'] == c]), reverse=True)
+        category_counts = snapshot.facets.get('カテゴリ', {})
+        categories = sorted(category_counts, key=lambda c: category_counts[c], reverse=True)
         cols = st.columns(4)
         for i, cat in enumerate(categories):
-            count = len(df[df['カテゴリ'] == cat])
+            count = category_counts[cat]
             label = f"{cat or '(カテゴリなし)'} / {count}件"
             col = cols[i % 4]
             with col:
@@ -600,9 +817,12 @@ def render_patrol(df):
 
         st.markdown(f"### 詳細（設備名: {equipment_name}、カテゴリ: {selected_note}）")
         st.info(f"該当件数: {len(rows)} 件")
+        st.checkbox("全文を表示", key="show_full_text")
+        limit = snippet_limit()
         for r in rows:
-            st.markdown(f"- **指摘事項**: {r['指摘事項']}")
-            st.markdown(f"  **対応**: {r['対応']}")
+            matched = r.get('一致') or {}
+            st.markdown(f"- **指摘事項**: {highlight(r['指摘事項'], matched.get('指摘事項'), limit)}")
+            st.markdown(f"  **対応**: {highlight(r['対応'], matched.get('対応'), limit)}")
             st.markdown("---")
         if st.button("🔙 戻る"):
             prev_page = st.session_state.get("previous_page", "patrol")
@@ -612,16 +832,14 @@ def render_patrol(df):
             st.session_state.page = "home"
             st.rerun()
 
-def render_trouble(df):
+# トラブル事例は集計（cube）と選択肢から表示し、DataFrame は作らない（登録のたびに全件を組み直さない）
+def render_trouble(snapshot):
     st.write("### ⚠️ トラブル事例")
 
     def normalize_text(text):
         return str(text).strip().lower().replace('　', ' ').replace(' ', '')
 
 
-    def display_value(value, default_label):
-        return value if str(value).strip() else default_label
-
     def trigger_rerun():
         st.session_state.trouble_reload_flag = True
 
@@ -641,14 +859,17 @@ def render_trouble(df):
             st.rerun()
         return
 
+    # 一覧・詳細の件数と該当行はスナップショットの集計から引く
+    cube = snapshot.cube
+
     if st.session_state.page == "trouble_category_detail":
         selected_cat = st.session_state.selected_trouble_category
-        rows = df[df['カテゴリ'].fillna('').apply(lambda x: display_value(x, "カテゴリ登録なし")) == selected_cat]
+        row_ids = cube.category_rows(display_value(selected_cat, "カテゴリ登録なし"))
         st.markdown(f"### 「{selected_cat}」に含まれる事例一覧")
-        if rows.empty:
+        if not row_ids:
             st.info("該当するトラブル事例はありません。")
         else:
-            for r in rows.to_dict(orient='records'):
+            for r in (snapshot.rows[i] for i in row_ids):
                 st.markdown(f"- **現場名**: {display_value(r.get('現場名', ''), '現場名登録なし')}")
                 st.markdown(f"  **詳細機器名**: {display_value(r.get('詳細機器名', ''), '機器名登録なし')}")
                 st.markdown(f"  **トラブル内容**: {display_value(r.get('トラブル内容', ''), 'トラブル内容なし')}")
@@ -662,10 +883,8 @@ def render_trouble(df):
 
     if st.session_state.page == "trouble_category_list":
         st.write("### 📋 カテゴリ一覧")
-        categories = sorted(set(df['カテゴリ'].dropna().astype(str)))
         cols = st.columns(4)
-        for i, cat in enumerate(categories):
-            count = len(df[df['カテゴリ'] == cat])
+        for i, (cat, count) in enumerate(cube.category_counts()):
             label = f"{cat or '(未分類)'} / {count}件"
             col = cols[i % 4]
             with col:
@@ -680,21 +899,16 @@ def render_trouble(df):
 
     if st.session_state.page != "trouble_detail":
         with st.form(key="trouble_search_form"):
-            query = st.text_input("🔍 設備名・トラブル内容・対処・カテゴリ・現場名・備考で検索", value=st.session_state.get("query", ""))
-            search_mode = st.radio("検索モードを選択してください", ('AND', 'OR'), index=('AND', 'OR').index(st.session_state.get("search_mode", "AND")))
+            query = st.text_input("🔍 設備名・トラブル内容・対処・カテゴリ・現場名・備考で検索", value=st.session_state.get("query", ""), key="trouble_query")
+            search_mode = st.radio("検索モードを選択してください", SEARCH_MODES, index=search_mode_index(SEARCH_MODES, st.session_state.get("search_mode", "AND")))
             submitted = st.form_submit_button("検索")
+        if snapshot is not None:
+            render_suggestions(snapshot.suggest, query, "trouble_query", "trouble")
 
         if submitted:
-            keywords = [''.join(normalize_text(c) for c in k) for k in query.lower().split() if len(k) >= 2]
             st.session_state.page = "trouble_search"
-            results = []
-            for _, row in df.iterrows():
-                raw_text = f"{row.get('設備名', '')} {row.get('トラブル内容', '')} {row.get('対処', '')} {row.get('カテゴリ', '')} {row.get('現場名', '')} {row.get('詳細機器名', '')}".lower()
-                content = ''.join(normalize_text(c) for c in raw_text)
-                if search_mode == 'AND' and all(k in content for k in keywords):
-                    results.append(dict(row))
-                elif search_mode == 'OR' and any(k in content for k in keywords):
-                    results.append(dict(row))
+            # 空白を除いた照合対象はスナップショット作成時に準備済み
+            results = [dict(snapshot.rows[i]) for i in snapshot.search(query, search_mode, get_refresher().synonyms)]
 
             if not results:
                 st.info("該当するトラブル事例は見つかりませんでした。")
@@ -724,10 +938,12 @@ def render_trouble(df):
 
     if st.session_state.page == "trouble_register":
         st.write("### 📝 トラブル事例 登録フォーム")
+        # 選択肢と件数はスナップショットごとの索引から引く
+        options = snapshot.options
 
         st.markdown("#### 現場名")
         site_input = st.text_input("現場名を入力または選択", value=st.session_state.get("site_input", ""), placeholder="新規登録。登録済の場合は↓から選択してください。", label_visibility="collapsed", key="site_input")
-        sites = sorted(set(df['現場名'].dropna().astype(str)))
+        sites = options.options()
         site_select = st.selectbox("登録済のワードはこちらから選択してください。", options=[""] + sites, index=0, key="site_select_trouble")
         col_site, col_dec1 = st.columns([3, 1])
         with col_dec1:
@@ -738,7 +954,7 @@ def render_trouble(df):
 
         st.markdown("#### 設備名（大項目）")
         eq_input = st.text_input("設備名を入力または選択", value=st.session_state.get("eq_input", ""), placeholder="新規登録。登録済の場合は↓から選択してください。", label_visibility="collapsed", key="eq_input")
-        eqs = sorted(set(df['設備名'].dropna().astype(str)))
+        eqs = options.column_options('設備名')
         eq_select = st.selectbox("登録済のワードはこちらから選択してください。", options=[""] + eqs, index=0, key="eq_select_trouble")
         col_eq, col_dec2 = st.columns([3, 1])
         with col_dec2:
@@ -749,8 +965,7 @@ def render_trouble(df):
 
         st.markdown("#### カテゴリ（中項目）")
         cat_input = st.text_input("カテゴリを入力または選択", value=st.session_state.get("cat_input", ""), placeholder="新規登録。登録済の場合は↓から選択してください。", label_visibility="collapsed", key="cat_input")
-        cat_df = df[(df['現場名'].astype(str) == site) & (df['設備名'].astype(str) == eq)]
-        cats = sorted(set(cat_df['カテゴリ'].dropna().astype(str)))
+        cats = options.options(site, eq)
         cat_select = st.selectbox("登録済のワードはこちらから選択してください。", options=[""] + cats, index=0, key="cat_select_trouble")
         col_cat, col_dec3 = st.columns([3, 1])
         with col_dec3:
@@ -758,19 +973,18 @@ def render_trouble(df):
                 st.session_state.cat_input = cat_input
         category = cat_select.strip() if cat_select.strip() else cat_input.strip()
         st.write(f"選択したカテゴリ：{category}")
-        st.write(f"登録済のカテゴリ：{len(cat_df)}件")
+        st.write(f"登録済のカテゴリ：{options.count(site, eq)}件")
 
         st.markdown("#### 詳細機器名（小項目）")
         detail_input = st.text_input("詳細機器名", placeholder="正式名称推奨", label_visibility="collapsed", key="detail_input")
-        detail_df = df[(df['現場名'].astype(str) == site) & (df['設備名'].astype(str) == eq) & (df['カテゴリ'].astype(str) == category)]
-        details = sorted(set(detail_df['詳細機器名'].dropna().astype(str)))
+        details = options.options(site, eq, category)
         detail_select = st.selectbox("登録済のワードはこちらから選択してください。", options=[""] + details, index=0, key="detail_select_trouble")
         col_detail, col_dec4 = st.columns([3, 1])
         with col_dec4:
             if st.button("決定", key="detail_decide"):
                 st.session_state.detail_input = detail_input
         detail = detail_select.strip() if detail_select.strip() else detail_input.strip()
-        st.write(f"登録済の機器名：{len(detail_df)}件")
+        st.write(f"登録済の機器名：{options.count(site, eq, category)}件")
         content = st.text_area("トラブル内容")
         response = st.text_area("対処")
 
@@ -780,8 +994,11 @@ def render_trouble(df):
         if not st.session_state.trouble_registered:
             if st.button("登録する"):
                 try:
-                    worksheet = get_worksheet("トラブル事例")
-                    worksheet.append_row([site, eq, content, response, detail, category])
+                    values = [site, eq, content, response, detail, category]
+                    entry_id = get_journal().append("トラブル事例", values)  # ローカルに記録できたら完了
+                    mark_stale("トラブル事例")  # 事前ビルド分より新しくなったので、次の全件読み込みはシートから
+                    # 登録内容は差分として即座に反映（照合対象・集計・選択肢・同義語）
+                    get_refresher().apply_rows("トラブル事例", [trouble_row(values, entry_id)])
                     st.session_state.trouble_registered = True
                     st.session_state.page = "trouble_register_done"
                     st.rerun()
@@ -811,11 +1028,9 @@ def render_trouble(df):
 
     elif st.session_state.page == "trouble_category_detail":
         selected_cat = st.session_state.selected_trouble_category
-        rows = df[df['カテゴリ'].fillna('').apply(lambda x: display_value(x, "カテゴリ登録なし")) == selected_cat]
-        grouped = rows.groupby(['現場名', '設備名'])
         st.markdown(f"### 「{selected_cat}」に含まれる事例")
         cols = st.columns(4)
-        for i, ((site, eq), group) in enumerate(grouped):
+        for i, ((site, eq), group) in enumerate(cube.category_groups(display_value(selected_cat, "カテゴリ登録なし"))):
             site_label = display_value(site, "現場名登録なし")
             eq_label = display_value(eq, "設備名なし")
             label = f"{site_label} / {eq_label} / {len(group)}件"
@@ -825,14 +1040,13 @@ def render_trouble(df):
                     st.session_state.selected_site = site
                     st.session_state.selected_equipment = eq
                     st.session_state.selected_trouble_category = selected_cat
+                    st.session_state.trouble_spans = {}  # 一覧から開いた行は強調しない
                     st.session_state.page = "trouble_detail"
                     st.rerun()
 
     elif st.session_state.page == "trouble_site_list":
-        sites = sorted(set(display_value(s, "現場名登録なし") for s in df['現場名']))
         cols = st.columns(4)
-        for i, site in enumerate(sites):
-            count = len(df[df['現場名'].fillna('').apply(lambda x: display_value(x, "現場名登録なし")) == site])
+        for i, (site, count) in enumerate(cube.site_counts()):
             col = cols[i % 4]
             with col:
                 if st.button(f"{site} / {count}件", key=f"trouble_site_{site}"):
@@ -842,11 +1056,9 @@ def render_trouble(df):
 
     elif st.session_state.page == "trouble_site_detail":
         site = st.session_state.selected_trouble_site
-        rows = df[df['現場名'].fillna('').apply(lambda x: display_value(x, "現場名登録なし")) == site]
-        grouped = rows.groupby(['現場名', '設備名'])
         st.markdown(f"### 「{site}」に含まれる事例")
         cols = st.columns(4)
-        for i, ((site, eq), group) in enumerate(grouped):
+        for i, ((site, eq), group) in enumerate(cube.site_groups(site)):
             site_label = display_value(site, "現場名登録なし")
             eq_label = display_value(eq, "設備名なし")
             label = f"{site_label} / {eq_label} / {len(group)}件"
@@ -855,7 +1067,8 @@ def render_trouble(df):
                 if st.button(label, key=f"trouble_detail_btn_site_{site}_{eq}"):
                     st.session_state.selected_site = site
                     st.session_state.selected_equipment = eq
-                    st.session_state.selected_trouble_category = group.iloc[0]['カテゴリ'] if 'カテゴリ' in group.columns else ''
+                    st.session_state.selected_trouble_category = snapshot.rows[group[0]].get('カテゴリ', '')
+                    st.session_state.trouble_spans = {}  # 一覧から開いた行は強調しない
                     st.session_state.page = "trouble_detail"
                     st.rerun()
 
@@ -863,15 +1076,20 @@ def render_trouble(df):
         site = display_value(st.session_state.selected_site, "現場名登録なし")
         eq = display_value(st.session_state.selected_equipment, "設備名なし")
         cat = display_value(st.session_state.selected_trouble_category, "カテゴリ登録なし")
-        rows = df[(df['現場名'].fillna('').apply(lambda x: display_value(x, "現場名登録なし")) == site) &
-                  (df['設備名'].fillna('').apply(lambda x: display_value(x, "設備名なし")) == eq) &
-                  (df['カテゴリ'].fillna('').apply(lambda x: display_value(x, "カテゴリ登録なし")) == cat)]
+        row_ids = cube.cell(site, eq, cat)
         st.markdown(f"### 詳細（現場名: {site}、設備名: {eq}、カテゴリ: {cat}）")
-        st.info(f"該当件数: {len(rows)} 件")
-        for r in rows.to_dict(orient='records'):
+        st.info(f"該当件数: {len(row_ids)} 件")
+        st.checkbox("全文を表示", key="show_full_text")
+        limit = snippet_limit()
+        # 全カテゴリ検索から開いた行だけ一致位置がある（(バージョン, 行番号) ごと。一覧から開いた行は空）
+        spans = st.session_state.get("trouble_spans", {})
+        for i in row_ids:
+            r = snapshot.rows[i]
+            matched = spans.get((snapshot.version, i), {})
+            content, response = r.get('トラブル内容', ''), r.get('対処', '')
             st.markdown(f"- **詳細機器名**: {display_value(r.get('詳細機器名', ''), '詳細機器名なし')}")
-            st.markdown(f"  **トラブル内容**: {display_value(r.get('トラブル内容', ''), 'トラブル内容なし')}")
-            st.markdown(f"  **対処**: {display_value(r.get('対処', ''), '対処なし')}")
+            st.markdown(f"  **トラブル内容**: {highlight(content, matched.get('トラブル内容'), limit) if str(content).strip() else 'トラブル内容なし'}")
+            st.markdown(f"  **対処**: {highlight(response, matched.get('対処'), limit) if str(response).strip() else '対処なし'}")
             st.markdown("---")
 
         if st.button("🔙 戻る"):
@@ -888,11 +1106,162 @@ def render_trouble(df):
 
 
     
+# -------------------------------
+# 🌐 全カテゴリ検索
+# -------------------------------
+GLOBAL_SEARCH = "🌐 全カテゴリ検索"
+GLOBAL_PAGE_SIZE = 20
+
+@st.cache_resource
+def get_search_executor():
+    return ThreadPoolExecutor(max_workers=len(ALL_CATEGORIES), thread_name_prefix="global-search")
+
+# 結果をクリックしたら、そのカテゴリの詳細ページへ（検索時のバージョンで表示）
+# 開いた行の一致位置もここで1回だけ求めて渡す
+def open_global_hit(hit):
+    category = hit['カテゴリ']
+    snapshot = get_refresher().get_version(category, hit['version'])
+    row = snapshot.records[hit['row']]
+    matched = snapshot.match_spans(hit['row'], st.session_state.get("global_query", ""))
+    st.session_state.category_select = category
+    st.session_state.setdefault("snapshot_versions", {})[category] = snapshot.version
+    if snapshot.kind == "faq":
+        st.session_state.search_results = [row]
+        st.session_state.search_spans = [matched]
+        st.session_state.selected_faq_index = 0
+        st.session_state.page = "detail"
+    elif snapshot.kind == "patrol":
+        st.session_state.selected_equipment_name = row.get('設備名', '')
+        st.session_state.selected_equipment_norm = str(row.get('設備名', '')).strip().lower().replace('　', ' ').replace(' ', '')
+        st.session_state.selected_patrol_note = row.get('カテゴリ', '')
+        st.session_state.filtered_rows = [dict({c: row.get(c, '') for c in ('設備名', 'カテゴリ', '指摘事項', '対応')}, 一致=matched)]
+        st.session_state.page = "patrol_detail"
+    else:
+        st.session_state.selected_site = row.get('現場名', '')
+        st.session_state.selected_equipment = row.get('設備名', '')
+        st.session_state.selected_trouble_category = row.get('カテゴリ', '')
+        st.session_state.trouble_spans = {(snapshot.version, hit['row']): matched}
+        st.session_state.page = "trouble_detail"
+
+def render_global_hits(hits, limit):
+    for hit in hits[:limit]:
+        st.markdown(f"- **[{hit['カテゴリ']}]** {hit['title']}")
+
+def render_global_search():
+    with st.form(key="global_search_form"):
+        query = st.text_input("🔍 すべてのカテゴリをまとめて検索", value=st.session_state.get("global_query", ""))
+        search_mode = st.radio("検索モードを選択してください", ('AND', 'OR'), index=('AND', 'OR').index(st.session_state.get("global_search_mode", "AND")))
+        submitted = st.form_submit_button("検索")
+    if submitted:
+        st.session_state.global_query = query
+        st.session_state.global_search_mode = search_mode
+        st.session_state.global_limit = GLOBAL_PAGE_SIZE
+
+    query = st.session_state.get("global_query", "")
+    if not query.split():
+        return
+    search_mode = st.session_state.get("global_search_mode", "AND")
+    limit = st.session_state.get("global_limit", GLOBAL_PAGE_SIZE)
+
+    # カテゴリごとに並行して検索し、終わったカテゴリから順に先頭ページを表示していく
+    placeholder = st.empty()
+    hits, done = [], 0
+    for category, result in search_all_categories(get_refresher().pin, ALL_CATEGORIES, query, search_mode, get_search_executor(),
+                                                     get_refresher().synonyms):
+        done += 1
+        if isinstance(result, Exception):
+            st.warning(f"{category} の検索に失敗しました: {result}")
+            continue
+        hits = collapse_hits(merge_hits(hits + result, ALL_CATEGORIES))
+        if done < len(ALL_CATEGORIES):
+            with placeholder.container():
+                st.caption(f"検索中… {done}/{len(ALL_CATEGORIES)} カテゴリ")
+                render_global_hits(hits, limit)
+
+    with placeholder.container():
+        st.write(f"### 【全カテゴリ検索結果 - {search_mode}検索】 {len(hits)}件")
+        if not hits:
+            st.info("該当する項目はありません。")
+            if submitted:
+                log_no_hit("全カテゴリ", query)
+        for i, hit in enumerate(hits[:limit]):
+            st.button(f"[{hit['カテゴリ']}] {hit['title']}", key=f"global_hit_{i}", on_click=open_global_hit, args=(hit,))
+        if len(hits) > limit:
+            if st.button("さらに表示", key="global_more"):
+                st.session_state.global_limit = limit + GLOBAL_PAGE_SIZE
+                st.rerun()
+
+# -------------------------------
+# 🛠 管理用の表示（環境変数 FAQ_ADMIN=1 のときだけサイドバーに出す）
+# -------------------------------
+def render_admin_panel():
+    if os.getenv("FAQ_ADMIN") != "1":
+        return
+    with st.sidebar.expander("🛠 管理情報"):
+        st.write("**シート API**")
+        st.json(get_sheets_client().metrics())
+        st.write("**シートの取得先**")
+        st.json(get_backend().metrics())
+        st.write("**書き込みジャーナル**")
+        st.json(get_journal().status())
+        st.write("**スナップショット**")
+        st.json(get_refresher().status())
+        if get_refresher().shard_pool is not None:
+            st.write("**検索シャード**")
+            st.json(get_refresher().shard_pool.metrics())
+    render_duplicate_report()
+    render_cache_report()
+    render_miss_report()
+
+# キャッシュごとの件数・見積もった大きさ・上限と、最新スナップショットの大きさ
+def render_cache_report():
+    with st.sidebar.expander("🧠 キャッシュ"):
+        mib = 1024 * 1024
+        st.dataframe(pd.DataFrame([{
+            '名前': stats['name'],
+            '件数': stats['entries'],
+            'MiB': round(stats['bytes'] / mib, 2),
+            '上限MiB': round(stats['max_bytes'] / mib, 1) if stats['max_bytes'] else None,
+            '期限秒': stats['ttl'],
+            'ヒット': stats['hits'],
+            'ミス': stats['misses'],
+            '追い出し': stats['evictions'],
+            '期限切れ': stats['expirations'],
+        } for stats in cache_stats()]), hide_index=True)
+        st.write("**最新スナップショット（見積もり）**")
+        st.dataframe(pd.DataFrame([{'カテゴリ': c, 'MiB': round(size / mib, 2)}
+                                   for c, size in get_refresher().memory().items()]), hide_index=True)
+
+# カテゴリごとのヒットなし上位（今はヒットするものに印）と、日ごとの件数
+def render_miss_report():
+    analytics = get_miss_analytics()
+    with st.sidebar.expander("📉 ヒットなしの集計"):
+        if st.button("今すぐ集計", key="miss_run"):
+            try:
+                analytics.run_once()
+            except Exception as e:
+                st.warning(f"集計エラー: {e}")
+        status = analytics.status()
+        st.caption(f"最終集計: {status['updated_at'] or '未集計'}")
+        if status['last_error']:
+            st.caption(f"⚠️ {status['last_error']}")
+        rows = analytics.top_misses(10)
+        if rows:
+            st.dataframe(pd.DataFrame(rows), hide_index=True)
+        # 日ごとの件数は表で出す（グラフは再実行のたびに描き直す分が重い）
+        trend = analytics.trend(14)
+        if trend:
+            st.dataframe(pd.DataFrame({c: {d[5:]: n for d, n in days.items()} for c, days in trend.items()}).T)
+
 def main():
     st.title("📚 FAQ検索")
     check_password()
     if not st.session_state.authenticated:
         return
+    render_admin_panel()
+    get_file_watcher()
+    get_miss_analytics()
+    st.sidebar.checkbox("🧹 重複をまとめて表示", key="collapse_duplicates")
 
     # 初期セッションステート
     if 'page' not in st.session_state:
@@ -910,23 +1279,20 @@ def main():
 
     # ✅ ① カテゴリ選択（スプレッドシートのシート名と一致）
     categories = ["工事関係", "事務関係", "その他", "パト指摘事項", "トラブル事例"]
-    selected_category = st.selectbox("カテゴリを選択してください", categories)
+    selected_category = st.selectbox("カテゴリを選択してください", categories + [GLOBAL_SEARCH], key="category_select")
     st.session_state.selected_category = selected_category  # ← log記録にも必要
+    if selected_category == GLOBAL_SEARCH:
+        render_global_search()
+        return
 
     # ✅ ② カテゴリに応じてデータ読み込み
     try:
-        if selected_category in ["工事関係", "事務関係", "その他"]:
-            faqs = load_faq_from_sheet(selected_category)
-            st.session_state.category_type = "faq"
-        elif selected_category == "パト指摘事項":
-            df = get_as_dataframe(get_worksheet("パト指摘事項")).fillna('')
-            st.session_state.category_type = "patrol"
-        elif selected_category == "トラブル事例":
-            df = get_as_dataframe(get_worksheet("トラブル事例")).fillna('')
-            st.session_state.category_type = "trouble"
-        else:
+        if selected_category not in categories:
             st.error("未対応のカテゴリです。")
             return
+        snapshot = get_session_snapshot(selected_category)
+        faqs = snapshot.faqs
+        st.session_state.category_type = snapshot.kind
     except Exception as e:
         st.error(f"データ読み込みに失敗しました: {e}")
         return
@@ -934,24 +1300,24 @@ def main():
     # ✅ ③ ページ遷移処理
     if st.session_state.category_type == "faq":
         if st.session_state.page == "home":
-            render_home(faqs)
+            render_home(faqs, snapshot=snapshot)
         elif st.session_state.page == "list":
             render_list(faqs)
         elif st.session_state.page == "gojuon":
-            render_gojuon(faqs)
+            render_gojuon(faqs, snapshot=snapshot)
         elif st.session_state.page == "gojuon_list":
-            render_gojuon_list(faqs)
+            render_gojuon_list(faqs, snapshot=snapshot)
         elif st.session_state.page in ("detail", "detail_gojuon"):
-            render_detail(faqs)
+            render_detail(faqs, snapshot=snapshot)
         else:
             st.session_state.page = "home"
             st.rerun()
 
     elif st.session_state.category_type == "patrol":
-        render_patrol(df)
+        render_patrol(snapshot.df, snapshot=snapshot)
 
     elif st.session_state.category_type == "trouble":
-        render_trouble(df)
+        render_trouble(snapshot)
 
 
 if __name__ == "__main__":
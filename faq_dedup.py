@@ -0,0 +1,146 @@
+import copy
+
+import numpy as np
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+
+from faq_similarity import BLOCK_ROWS, document_text, gram_keys
+
+# -------------------------------
+# 🧹 重複候補の検出（MinHash＋LSH で、ほぼ同じ行をカテゴリをまたいでまとめる）
+# -------------------------------
+# ・行ごとの文字 3-gram の集合を MINHASH_PERMS 個のハッシュの最小値（署名）に縮める
+#   （署名が一致する割合 ≒ 3-gram 集合の Jaccard 係数）
+# ・署名を LSH_BANDS 個の帯に分け、どれかの帯が丸ごと一致した行どうしだけを候補にする
+#   （全組み合わせを比べないので、行数にほぼ比例する時間で済む）
+# ・候補は署名の一致率が DUPLICATE_THRESHOLD 以上のものだけ残し、つながった行を1つの塊にする
+# 署名はスナップショットごとに1回だけ計算し、塊の計算はカテゴリが読み直されるたびに全カテゴリ分やり直す
+MINHASH_PERMS = 64
+LSH_BANDS = 8  # 1帯 8 個（一致率 0.77 あたりから候補になりやすい）
+DUPLICATE_THRESHOLD = 0.8
+SHINGLE_SIZES = (3,)
+
+# 重複の判定に使う列
+DUPLICATE_COLUMNS = {
+    "faq": ['質問', '回答'],
+    "patrol": ['設備名', '指摘事項', '対応'],
+    "trouble": ['設備名', 'トラブル内容', '対処'],
+}
+
+_rng = np.random.default_rng(20240601)
+_MULTIPLIERS = _rng.integers(1, 2 ** 63, MINHASH_PERMS, dtype=np.uint64) | np.uint64(1)
+_OFFSETS = _rng.integers(0, 2 ** 63, MINHASH_PERMS, dtype=np.uint64)
+EMPTY_SIGNATURE = np.iinfo(np.uint32).max
+
+
+def duplicate_text(kind, record):
+    return document_text(record.get(c, '') for c in DUPLICATE_COLUMNS[kind])
+
+
+def _mix(x):
+    x = x ^ (x >> np.uint64(31))
+    x = x * np.uint64(0x9E3779B97F4A7C15)
+    return x ^ (x >> np.uint64(29))
+
+
+# 行 × MINHASH_PERMS の署名（uint32）。照合する文字が無い行は EMPTY_SIGNATURE のまま
+def minhash_signatures(texts):
+    texts = list(texts)
+    signatures = np.full((len(texts), MINHASH_PERMS), EMPTY_SIGNATURE, np.uint32)
+    for a in range(0, len(texts), BLOCK_ROWS):
+        keys, docs = gram_keys(texts[a:a + BLOCK_ROWS], SHINGLE_SIZES)
+        if not len(keys):
+            continue
+        order = np.argsort(docs, kind='stable')  # 最小値を取るだけなので同じ 3-gram の重複はそのままでよい
+        docs, base = docs[order], _mix(keys[order].astype(np.uint64))
+        starts = np.flatnonzero(np.r_[True, docs[1:] != docs[:-1]])
+        rows = a + docs[starts]
+        for p in range(MINHASH_PERMS):
+            hashed = ((base * _MULTIPLIERS[p] + _OFFSETS[p]) >> np.uint64(32)).astype(np.uint32)
+            signatures[rows, p] = np.minimum.reduceat(hashed, starts)
+    return signatures
+
+
+# 署名 → 塊の番号（1行だけの塊も含む通し番号）
+def cluster_signatures(signatures, threshold=DUPLICATE_THRESHOLD):
+    n = len(signatures)
+    usable = np.flatnonzero((signatures != EMPTY_SIGNATURE).any(axis=1))
+    width = MINHASH_PERMS // LSH_BANDS
+    heads, members = [], []
+    for band in range(LSH_BANDS):
+        chunk = signatures[usable, band * width:(band + 1) * width].astype(np.uint64)
+        key = np.zeros(len(usable), np.uint64)
+        for column in chunk.T:
+            key = _mix(key ^ column)
+        order = np.argsort(key, kind='stable')
+        sorted_key = key[order]
+        is_start = np.r_[True, sorted_key[1:] != sorted_key[:-1]]
+        head = order[np.maximum.accumulate(np.where(is_start, np.arange(len(order)), 0))]
+        # 同じバケツの先頭の行と比べる（バケツの中を総当たりしない）
+        heads.append(usable[head[~is_start]])
+        members.append(usable[order[~is_start]])
+    heads = np.concatenate(heads) if heads else np.zeros(0, int)
+    members = np.concatenate(members) if members else np.zeros(0, int)
+    if len(heads):
+        agree = (signatures[heads] == signatures[members]).mean(axis=1)
+        heads, members = heads[agree >= threshold], members[agree >= threshold]
+    graph = sparse.csr_matrix((np.ones(len(heads), np.int8), (heads, members)), shape=(n, n))
+    return connected_components(graph, directed=False)[1]
+
+
+class DuplicateIndex:
+    def __init__(self):
+        self.snapshots = {}  # カテゴリ → 計算に使った Snapshot
+        self.labels = {}     # カテゴリ → 行ごとの塊の番号
+        self.clusters = {}   # 塊の番号 → [(カテゴリ, 行番号)]（2行以上の塊だけ）
+
+    @property
+    def versions(self):
+        return {category: snapshot.version for category, snapshot in self.snapshots.items()}
+
+    # category を snapshot に差し替えた新しい索引を返す（自分は変えない）
+    def updated(self, category, snapshot):
+        index = copy.copy(self)
+        index.snapshots = dict(self.snapshots)
+        index.snapshots[category] = snapshot
+        categories = list(index.snapshots)
+        signatures = [index.snapshots[c].minhash for c in categories]
+        labels = cluster_signatures(np.vstack(signatures)) if signatures else np.zeros(0, int)
+        sizes = np.bincount(labels) if len(labels) else np.zeros(0, int)
+        index.labels, index.clusters = {}, {}
+        start = 0
+        for c, signature in zip(categories, signatures):
+            index.labels[c] = labels[start:start + len(signature)]
+            for row in np.flatnonzero(sizes[index.labels[c]] > 1):
+                index.clusters.setdefault(int(index.labels[c][row]), []).append((c, int(row)))
+            start += len(signature)
+        return index
+
+    def cluster_of(self, category, version, row):
+        snapshot = self.snapshots.get(category)
+        if snapshot is None or snapshot.version != version or row >= len(self.labels[category]):
+            return None  # 計算していない版の行はまとめない
+        label = int(self.labels[category][row])
+        return label if label in self.clusters else None
+
+    # (カテゴリ, バージョン, 行番号) の並びのうち、同じ塊の2件目以降を除いた位置を返す
+    def collapse(self, entries):
+        seen = set()
+        kept = []
+        for n, (category, version, row) in enumerate(entries):
+            label = self.cluster_of(category, version, row)
+            if label is not None:
+                if label in seen:
+                    continue
+                seen.add(label)
+            kept.append(n)
+        return kept
+
+    # 重複候補の一覧（大きい塊から）。各行は カテゴリ・行番号・見出し
+    def report(self):
+        clusters = sorted(self.clusters.values(), key=lambda members: (-len(members), members[0]))
+        return [
+            [{'カテゴリ': c, '行': row, '見出し': self.snapshots[c].title(self.snapshots[c].records[row])}
+             for c, row in members]
+            for members in clusters
+        ]
@@ -0,0 +1,633 @@
+import bisect
+import multiprocessing
+import os
+import re
+import unicodedata
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import pykakasi
+
+# -------------------------------
+# 🌤 ふりがな変換（漢字→ひらがな）
+# -------------------------------
+kakasi = pykakasi.kakasi()
+kakasi.setMode("J", "H")  # 漢字→ひらがな
+kakasi.setMode("K", "H")  # カタカナ→ひらがな
+kakasi.setMode("H", "H")  # ひらがなはそのまま
+converter = kakasi.getConverter()
+
+# 激音・半激音を正規化（例: ば → は）
+def normalize_seion(char):
+    decomposed = unicodedata.normalize('NFD', char)
+    filtered = ''.join(c for c in decomposed if c not in ['゙', '゚'])  # 激音・半激音を除去
+    return unicodedata.normalize('NFC', filtered)
+
+# ひらがな化＋濁音正規化した読み
+def to_reading(text):
+    return ''.join(normalize_seion(c) for c in converter.do(str(text)))
+
+# 関連ワードはカンマ・読点・空白（全角含む）区切り
+def split_related_words(value):
+    return [w for w in re.split(r'[,、，\s]+', str(value).strip()) if w]
+
+
+# 空白（全角含む）を除いて小文字化
+def squash_text(text):
+    return ''.join(str(text).lower().split())
+
+# トラブル事例 1件分の照合対象（空白を除いた小文字の連結）
+def trouble_search_text(row):
+    return squash_text(f"{row.get('設備名', '')} {row.get('トラブル内容', '')} {row.get('対処', '')} {row.get('カテゴリ', '')} {row.get('現場名', '')} {row.get('詳細機器名', '')} {row.get('備考', '')}")
+
+# FAQ 1件分の読み（質問・関連ワード）
+def faq_readings(item):
+    question, related = item
+    return to_reading(question), ' '.join(to_reading(w) for w in split_related_words(related))
+
+# パト指摘事項 1件分の照合対象（原文＋ひらがな化＋関連ワードの読み）
+def patrol_search_text(row):
+    original_text = f"{row.get('設備名', '')} {row.get('指摘事項', '')} {row.get('対応', '')} {row.get('カテゴリ', '')}".lower()
+    normalized_text = to_reading(original_text)
+    related_words = [to_reading(w.strip().lower()) for w in str(row.get('関連ワード', '')).split(',') if w.strip()]
+    return original_text + " " + normalized_text + " " + " ".join(related_words)
+
+
+# -------------------------------
+# ⚙️ 行の正規化・索引構築をプロセスプールで分割実行
+# -------------------------------
+PARALLEL_MIN_ROWS = 2000  # これ未満はプロセス起動の方が高くつくので直列
+
+# 並列数は環境変数 FAQ_INDEX_WORKERS（1 で直列）。未指定なら CPU 数
+def index_workers():
+    try:
+        return max(1, int(os.getenv("FAQ_INDEX_WORKERS", "") or os.cpu_count() or 1))
+    except ValueError:
+        return 1
+
+def _chunk_ranges(n, workers):
+    size = -(-n // (workers * 4))  # 1ワーカーあたり4チャンク程度
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+def _map_chunk(args):
+    func, items = args
+    return [func(item) for item in items]
+
+# func(item) を行ごとに適用。結果の順序は入力と同じ（直列と同一の出力）
+def parallel_map(func, items, workers=None):
+    items = list(items)
+    workers = workers or index_workers()
+    if workers <= 1 or len(items) < PARALLEL_MIN_ROWS:
+        return [func(item) for item in items]
+    tasks = [(func, items[a:b]) for a, b in _chunk_ranges(len(items), workers)]
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return [out for part in pool.map(_map_chunk, tasks) for out in part]
+    except (OSError, BrokenProcessPool):
+        return [func(item) for item in items]  # プールが使えない環境では直列にフォールバック
+
+# func((開始行, チャンク)) をチャンクごとに適用し、チャンク順に結果を返す
+def parallel_chunks(func, items, workers=None):
+    items = list(items)
+    if not items:
+        return []
+    workers = workers or index_workers()
+    if workers <= 1 or len(items) < PARALLEL_MIN_ROWS:
+        return [func((0, items))]
+    tasks = [(a, items[a:b]) for a, b in _chunk_ranges(len(items), workers)]
+    try:
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            return list(pool.map(func, tasks))
+    except (OSError, BrokenProcessPool):
+        return [func((0, items))]
+
+
+# -------------------------------
+# 💡 入力候補（前方一致トライ）
+# -------------------------------
+SUGGEST_LIMIT = 10       # ノードごとに保持する候補数
+SUGGEST_MAX_DEPTH = 24   # これより長い接頭辞は打ち切り
+
+class SuggestTrie:
+    def __init__(self, limit=SUGGEST_LIMIT):
+        self.limit = limit
+        self.counts = {}  # 表示語 → 出現回数
+        self.keys = {}    # 表示語 → 検索キー（小文字の原文・読み）
+        self.terms = []   # 順位順の表示語（ノードには順位番号を保持）
+        self.root = None
+
+    def add(self, term, readings=()):
+        term = str(term).strip()
+        if not term:
+            return
+        self.counts[term] = self.counts.get(term, 0) + 1
+        keys = self.keys.setdefault(term, set())
+        keys.add(term.lower())
+        keys.update(r for r in readings if r)
+
+    # 出現回数の多い順に挿入するので、各ノードの候補リストは最初から順位付き
+    def freeze(self):
+        self.root = [{}, []]
+        self.terms = sorted(self.counts, key=lambda t: (-self.counts[t], t))
+        for rank, term in enumerate(self.terms):
+            for key in self.keys[term]:
+                node = self.root
+                for ch in key[:SUGGEST_MAX_DEPTH]:
+                    node = node[0].setdefault(ch, [{}, []])
+                    top = node[1]
+                    if len(top) < self.limit and rank not in top:
+                        top.append(rank)
+        self.keys = None
+        return self
+
+    def _walk(self, prefix):
+        node = self.root
+        for ch in prefix[:SUGGEST_MAX_DEPTH]:
+            node = node[0].get(ch)
+            if node is None:
+                return []
+        return node[1]
+
+    def lookup(self, prefix, limit=None):
+        limit = limit or self.limit
+        prefix = str(prefix).strip().lower()
+        if not prefix or self.root is None:
+            return []
+        hits = set(self._walk(prefix))
+        reading = to_reading(prefix)
+        if reading != prefix:
+            hits.update(self._walk(reading))
+        return [self.terms[rank] for rank in sorted(hits)[:limit]]
+
+    # 幅優先でノードを並べ、兄弟ノードが連続する配列形式に変換（mmap 用）
+    def flatten(self):
+        nodes, edge_chars = [self.root], [0]
+        child_start, child_len, top_start, top_ids = [], [], [0], []
+        i = 0
+        while i < len(nodes):
+            children = sorted(nodes[i][0].items())
+            child_start.append(len(nodes))
+            child_len.append(len(children))
+            for ch, child in children:
+                nodes.append(child)
+                edge_chars.append(ord(ch))
+            top_ids.extend(nodes[i][1])
+            top_start.append(len(top_ids))
+            i += 1
+        return {
+            'terms': self.terms,
+            'edge_chars': edge_chars,
+            'child_start': child_start,
+            'child_len': child_len,
+            'top_start': top_start,
+            'top_ids': top_ids,
+        }
+
+
+# flatten() の配列（mmap 上の memoryview でも可）から直接引くトライ
+class FlatSuggestTrie(SuggestTrie):
+    def __init__(self, arrays, limit=SUGGEST_LIMIT):
+        self.limit = limit
+        self.terms = arrays['terms']
+        self.edge_chars = arrays['edge_chars']
+        self.child_start = arrays['child_start']
+        self.child_len = arrays['child_len']
+        self.top_start = arrays['top_start']
+        self.top_ids = arrays['top_ids']
+        self.root = 0
+
+    def _walk(self, prefix):
+        node = 0
+        for ch in prefix[:SUGGEST_MAX_DEPTH]:
+            lo = self.child_start[node]
+            hi = lo + self.child_len[node]
+            pos = bisect.bisect_left(self.edge_chars, ord(ch), lo, hi)
+            if pos >= hi or self.edge_chars[pos] != ord(ch):
+                return []
+            node = pos
+        return self.top_ids[self.top_start[node]:self.top_start[node + 1]]
+
+
+def build_suggest_trie(faqs=None, rows=None, columns=(), related_column=None):
+    trie = SuggestTrie()
+    reading_cache = {}
+
+    def reading_of(text):
+        if text not in reading_cache:
+            reading_cache[text] = to_reading(text)
+        return reading_cache[text]
+
+    for faq in faqs or []:
+        trie.add(faq.get('質問', ''), [faq.get('読み', '')])
+        for word in split_related_words(faq.get('関連ワード', '')):
+            trie.add(word, [reading_of(word)])
+
+    for row in rows or []:
+        for col in columns:
+            value = str(row.get(col, '')).strip()
+            if value:
+                trie.add(value, [reading_of(value)])
+        if related_column:
+            for word in split_related_words(row.get(related_column, '')):
+                trie.add(word, [reading_of(word)])
+    return trie.freeze()
+
+
+# -------------------------------
+# 🔎 検索索引（文字1-gram・2-gramの転置索引＋部分一致で確認）
+# -------------------------------
+def _index_grams(text):
+    grams = set(text)
+    grams.update(text[j:j + 2] for j in range(len(text) - 1))
+    return grams
+
+# 部分索引（行番号は start からの通し番号）
+def _build_postings(args):
+    start, texts = args
+    postings = {}
+    for i, text in enumerate(texts, start):
+        for gram in _index_grams(text):
+            postings.setdefault(gram, []).append(i)
+    return postings
+
+class SearchIndex:
+    def __init__(self, texts, workers=None):
+        self.texts = texts
+        parts = parallel_chunks(_build_postings, texts, workers)
+        # チャンクは行番号順に並んでいるので連結するだけで直列構築と同じ結果になる
+        postings = parts[0] if parts else {}
+        for part in parts[1:]:
+            for gram, ids in part.items():
+                postings.setdefault(gram, []).extend(ids)
+        self.postings = postings
+
+    # 事前ビルド済みの照合対象・転置索引（mmap 上の列）をそのまま使う
+    @classmethod
+    def mapped(cls, texts, postings):
+        index = cls.__new__(cls)
+        index.texts = texts
+        index.postings = postings
+        return index
+
+    def _candidates(self, keyword):
+        if len(keyword) == 1:
+            return self.postings.get(keyword, [])
+        lists = []
+        for j in range(len(keyword) - 1):
+            ids = self.postings.get(keyword[j:j + 2])
+            if not ids:
+                return []
+            lists.append(ids)
+        lists.sort(key=len)
+        result = set(lists[0])
+        for ids in lists[1:]:
+            result.intersection_update(ids)
+            if not result:
+                break
+        return result
+
+    def match(self, keyword):
+        return {i for i in self._candidates(keyword) if keyword in self.texts[i]}
+
+    # keywords: キーワードごとの表記候補（原文・読み）のリスト
+    # extra: キーワードごとに追加でヒット扱いにする行番号（同義語展開の結果など）
+    def search(self, keywords, search_mode='AND', extra=None):
+        if not keywords:
+            return list(range(len(self.texts))) if search_mode == 'AND' else []
+        hits = None
+        for n, variants in enumerate(keywords):
+            ids = set(extra[n]) if extra else set()
+            for variant in variants:
+                if variant:
+                    ids |= self.match(variant)
+            if search_mode == 'AND':
+                hits = ids if hits is None else hits & ids
+                if not hits:
+                    return []
+            else:
+                hits = ids if hits is None else hits | ids
+        return sorted(hits)
+
+
+# 検索語ごとに「原文（小文字）」と「読み」の2通りで照合する
+def query_variants(keywords):
+    variants = []
+    for k in keywords:
+        k = k.lower()
+        reading = to_reading(k).lower()
+        variants.append((k,) if reading == k else (k, reading))
+    return variants
+
+# FAQ 1件分の照合対象（原文＋質問・関連ワードの読み）
+def faq_search_text(faq):
+    original = f"{str(faq.get('質問', '')).lower()} {str(faq.get('関連ワード', '')).lower()}"
+    readings = f"{faq.get('読み', '')}\n{faq.get('関連読み', '')}".lower()
+    return f"{original}\n{readings}"
+
+def build_faq_search_index(faqs, workers=None):
+    return SearchIndex([faq_search_text(faq) for faq in faqs], workers)
+
+
+# -------------------------------
+# 🖍 一致位置（照合対象の文字 → 表示する列の文字）
+# -------------------------------
+# 照合対象（*_search_text）の1文字ごとに「どの列の何文字目から来たか」を並べ、
+# 照合対象の中で見つかった位置を列の中の位置に戻す。読みの部分は kakasi.convert() の区切り
+# （漢字の語 → 読み）ごとに元の語全体へ戻す（読みと同じ長さの区切りは1文字ずつ）。
+# *_match_origins(行, 索引の照合対象) は組み立て直した文字列が照合対象と一致したときだけ位置を返す
+# （照合対象の組み立てを変えるときは、ここの並べ方も揃える。合わなければ強調しないだけ）
+MAX_SPANS = 20  # 1語あたりに拾う一致の数
+
+def reading_origins(text):
+    reading, origins, pos = [], [], 0
+    for segment in kakasi.convert(text):
+        orig = segment['orig']
+        hira = to_reading(orig)  # 区切りは convert()、読みは索引と同じ変換（長音の扱いが違うため）
+        if len(orig) == len(hira):
+            origins.extend((pos + j, pos + j + 1) for j in range(len(orig)))
+        else:
+            origins.extend([(pos, pos + len(orig))] * len(hira))
+        reading.append(hira)
+        pos += len(orig)
+    return ''.join(reading), origins
+
+class TextOrigins:
+    def __init__(self):
+        self.text = []
+        self.origins = []
+
+    def add(self, piece, origins):
+        self.text.append(piece)
+        self.origins.extend(origins)
+
+    def sep(self, piece):
+        self.add(piece, [None] * len(piece))
+
+    # 列の値そのもの（小文字化で長さが変わる文字があるときは位置を持たない）
+    def column(self, column, value, lower=True):
+        value = str(value)
+        piece = value.lower() if lower else value
+        if len(piece) != len(value):
+            return self.sep(piece)
+        self.add(piece, [(column, j, j + 1) for j in range(len(piece))])
+
+    # 列の値の読み。offsets は読みの1文字ごとの (開始, 終了)、base は値の中での位置
+    def reading(self, column, value, base=0):
+        reading, offsets = reading_origins(value)
+        self.add(reading.lower(), [(column, base + a, base + b) for a, b in offsets])
+
+    def result(self, expected):
+        return self.origins if ''.join(self.text) == expected else None
+
+def faq_match_origins(faq, text):
+    question, related = str(faq.get('質問', '')), str(faq.get('関連ワード', ''))
+    t = TextOrigins()
+    t.column('質問', question)
+    t.sep(' ')
+    t.column('関連ワード', related)
+    t.sep('\n')
+    t.reading('質問', question)
+    t.sep('\n')
+    for n, m in enumerate(re.finditer(r'[^,、，\s]+', related)):
+        if n:
+            t.sep(' ')
+        t.reading('関連ワード', m.group(), m.start())
+    return t.result(text)
+
+# 列を空白でつないだ文字列の中の位置 → 列の中の位置
+def _joined_origins(row, columns):
+    origins = []
+    for n, column in enumerate(columns):
+        if n:
+            origins.append(None)
+        origins.extend((column, j, j + 1) for j in range(len(str(row.get(column, '')))))
+    return origins
+
+PATROL_TEXT_COLUMNS = ['設備名', '指摘事項', '対応', 'カテゴリ']
+TROUBLE_TEXT_COLUMNS = ['設備名', 'トラブル内容', '対処', 'カテゴリ', '現場名', '詳細機器名', '備考']
+
+def patrol_match_origins(row, text):
+    joined = ' '.join(str(row.get(c, '')) for c in PATROL_TEXT_COLUMNS)
+    if len(joined.lower()) != len(joined):
+        return None
+    joined_origins = _joined_origins(row, PATROL_TEXT_COLUMNS)
+    t = TextOrigins()
+    t.add(joined.lower(), joined_origins)
+    t.sep(' ')
+    reading, offsets = reading_origins(joined.lower())
+    t.add(reading, [joined_origins[a] if b - a == 1 else _span_origin(joined_origins, a, b) for a, b in offsets])
+    t.sep(' ')
+    related = str(row.get('関連ワード', ''))
+    pos = 0
+    for n, word in enumerate(w for w in related.split(',') if w.strip()):
+        start = related.index(word, pos)
+        pos = start + len(word)
+        if n:
+            t.sep(' ')
+        stripped = word.strip()
+        lowered = stripped.lower()
+        if len(lowered) != len(stripped):
+            t.sep(to_reading(lowered))
+            continue
+        t.reading('関連ワード', lowered, start + len(word) - len(word.lstrip()))
+    return t.result(text)
+
+# 読みの1文字が元の複数文字（漢字の語）から来たときは、同じ列の範囲にまとめる
+def _span_origin(origins, a, b):
+    inside = [o for o in origins[a:b] if o is not None]
+    if not inside or any(o[0] != inside[0][0] for o in inside):
+        return None
+    return (inside[0][0], inside[0][1], inside[-1][2])
+
+def trouble_match_origins(row, text):
+    joined = ' '.join(str(row.get(c, '')) for c in TROUBLE_TEXT_COLUMNS)
+    lowered = joined.lower()
+    if len(lowered) != len(joined):
+        return None
+    joined_origins = _joined_origins(row, TROUBLE_TEXT_COLUMNS)
+    t = TextOrigins()
+    for c, origin in zip(lowered, joined_origins):
+        if not c.isspace():
+            t.add(c, [origin])
+    return t.result(text)
+
+MATCH_ORIGINS = {
+    "faq": faq_match_origins,
+    "patrol": patrol_match_origins,
+    "trouble": trouble_match_origins,
+}
+
+# 照合対象の中で keywords（キーワードごとの表記候補。query_variants と同じ形）が見つかった位置を
+# 列ごとの [(開始, 終了)] にする。同じキーワードの読みでの一致は、原文での一致と重なれば捨てる
+# （「安全」が原文で見つかれば、読みで当たった「安全弁」全体は強調しない）
+def match_spans(text, origins, keywords):
+    if origins is None:
+        return {}
+    spans = {}
+    for variants in keywords:
+        found = {}
+        for term in variants:
+            if not term:
+                continue
+            ranges = {}
+            start = text.find(term)
+            count = 0
+            while start != -1 and count < MAX_SPANS:
+                inside = [o for o in origins[start:start + len(term)] if o is not None]
+                for column in {o[0] for o in inside}:
+                    cells = [o for o in inside if o[0] == column]
+                    ranges.setdefault(column, []).append((min(o[1] for o in cells), max(o[2] for o in cells)))
+                count += 1
+                start = text.find(term, start + 1)
+            for column, rs in ranges.items():
+                earlier = found.get(column, [])
+                kept = [r for r in rs if not any(r[0] < e and s < r[1] for s, e in earlier)]
+                found[column] = earlier + kept
+        for column, rs in found.items():
+            spans.setdefault(column, []).extend(rs)
+    return {column: _merge_spans(ranges) for column, ranges in spans.items()}
+
+def _merge_spans(ranges):
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+# 索引を持たない長文向け：行ごとの照合対象を順に確認
+# -------------------------------
+# 🔦 複数キーワードの一括照合（索引を持たない長文の列向け）
+# -------------------------------
+# ・クエリごとにキーワードを重複除去し、他のキーワードに含まれる語は出力リンクでまとめる
+#   （"安全弁" が見つかれば "安全" も見つかったことにする＝Aho–Corasick の出力関数と同じ考え方）
+# ・1行ごとに見つかったキーワードをビットマスクにし、AND / OR はそのマスクだけで判定する
+# ・文字ごとの状態遷移を Python で回すと str の部分文字列検索（C 実装）より桁違いに遅いので、
+#   照合そのものは str に任せ、長い語から順に調べて AND は最初の不一致で打ち切る
+class KeywordMatcher:
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        self.terms = sorted(set(self.keywords), key=len, reverse=True)
+        self.bits = {t: 1 << j for j, t in enumerate(self.terms)}
+        # 語 → その語が見つかれば同時に見つかる語（自身を含む）のマスク
+        self.implied = {t: sum(self.bits[u] for u in self.terms if u in t) for t in self.terms}
+        self.full = (1 << len(self.terms)) - 1
+
+    # need のキーワードを調べ、見つかったもののマスクを返す（first=True は1つ見つかれば終了）
+    def scan(self, text, need=None, first=False):
+        need = self.full if need is None else need
+        found = 0
+        for t in self.terms:
+            bit = self.bits[t]
+            if not need & bit or found & bit:
+                continue
+            if t in text:
+                found |= self.implied[t]
+                if first:
+                    break
+            elif not first:
+                break
+        return found
+
+    def matched_keywords(self, text):
+        found = 0
+        for t in self.terms:
+            if not found & self.bits[t] and t in text:
+                found |= self.implied[t]
+        return [k for k in self.keywords if found & self.bits[k]]
+
+    # extra はキーワードごとの「同義語展開で一致とみなす行番号」
+    def search(self, texts, search_mode='AND', extra=None):
+        # 同じ語が複数回あるときは、AND ならすべての展開、OR ならいずれかの展開に含まれる行だけ
+        term_ids = {}
+        for k, ids in zip(self.keywords, extra or []):
+            if k not in term_ids:
+                term_ids[k] = set(ids)
+            elif search_mode == 'AND':
+                term_ids[k] &= set(ids)
+            else:
+                term_ids[k] |= set(ids)
+        given = {}
+        for k, ids in term_ids.items():
+            for i in ids:
+                given[i] = given.get(i, 0) | self.bits[k]
+        hits = []
+        for i, text in enumerate(texts):
+            if search_mode == 'AND':
+                need = self.full & ~given.get(i, 0)
+                if not need or self.scan(text, need) & need == need:
+                    hits.append(i)
+            elif i in given or self.scan(text, first=True):
+                hits.append(i)
+        return hits
+
+
+# -------------------------------
+# 📚 関連ワードの同義語辞書（語 → 代表概念 → 行番号）
+# -------------------------------
+# ・FAQ は「質問」と関連ワードを同じ概念とみなし、同じ質問の行どうしはまとめる
+# ・パト指摘事項の関連ワードは行ごとの概念（設備名とは結びつけない）
+# ・トラブル事例は関連ワードが無いので、設備名・詳細機器名で引かれる側だけ
+# 語はすべて読み（ひらがな・濁音正規化）に揃えるので、バルブ／ばるぶ は同じ語になる
+SYNONYM_MAX_ROWS = 200  # これより多くの行に出てくる語は一般語とみなして展開に使わない
+SYNONYM_SEP = '\t'
+
+def term_key(term):
+    return to_reading(str(term).strip().lower())
+
+class SynonymDictionary:
+    def __init__(self, snapshots):
+        self.versions = {}
+        term_rows = {}      # 語 → {カテゴリ: 行番号の集合}
+        concept_terms = {}  # 概念 → 語の集合
+        for category, snapshot in snapshots.items():
+            if snapshot.synonym_concepts is None:
+                continue
+            self.versions[category] = snapshot.version
+            for i, (concept, targets) in enumerate(zip(snapshot.synonym_concepts, snapshot.synonym_targets)):
+                for key in targets.split(SYNONYM_SEP):
+                    if key:
+                        term_rows.setdefault(key, {}).setdefault(category, set()).add(i)
+                terms = concept.split(SYNONYM_SEP)
+                if len([t for t in terms if t]) < 2:
+                    continue
+                concept_id = terms[0] or (category, i)
+                concept_terms.setdefault(concept_id, set()).update(t for t in terms if t)
+
+        term_concepts = {}
+        for concept_id, terms in concept_terms.items():
+            for key in terms:
+                term_concepts.setdefault(key, set()).add(concept_id)
+
+        # 語ごとに展開後の行番号まで前計算しておき、検索時は1回引くだけにする
+        self.postings = {}
+        self.expanders = {}  # 引かれる側の語 → その語へ展開される語（行の追加を反映するため）
+        for key, concepts in term_concepts.items():
+            merged = {}
+            for concept_id in concepts:
+                for term in concept_terms[concept_id]:
+                    rows = term_rows.get(term, {})
+                    if sum(len(ids) for ids in rows.values()) > SYNONYM_MAX_ROWS:
+                        continue
+                    self.expanders.setdefault(term, set()).add(key)
+                    for category, ids in rows.items():
+                        merged.setdefault(category, set()).update(ids)
+            self.postings[key] = {category: sorted(ids) for category, ids in merged.items()}
+        self.synonyms = {key: sorted(set().union(*(concept_terms[c] for c in concepts)) - {key})
+                         for key, concepts in term_concepts.items()}
+
+    # 追加された行（引かれる側の語だけを持つ行）を展開先に足す。概念を増やす行は作り直しで扱う
+    def add_rows(self, category, version, start, targets):
+        for offset, joined in enumerate(targets):
+            i = start + offset
+            for term in joined.split(SYNONYM_SEP):
+                for key in self.expanders.get(term, ()):
+                    ids = self.postings[key].setdefault(category, [])
+                    if not ids or ids[-1] != i:
+                        ids.append(i)
+        self.versions[category] = version
+
+    def expand(self, keyword, category):
+        return self.postings.get(term_key(keyword), {}).get(category, [])
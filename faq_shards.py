@@ -0,0 +1,417 @@
+import argparse
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import weakref
+from itertools import count
+from multiprocessing.connection import Connection
+
+import numpy as np
+
+from faq_index import KeywordMatcher, SearchIndex, query_variants
+
+# -------------------------------
+# 🧩 検索索引のシャード分割（大きなカテゴリを行範囲で分け、ワーカープロセスで並行に照合）
+# -------------------------------
+# ・パト指摘事項・トラブル事例の照合対象を連続した行範囲（シャード）に分け、
+#   シャードごとに1つのワーカープロセスが索引を持ち続ける（検索のたびに送り直さない）
+# ・検索は全シャードへ同時に送り、各シャードの行番号（昇順）を範囲の順に連結する
+#   → 1つの索引で検索したときと同じ並び・同じ件数になり、ページ送りもそのまま使える
+# ・差分で追加した行（トラブル事例の登録）は末尾の行としてアプリのプロセス側で照合する
+# ・ワーカーが落ちた・応答しないときは ShardError を出し、呼び出し側は手元の索引で検索し直す
+# シャード数は環境変数 FAQ_SEARCH_SHARDS（0 / 1 で分割しない）。未指定なら CPU 数。
+# 行数が FAQ_SHARD_MIN_ROWS 未満のカテゴリは分割しない（プロセス間の受け渡しの方が高くつく）
+SHARD_MIN_ROWS = 50000
+SHARD_TIMEOUT = 30  # 1回の検索でワーカーの応答を待つ秒数
+
+# ワーカーは multiprocessing の spawn ではなく、このモジュールだけを読み込む子プロセスで起動する
+# （spawn は __main__ を読み直すので、streamlit 上ではアプリのスクリプト全体が子プロセスで動いてしまう）
+WORKER_CODE = "import sys; sys.path.insert(0, sys.argv[1]); import faq_shards; faq_shards._serve(int(sys.argv[2]))"
+
+
+class ShardError(Exception):
+    pass
+
+
+def shard_count():
+    try:
+        return max(1, int(os.getenv("FAQ_SEARCH_SHARDS", "") or os.cpu_count() or 1))
+    except ValueError:
+        return 1
+
+
+def shard_min_rows():
+    try:
+        return int(os.getenv("FAQ_SHARD_MIN_ROWS", "") or SHARD_MIN_ROWS)
+    except ValueError:
+        return SHARD_MIN_ROWS
+
+
+def _shard_ranges(n, shards):
+    size = -(-n // shards)
+    return [(start, min(start + size, n)) for start in range(0, n, size)]
+
+
+# -------------------------------
+# 🔎 シャード1つ分の照合（パト指摘事項は転置索引、トラブル事例は全件走査）
+# -------------------------------
+class ScanIndex:
+    def __init__(self, texts):
+        self.texts = texts
+
+    def search(self, keywords, search_mode='AND', extra=None):
+        return KeywordMatcher(keywords).search(self.texts, search_mode, extra)
+
+
+SHARD_ENGINES = {
+    "index": lambda texts: SearchIndex(texts, workers=1),
+    "scan": ScanIndex,
+}
+
+
+def _serve(fd):
+    _shard_worker(Connection(fd))
+
+
+# ワーカープロセスの本体（シャードのキー → 照合用の索引）
+def _shard_worker(conn):
+    shards = {}
+    while True:
+        try:
+            message = conn.recv()
+        except (EOFError, OSError):
+            return
+        op = message[0]
+        if op == "stop":
+            return
+        if op == "drop":
+            shards.pop(message[1], None)
+            continue
+        try:
+            if op == "load":
+                _, key, engine, texts = message
+                shards[key] = SHARD_ENGINES[engine](texts)
+                reply = len(texts)
+            else:  # search: [(キー, キーワード, AND/OR, シャード内の行番号にした extra)]
+                reply = [np.asarray(shards[key].search(keywords, mode, extra), dtype=np.int64)
+                         for key, keywords, mode, extra in message[1]]
+            conn.send(("ok", reply))
+        except Exception as e:
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+# -------------------------------
+# 🏭 ワーカープロセスの組（アプリ全体で1つ。初回の読み込みで起動する）
+# -------------------------------
+class ShardPool:
+    def __init__(self, workers):
+        self.workers = workers
+        self.lock = threading.Lock()
+        self.generation = 0       # 起動し直すたびに増やす（古い世代のシャードは使わない）
+        self.broken = False       # 通信に失敗した（次の読み込みで起動し直す）
+        self.processes = []
+        self.conns = []
+        self.conn_locks = []
+        self.rows = []            # ワーカーごとに持たせた行数
+        self.keys = count()
+        self.counters = {'queries': 0, 'loads': 0, 'restarts': 0, 'failures': 0}
+        self.last_error = None
+
+    def _start(self):
+        self.processes, self.conns = [], []
+        here = os.path.dirname(os.path.abspath(__file__))
+        try:
+            for _ in range(self.workers):
+                parent, child = socket.socketpair()
+                with child:
+                    process = subprocess.Popen([sys.executable, "-c", WORKER_CODE, here, str(child.fileno())],
+                                               pass_fds=(child.fileno(),))
+                self.processes.append(process)
+                self.conns.append(Connection(parent.detach()))
+        except (OSError, ValueError) as e:  # 子プロセスを作れない環境では分割しない
+            self._stop()
+            raise ShardError(f"ワーカーを起動できません: {e}") from e
+        self.conn_locks = [threading.Lock() for _ in self.conns]
+        self.rows = [0] * self.workers
+        self.generation += 1
+        self.broken = False
+
+    def _stop(self):
+        for conn in self.conns:
+            try:
+                conn.send(("stop",))
+                conn.close()
+            except OSError:
+                pass
+        for process in self.processes:
+            try:
+                process.wait(1)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        self.processes, self.conns = [], []
+
+    def _alive(self):
+        return bool(self.processes) and all(p.poll() is None for p in self.processes)
+
+    def _fail(self, generation, error):
+        with self.lock:
+            self.counters['failures'] += 1
+            self.last_error = error
+            if generation == self.generation:
+                self.broken = True
+        raise ShardError(error)
+
+    def _recv(self, conn, w, generation):
+        try:
+            if not conn.poll(SHARD_TIMEOUT):
+                self._fail(generation, f"シャードのワーカー {w} が {SHARD_TIMEOUT}秒 応答しません")
+            status, reply = conn.recv()
+        except (EOFError, OSError) as e:
+            self._fail(generation, f"シャードのワーカー {w} との通信が切れました: {e}")
+        if status != "ok":
+            raise ShardError(reply)
+        return reply
+
+    # texts を行範囲で分けて各ワーカーに持たせ、ShardSet を返す
+    def load(self, engine, texts, shards):
+        with self.lock:
+            if self.broken or not self._alive():
+                if self.processes:
+                    self.counters['restarts'] += 1
+                    self._stop()
+                self._start()
+            generation, conns, conn_locks = self.generation, self.conns, self.conn_locks
+            ranges = _shard_ranges(len(texts), shards)
+            order = sorted(range(self.workers), key=lambda w: self.rows[w])
+            placed = [(order[n % self.workers], next(self.keys), a, b) for n, (a, b) in enumerate(ranges)]
+            for w, _, a, b in placed:
+                self.rows[w] += b - a
+            self.counters['loads'] += 1
+        for w, key, a, b in placed:
+            with conn_locks[w]:
+                try:
+                    conns[w].send(("load", key, engine, [texts[i] for i in range(a, b)]))
+                except OSError as e:
+                    self._fail(generation, f"シャードのワーカー {w} に送れません: {e}")
+                self._recv(conns[w], w, generation)
+        return ShardSet(self, generation, placed)
+
+    def drop(self, generation, placed):
+        with self.lock:
+            if generation != self.generation or self.broken:
+                return
+            for w, _, a, b in placed:
+                self.rows[w] -= b - a
+            conns, conn_locks = self.conns, self.conn_locks
+        for w, key, _, _ in placed:
+            with conn_locks[w]:
+                try:
+                    conns[w].send(("drop", key))
+                except OSError:
+                    pass
+
+    # シャードごとの検索を同時に送り、範囲の順に結果を返す
+    # 複数の検索が同時に来てもワーカーの順にロックを取るので、送受信の組が入れ違わない
+    def search(self, generation, tasks):
+        with self.lock:
+            if generation != self.generation or self.broken:
+                raise ShardError(self.last_error or "シャードのワーカーが起動し直されました")
+            conns, conn_locks = self.conns, self.conn_locks
+        by_worker = {}
+        for n, (w, key, keywords, mode, extra) in enumerate(tasks):
+            by_worker.setdefault(w, []).append((n, (key, keywords, mode, extra)))
+        workers = sorted(by_worker)
+        results = [None] * len(tasks)
+        locks = [conn_locks[w] for w in workers]
+        for lock in locks:
+            lock.acquire()
+        try:
+            for w in workers:
+                try:
+                    conns[w].send(("search", [task for _, task in by_worker[w]]))
+                except OSError as e:
+                    self._fail(generation, f"シャードのワーカー {w} に送れません: {e}")
+            error = None
+            for w in workers:  # 1つが失敗しても残りの応答は読み切る（次の検索に持ち越さない）
+                try:
+                    replies = self._recv(conns[w], w, generation)
+                except ShardError as e:
+                    if self.broken:
+                        raise
+                    error = error or e
+                    continue
+                for (n, _), ids in zip(by_worker[w], replies):
+                    results[n] = ids
+        finally:
+            for lock in locks:
+                lock.release()
+        if error is not None:
+            raise error
+        with self.lock:
+            self.counters['queries'] += 1
+        return results
+
+    def close(self):
+        with self.lock:
+            self._stop()
+            self.generation += 1
+            self.broken = False
+
+    def metrics(self):
+        with self.lock:
+            return {
+                'shard_workers': self.workers,
+                'alive': sum(1 for p in self.processes if p.poll() is None),
+                'generation': self.generation,
+                'rows_per_worker': list(self.rows),
+                **self.counters,
+                'last_error': self.last_error,
+            }
+
+
+# シャード数が 2 以上のときだけ作る（1 なら今までどおり手元の索引だけで検索）
+def shard_pool_from_env():
+    shards = shard_count()
+    return ShardPool(shards) if shards > 1 else None
+
+
+# ワーカーに持たせたシャードの組。使う索引がすべて無くなったらワーカーからも捨てる
+class ShardSet:
+    def __init__(self, pool, generation, placed):
+        self.pool = pool
+        self.generation = generation
+        self.placed = placed      # [(ワーカー, キー, 開始行, 終了行)]（行の順）
+        self.rows = placed[-1][3] if placed else 0
+        weakref.finalize(self, pool.drop, generation, placed)
+
+
+def _localized(extra, a, b):
+    if extra is None:
+        return None
+    return [[i - a for i in ids if a <= i < b] for ids in extra]
+
+
+# -------------------------------
+# 🧩 シャード分割した索引（Snapshot から検索索引の代わりに使う）
+# -------------------------------
+class ShardedIndex:
+    def __init__(self, shards, engine, tail_texts=()):
+        self.shards = shards
+        self.engine = engine
+        self.tail_texts = list(tail_texts)
+        self.tail = SHARD_ENGINES[engine](self.tail_texts) if self.tail_texts else None
+
+    @classmethod
+    def build(cls, pool, engine, texts, shards):
+        return cls(pool.load(engine, texts, shards), engine)
+
+    @property
+    def rows(self):
+        return self.shards.rows + len(self.tail_texts)
+
+    # 末尾に行を足した照合対象に対する索引（ワーカーのシャードはそのまま共有する）
+    def extended(self, texts):
+        return ShardedIndex(self.shards, self.engine, [texts[i] for i in range(self.shards.rows, len(texts))])
+
+    # keywords は索引の種類に合わせた形（index は query_variants の結果、scan は語のリスト）
+    def search(self, keywords, search_mode='AND', extra=None):
+        placed = self.shards.placed
+        tasks = [(w, key, keywords, search_mode, _localized(extra, a, b)) for w, key, a, b in placed]
+        parts = [ids + a for ids, (_, _, a, _) in zip(self.shards.pool.search(self.shards.generation, tasks), placed)]
+        if self.tail is not None:
+            start = self.shards.rows
+            tail = self.tail.search(keywords, search_mode, _localized(extra, start, self.rows))
+            parts.append(np.asarray(tail, dtype=np.int64) + start)
+        return np.concatenate(parts).tolist() if parts else []
+
+
+# -------------------------------
+# 📈 シャード数ごとの計測（1 = 分割しない手元の索引）
+# -------------------------------
+# 使い方:
+#   python faq_shards.py --rows 200000 --shards 1,2,4,8
+#   python faq_shards.py --engine index --rows 50000 --repeat 10
+# ・模擬の照合対象（語をつなげた文）を作り、同じ検索語をシャード数を変えて流す
+# ・分割した結果が分割しないときと同じ行番号の並びになることも確かめる
+BENCH_WORDS = [
+    "ポンプ", "異音", "漏れ", "配管", "腐食", "交換", "点検", "バルブ", "ブレーカー", "停電", "モーター", "過熱",
+    "センサー", "誤作動", "制御盤", "警報", "振動", "ベアリング", "摩耗", "冷却水", "圧力", "低下", "送風機", "停止",
+    "電源", "断線", "タンク", "水位", "フィルター", "目詰まり", "清掃", "給水", "排水", "詰まり", "照明", "不点灯",
+    "配線", "絶縁", "不良", "再起動", "復旧", "部品", "手配", "現場", "確認", "調整", "締付け", "ゆるみ",
+]
+BENCH_QUERIES = [
+    ("漏れ", "AND"),
+    ("ポンプ 異音", "AND"),
+    ("配管 腐食 交換", "AND"),
+    ("ブレーカー 停電", "OR"),
+    ("存在しない語", "AND"),
+]
+
+
+def bench_texts(rows, seed=20240601):
+    rng = random.Random(seed)
+    return ["、".join(rng.choice(BENCH_WORDS) for _ in range(rng.randint(6, 24))).lower() for _ in range(rows)]
+
+
+def bench_keywords(engine, query):
+    words = [k for k in query.lower().split() if len(k) >= 2]
+    return query_variants(words) if engine == "index" else words
+
+
+def _bench_run(search, engine, repeat):
+    latencies, results = [], []
+    for _ in range(repeat):
+        results = []
+        for query, mode in BENCH_QUERIES:
+            start = time.perf_counter()
+            results.append(list(search(bench_keywords(engine, query), mode)))
+            latencies.append(time.perf_counter() - start)
+    return latencies, results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="シャード数ごとの検索時間を計測する")
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--shards", default="1,2,4", help="カンマ区切りのシャード数（1 は分割しない）")
+    parser.add_argument("--engine", choices=sorted(SHARD_ENGINES), default="scan",
+                        help="scan = トラブル事例（全件走査）、index = パト指摘事項（転置索引）")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+
+    texts = bench_texts(args.rows)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    print(f"行数: {args.rows}  照合: {args.engine}  使える CPU: {cpus}  検索語: {len(BENCH_QUERIES)}種 × {args.repeat}回")
+    baseline = None
+    base_p50 = None
+    for shards in [int(n) for n in args.shards.split(",") if n]:
+        pool = None
+        start = time.perf_counter()
+        if shards <= 1:
+            index = SHARD_ENGINES[args.engine](texts)
+        else:
+            pool = ShardPool(shards)
+            index = ShardedIndex.build(pool, args.engine, texts, shards)
+        load_sec = time.perf_counter() - start
+        try:
+            _bench_run(index.search, args.engine, 1)  # 初回（ワーカーの温まり）は数えない
+            latencies, results = _bench_run(index.search, args.engine, args.repeat)
+        finally:
+            if pool is not None:
+                pool.close()
+        if baseline is None:
+            baseline = results
+        same = "同じ" if results == baseline else "⚠️ 不一致"
+        latencies.sort()
+        p50 = statistics.median(latencies) * 1000
+        base_p50 = base_p50 or p50
+        print(f"- シャード {shards}: 準備 {load_sec:.2f}s  p50 {p50:.1f}ms  最大 {latencies[-1] * 1000:.1f}ms"
+              f"  速度比 {base_p50 / p50:.2f}x  結果: {same}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+import copy
+import unicodedata
+
+import numpy as np
+from scipy import sparse
+
+from faq_index import parallel_chunks
+
+# -------------------------------
+# 🧭 類似検索（文字 n-gram の TF-IDF ベクトル＋コサイン類似度）
+# -------------------------------
+# ・言い回しの違う質問（"足場の点検頻度は？" と「足場は何日ごとに点検しますか」など）を、
+#   共通する文字 2-gram / 3-gram の重なりで順位付けする（外部モデル・ダウンロード不要）
+# ・文字は NFKC で全角・半角をそろえて小文字化し、空白は除く
+# ・n-gram は文字コード（21ビット）を並べた int64 のキーにして NumPy でまとめて数える
+#   （語彙の辞書を Python で回さない）。語彙はキーを並べた配列で、検索語は二分探索で引く
+# ・行列は「語 × 行」の CSR（L2 正規化済み）で持ち、クエリは疎ベクトルとの積1回＋上位 k 件
+NGRAM_SIZES = (2, 3)
+CODE_BITS = 21  # Unicode のコードポイントは 21 ビットに収まる
+DOC_SEP = "\0"     # 行の区切り（n-gram はまたがない）
+FIELD_SEP = "\x01"  # 列の区切り（同じ行のまま、n-gram はまたがない）
+
+
+def normalize_for_similarity(text):
+    text = unicodedata.normalize('NFKC', str(text)).lower()
+    return "".join(text.split()).replace(DOC_SEP, "").replace(FIELD_SEP, "")
+
+
+def document_text(fields):
+    return FIELD_SEP.join(normalize_for_similarity(f) for f in fields)
+
+
+BLOCK_ROWS = 4096  # この行数ずつ数える（大きな一時配列を作らない）
+
+
+# 行の並び → (n-gram のキー, 行番号)。1文字だけの行は 1-gram で代用する
+def gram_keys(texts, sizes=NGRAM_SIZES):
+    joined = DOC_SEP.join(texts) + DOC_SEP
+    codes = np.frombuffer(joined.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    is_sep = codes == 0
+    doc_of = np.cumsum(is_sep) - is_sep
+    usable = codes > 1
+    keys, docs = [], []
+    for n in sizes:
+        length = len(codes) - n + 1
+        if length <= 0:
+            continue
+        key = codes[:length].copy()
+        valid = usable[:length].copy()
+        for j in range(1, n):
+            key = (key << CODE_BITS) | codes[j:j + length]
+            valid &= usable[j:j + length]
+        keys.append(key[valid])
+        docs.append(doc_of[:length][valid])
+    # 短すぎて n-gram が1つも取れない行（"弁" など）は文字そのものを語にする
+    found = np.bincount(np.concatenate(docs), minlength=len(texts)) if docs else np.zeros(len(texts), int)
+    short = np.flatnonzero(found == 0)
+    if len(short):
+        single = usable & np.isin(doc_of, short)
+        keys.append(codes[single])
+        docs.append(doc_of[single])
+    if not keys:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64)
+    return np.concatenate(keys), np.concatenate(docs)
+
+
+# 行のまとまり → (出てきたキーの昇順配列, 行 × キーの出現回数)
+def _count_block(texts):
+    keys, docs = gram_keys(texts)
+    terms, term_ids = np.unique(keys, return_inverse=True)
+    counts = sparse.csr_matrix(
+        (np.ones(len(term_ids), np.float32), (docs, term_ids)),
+        shape=(len(texts), len(terms)),
+    )
+    counts.sum_duplicates()
+    return terms, counts
+
+def _count_grams(args):
+    start, texts = args
+    return [_count_block(texts[a:a + BLOCK_ROWS]) for a in range(0, len(texts), BLOCK_ROWS)]
+
+
+def _l2_normalize_rows(matrix):
+    norms = np.sqrt(np.asarray(matrix.multiply(matrix).sum(axis=1)).ravel())
+    norms[norms == 0] = 1.0
+    return sparse.diags(1.0 / norms).dot(matrix).tocsr()
+
+
+class TfidfIndex:
+    def __init__(self, texts, workers=None):
+        texts = list(texts)
+        self.texts = texts
+        self.size = len(texts)
+        blocks = [block for part in parallel_chunks(_count_grams, texts, workers) for block in part]
+        self.vocab = np.unique(np.concatenate([terms for terms, _ in blocks])) if blocks else np.zeros(0, np.int64)
+        counts = self._stack(blocks)
+        df = np.bincount(counts.indices, minlength=len(self.vocab))
+        self.idf = (np.log((1 + self.size) / (1 + df)) + 1).astype(np.float32)
+        # 語 × 行（クエリに含まれる語の行だけを触るので、行数が多くても積は速い）
+        self.term_docs = self._weight(counts).T.tocsr()
+
+    # まとまりごとのキー番号を語彙全体の番号に付け替えて縦に連結（語彙に無いキーは捨てる）
+    def _stack(self, blocks):
+        parts = []
+        for terms, counts in blocks:
+            pos = np.searchsorted(self.vocab, terms)
+            pos[pos == len(self.vocab)] = 0
+            known = self.vocab[pos] == terms if len(self.vocab) else np.zeros(len(terms), bool)
+            if not known.all():
+                counts = counts[:, np.flatnonzero(known)]
+                pos = pos[known]
+            parts.append(sparse.csr_matrix(
+                (counts.data, pos[counts.indices], counts.indptr),
+                shape=(counts.shape[0], len(self.vocab)),
+            ))
+        if not parts:
+            return sparse.csr_matrix((0, len(self.vocab)), dtype=np.float32)
+        return sparse.vstack(parts, format='csr')
+
+    def _weight(self, counts):
+        counts.data = (1 + np.log(counts.data)) * self.idf[counts.indices]  # tf は対数で抑える
+        return _l2_normalize_rows(counts).astype(np.float32)
+
+    # 行と同じ語彙・重みでベクトル化（語彙に無い n-gram は捨てる）
+    def transform(self, texts):
+        texts = list(texts)
+        blocks = [_count_block(texts[a:a + BLOCK_ROWS]) for a in range(0, len(texts), BLOCK_ROWS)]
+        return self._weight(self._stack(blocks))
+
+    # 類似度の高い順に (行番号, 類似度)。同点は行番号順
+    def query(self, text, k=20, min_score=0.0):
+        vector = self.transform([normalize_for_similarity(text)])
+        if vector.nnz == 0 or self.size == 0:
+            return []
+        scores = (vector @ self.term_docs).tocsr()
+        rows, values = scores.indices, scores.data
+        keep = values > min_score
+        rows, values = rows[keep], values[keep]
+        if len(rows) > k:
+            top = np.argpartition(-values, k - 1)[:k]
+            rows, values = rows[top], values[top]
+        order = np.lexsort((rows, -values))
+        return [(int(rows[i]), float(values[i])) for i in order]
+
+    # 行 × 語（行どうしの類似度を求めるとき用）
+    def doc_vectors(self):
+        return self.term_docs.T.tocsr()
+
+
+# FAQ 1件分の照合対象（質問・回答・関連ワード）
+def faq_similarity_text(faq):
+    return document_text((faq.get('質問', ''), faq.get('回答', ''), faq.get('関連ワード', '')))
+
+
+def build_faq_similarity_index(faqs, workers=None):
+    return TfidfIndex([faq_similarity_text(faq) for faq in faqs], workers)
+
+
+# -------------------------------
+# 🔗 関連 FAQ（行ごとの近傍 k 件をスナップショットごとに前計算）
+# -------------------------------
+# ・カテゴリの組ごとに「元の行 → 先のカテゴリで似ている上位 k 行」を配列（行数 × k）で持つ
+#   （他カテゴリの行は元カテゴリの語彙・重みでベクトル化して比べる）
+# ・あるカテゴリが読み直されたら、そのカテゴリが関わる組だけを計算し直す（他の組はそのまま）
+# ・更新は新しい表を作って参照を差し替える。表示は行を引くだけで計算しない
+RELATED_LIMIT = 5
+NEIGHBOR_BLOCK_CELLS = 4_000_000  # 類似度を一度に密行列にするマス数（行 × 列）
+NEIGHBOR_EXACT_CELLS = 10_000_000  # 行数 × 行数がこれ以下なら全語で比べる
+NEIGHBOR_TERMS = 96  # それより大きいときは、候補探しを元の行の重みの大きい語だけで行う
+NEIGHBOR_CANDIDATES = 4  # 正確に計算し直す候補は k の何倍か
+
+
+# 行ごとに重みの大きい keep 語だけを残す
+def prune_rows(matrix, keep):
+    matrix = matrix.tocsr()
+    row_of = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((-matrix.data, row_of))
+    rank = np.arange(len(order)) - matrix.indptr[row_of[order]]
+    kept = np.sort(order[rank < keep])
+    counts = np.bincount(row_of[kept], minlength=matrix.shape[0])
+    indptr = np.concatenate(([0], np.cumsum(counts)))
+    return sparse.csr_matrix((matrix.data[kept], matrix.indices[kept], indptr), shape=matrix.shape)
+
+
+# left の各行について right の上位 k 行 → (行番号 n×k, 類似度 n×k)。足りない分は -1
+# 行数が多いときは重みの大きい語だけの近似で候補を k × NEIGHBOR_CANDIDATES 件に絞り、
+# 候補だけ正確なコサインで並べ直す（どの行にもある語で積が密になり、行数の2乗で遅くなるのを避ける）
+def top_neighbors(left, right, k, exclude_self=False):
+    n, m = left.shape[0], right.shape[0]
+    ids = np.full((n, k), -1, np.int32)
+    scores = np.zeros((n, k), np.float32)
+    kk = min(k, m)
+    if n == 0 or kk == 0:
+        return ids, scores
+    pool = min(m, k * NEIGHBOR_CANDIDATES)
+    pruned = left if n * m <= NEIGHBOR_EXACT_CELLS else prune_rows(left, NEIGHBOR_TERMS)
+    right_t = right.T.tocsr()
+    step = max(1, NEIGHBOR_BLOCK_CELLS // m)
+    for a in range(0, n, step):
+        b = min(a + step, n)
+        block = (pruned[a:b] @ right_t).toarray()
+        if exclude_self:
+            block[np.arange(b - a), np.arange(a, b)] = -1
+        cand = np.argpartition(-block, pool - 1, axis=1)[:, :pool]
+        live = np.take_along_axis(block, cand, axis=1) > 0
+        rows = np.repeat(np.arange(a, b), pool)
+        exact = np.asarray(left[rows].multiply(right[cand.ravel()]).sum(axis=1)).reshape(b - a, pool)
+        exact = np.where(live, exact, 0)
+        order = np.lexsort((cand, -exact))[:, :kk]  # 似ている順、同点は行番号順
+        top = np.take_along_axis(cand, order, axis=1)
+        top_scores = np.take_along_axis(exact, order, axis=1)
+        ids[a:b, :kk] = np.where(top_scores > 0, top, -1)
+        scores[a:b, :kk] = np.maximum(top_scores, 0)
+    return ids, scores
+
+
+def faq_key(faq):
+    return (str(faq.get('質問', '')).strip(), str(faq.get('回答', '')).strip())
+
+
+class RelatedFaqTable:
+    def __init__(self, k=RELATED_LIMIT):
+        self.k = k
+        self.snapshots = {}  # カテゴリ → 計算に使った Snapshot（表の行番号はこの版のもの）
+        self.rows = {}       # カテゴリ → {(質問, 回答): 行番号}
+        self.pairs = {}      # (元カテゴリ, 先カテゴリ) → (行番号 n×k, 類似度 n×k)
+        self.across = {}     # カテゴリ → 他カテゴリ分をまとめた上位 k（先カテゴリ, 行番号, 類似度）
+
+    @property
+    def versions(self):
+        return {category: snapshot.version for category, snapshot in self.snapshots.items()}
+
+    # category を snapshot に差し替えた新しい表を返す（自分は変えない）
+    def updated(self, category, snapshot):
+        table = copy.copy(self)
+        table.snapshots = dict(self.snapshots)
+        table.rows = dict(self.rows)
+        table.pairs = {pair: value for pair, value in self.pairs.items() if category not in pair}
+        table.snapshots[category] = snapshot
+        rows = {}
+        for i, faq in enumerate(snapshot.faqs):
+            rows.setdefault(faq_key(faq), i)
+        table.rows[category] = rows
+
+        index = snapshot.similarity
+        vectors = index.doc_vectors()
+        table.pairs[(category, category)] = top_neighbors(vectors, vectors, self.k, exclude_self=True)
+        for other, other_snapshot in table.snapshots.items():
+            if other == category:
+                continue
+            other_index = other_snapshot.similarity
+            table.pairs[(category, other)] = top_neighbors(vectors, index.transform(other_index.texts), self.k)
+            table.pairs[(other, category)] = top_neighbors(
+                other_index.doc_vectors(), other_index.transform(index.texts), self.k)
+        table.across = {c: table._merge_across(c) for c in table.snapshots}
+        return table
+
+    def _merge_across(self, category):
+        others = [c for c in self.snapshots if c != category]
+        n = len(self.snapshots[category].faqs)
+        if not others:
+            return (np.zeros((n, 0), np.int8), np.zeros((n, 0), np.int32), np.zeros((n, 0), np.float32))
+        ids = np.hstack([self.pairs[(category, c)][0] for c in others])
+        scores = np.hstack([self.pairs[(category, c)][1] for c in others])
+        cats = np.repeat(np.arange(len(others), dtype=np.int8), self.k)[None, :].repeat(n, axis=0)
+        order = np.argsort(-scores, axis=1, kind='stable')[:, :self.k]
+        return (np.take_along_axis(cats, order, axis=1), np.take_along_axis(ids, order, axis=1),
+                np.take_along_axis(scores, order, axis=1))
+
+    def _entries(self, category, ids, scores):
+        faqs = self.snapshots[category].faqs
+        return [(category, faqs[int(i)], float(score)) for i, score in zip(ids, scores) if i >= 0]
+
+    # 表示中の FAQ → (同じカテゴリの関連, 他カテゴリの関連)。それぞれ (カテゴリ, FAQ, 類似度) のリスト
+    def lookup(self, category, faq):
+        i = self.rows.get(category, {}).get(faq_key(faq))
+        if i is None:
+            return [], []
+        ids, scores = self.pairs[(category, category)]
+        within = self._entries(category, ids[i], scores[i])
+        others = [c for c in self.snapshots if c != category]
+        cats, ids, scores = self.across[category]
+        across = []
+        for c, j, score in zip(cats[i], ids[i], scores[i]):
+            if j >= 0:
+                across.extend(self._entries(others[c], [j], [score]))
+        return within, across
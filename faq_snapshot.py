@@ -0,0 +1,860 @@
+import copy
+import threading
+import time
+from concurrent.futures import as_completed
+from itertools import zip_longest
+
+import numpy as np
+import pandas as pd
+
+from faq_index import (
+    SearchIndex, build_suggest_trie, build_faq_search_index, faq_readings, parallel_map, patrol_search_text,
+    query_variants, KeywordMatcher, trouble_search_text, split_related_words, term_key, SynonymDictionary, SYNONYM_SEP,
+    MATCH_ORIGINS, match_spans,
+)
+from faq_similarity import build_faq_similarity_index, RelatedFaqTable
+from faq_dedup import DuplicateIndex, duplicate_text, minhash_signatures
+from faq_shards import SHARD_MIN_ROWS, ShardError, ShardedIndex
+from memory_cache import BoundedCache, env_megabytes, env_seconds, estimate_size
+
+# -------------------------------
+# 🗂 カテゴリ定義
+# -------------------------------
+FAQ_CATEGORIES = ["工事関係", "事務関係", "その他"]
+PATROL_SHEET = "パト指摘事項"
+TROUBLE_SHEET = "トラブル事例"
+ALL_CATEGORIES = FAQ_CATEGORIES + [PATROL_SHEET, TROUBLE_SHEET]
+
+FAQ_COLUMNS = ['質問', '回答', '関連ワード', '添付ファイル', '読み', '関連読み']
+
+# 入力候補に使う列
+SUGGEST_COLUMNS = {
+    "patrol": ['設備名', 'カテゴリ'],
+    "trouble": ['現場名', '設備名', 'カテゴリ', '詳細機器名'],
+}
+
+# 全カテゴリ検索の結果に表示する列
+TITLE_COLUMNS = {
+    "faq": ['質問'],
+    "patrol": ['設備名', 'カテゴリ', '指摘事項'],
+    "trouble": ['現場名', '設備名', 'トラブル内容'],
+}
+
+# 件数を集計しておく列
+FACET_COLUMNS = {
+    "patrol": ['設備名', 'カテゴリ'],
+    "trouble": ['現場名', '設備名', 'カテゴリ'],
+}
+
+# シートごとの列（この順で持つ。シートに無い列は空欄、ここに無い列は読み込まない）
+SHEET_SCHEMAS = {
+    "faq": ['質問', '回答', '関連ワード', '添付ファイル'],
+    "patrol": ['設備名', '指摘事項', '対応', 'カテゴリ', '関連ワード'],
+    "trouble": ['現場名', '設備名', 'トラブル内容', '対処', '詳細機器名', 'カテゴリ', '備考'],
+}
+
+# 書き込みジャーナルの id の列（アプリから登録した行を1回だけ反映するための目印）。
+# 見出しに「登録ID」があればその列、無ければ見出しとスキーマのどちらよりも右の列に入れる
+JOURNAL_ID_COLUMN = '登録ID'
+JOURNAL_KINDS = ('trouble',)  # アプリから行を登録するカテゴリ
+
+# 検索モード（類似は FAQ だけ。質問・回答・関連ワードの文字 n-gram TF-IDF で上位から並べる）
+SEARCH_MODES = ('AND', 'OR')
+SIMILAR_MODE = '類似'
+FAQ_SEARCH_MODES = SEARCH_MODES + (SIMILAR_MODE,)
+SIMILAR_LIMIT = 20
+
+# 検索結果（カテゴリ・版・検索語・モードごとの行番号）。版が変われば別のキーになるので古い結果は出ない
+search_results_cache = BoundedCache(
+    "検索結果",
+    max_bytes=env_megabytes("FAQ_RESULT_CACHE_MB", 32),
+    ttl=env_seconds("FAQ_RESULT_CACHE_TTL", 600),
+)
+
+_version_lock = threading.Lock()
+_similarity_lock = threading.Lock()
+_last_version = 0
+
+
+# スナップショットのバージョン（ミリ秒時刻ベースで単調増加。事前ビルド分とも比較できる）
+def next_version():
+    global _last_version
+    with _version_lock:
+        _last_version = max(_last_version + 1, int(time.time() * 1000))
+        return _last_version
+
+
+def category_kind(category):
+    if category in FAQ_CATEGORIES:
+        return "faq"
+    if category == PATROL_SHEET:
+        return "patrol"
+    if category == TROUBLE_SHEET:
+        return "trouble"
+    return None
+
+
+# -------------------------------
+# 📅 行データ → FAQ（読みは並列に計算）
+# -------------------------------
+def build_faqs(records, workers=None):
+    faqs = []
+    for row in records:
+        faqs.append({
+            '質問': row.get('質問', ''),
+            '回答': row.get('回答', ''),
+            '関連ワード': row.get('関連ワード', ''),
+            '添付ファイル': row.get('添付ファイル', ''),
+        })
+    # 読み（漢字→ひらがな）の変換は重いので行を分割して並列に処理
+    readings = parallel_map(faq_readings, [(faq['質問'], faq['関連ワード']) for faq in faqs], workers)
+    for faq, (reading, related_reading) in zip(faqs, readings):
+        faq['読み'] = reading
+        faq['関連読み'] = related_reading
+    return faqs
+
+# -------------------------------
+# 🧾 セルの値（ws.get_all_values() などの行のリスト）→ 列ごとの値
+# -------------------------------
+# 見出し行はスキーマの列名を含む最初の行（ブックによっては先頭にタイトル行がある）。
+# 全部空欄の行は読み飛ばし、行 → 列の入れ替えは zip でまとめて行う（DataFrame やセル単位の
+# オブジェクトを経由しない）
+# start を渡すとその行以降（末尾に追加された分）だけを読む
+def find_header(values, names):
+    return next((i for i, row in enumerate(values) if set(names) & {str(v).strip() for v in row}), None)
+
+def journal_id_position(header, names):
+    header = [str(v).strip() for v in header]
+    if JOURNAL_ID_COLUMN in header:
+        return header.index(JOURNAL_ID_COLUMN)
+    while header and not header[-1]:
+        header.pop()
+    return max(len(header), len(names))
+
+def decode_values(values, kind, start=0):
+    schema = SHEET_SCHEMAS[kind]
+    header_at = find_header(values, schema)
+    if header_at is None:
+        return {c: () for c in schema}
+    header = [str(v).strip() for v in values[header_at]]
+    rows = [row for row in values[max(header_at + 1, start):] if any(row)]
+    transposed = list(zip_longest(*rows, fillvalue='')) if rows else []
+    positions = {c: header.index(c) if c in header else None for c in schema}
+    if kind in JOURNAL_KINDS:
+        positions[JOURNAL_ID_COLUMN] = journal_id_position(header, schema)
+    columns = {}
+    for c, pos in positions.items():
+        columns[c] = transposed[pos] if pos is not None and pos < len(transposed) else ('',) * len(rows)
+    return columns
+
+def records_from_values(values, kind, start=0):
+    columns = decode_values(values, kind, start)
+    return list(LazyRecords(columns, len(next(iter(columns.values()), ()))))
+
+def snapshot_from_values(category, values, workers=None):
+    kind = category_kind(category)
+    columns = decode_values(values, kind)
+    if kind == "faq":
+        return Snapshot(category, faqs=build_faqs(LazyRecords(columns, len(columns['質問'])), workers), workers=workers)
+    return Snapshot(category, columns=columns, workers=workers)
+
+# 読みの頭文字ごとの行番号（完全に同じ FAQ は1件にまとめる）
+def gojuon_groups(faqs):
+    groups = {}
+    seen = set()
+    for i, faq in enumerate(faqs):
+        reading = faq.get('読み', '')
+        if not reading:
+            continue
+        key = (reading[0],) + tuple(faq.get(c, '') for c in FAQ_COLUMNS)
+        if key in seen:
+            continue
+        seen.add(key)
+        groups.setdefault(reading[0], []).append(i)
+    return dict(sorted(groups.items()))
+
+# 同義語辞書の材料：行ごとの「概念を成す語」と「その行を引ける語」（読みに揃えてタブ区切り）
+def synonym_columns(kind, records):
+    cache = {}
+
+    def key(term):
+        term = str(term).strip()
+        if term not in cache:
+            cache[term] = term_key(term) if term else ''
+        return cache[term]
+
+    concepts, targets = [], []
+    for row in records:
+        related = [key(w) for w in split_related_words(row.get('関連ワード', ''))]
+        if kind == "faq":
+            terms = [key(row.get('質問', ''))] + related
+            concepts.append(SYNONYM_SEP.join(terms))
+            targets.append(SYNONYM_SEP.join(terms))
+        elif kind == "patrol":
+            concepts.append(SYNONYM_SEP.join([''] + related))
+            targets.append(SYNONYM_SEP.join([key(row.get('設備名', ''))] + related))
+        else:
+            concepts.append('')
+            targets.append(SYNONYM_SEP.join([key(row.get('設備名', '')), key(row.get('詳細機器名', ''))]))
+    return concepts, targets
+
+def facet_counts(rows, columns):
+    counts = {c: {} for c in columns}
+    for row in rows:
+        for c in columns:
+            value = str(row.get(c, ''))
+            counts[c][value] = counts[c].get(value, 0) + 1
+    return counts
+
+
+# -------------------------------
+# 🧊 トラブル事例の集計（現場 → 設備 → カテゴリ）
+# -------------------------------
+# 一覧・詳細ページの件数や該当行は、表示のたびに DataFrame を絞り込まずにここから引く
+TROUBLE_LABELS = {'現場名': '現場名登録なし', '設備名': '設備名なし', 'カテゴリ': 'カテゴリ登録なし'}
+
+def display_value(value, default_label):
+    return value if str(value).strip() else default_label
+
+class TroubleCube:
+    def __init__(self, rows):
+        self.cells = {}          # (現場, 設備, カテゴリ) の表示名 → 行番号
+        self.sites = {}          # 現場の表示名 → 行番号
+        self.categories = {}     # カテゴリの表示名 → 行番号
+        self.raw_categories = {}  # カテゴリの元の値 → 件数（カテゴリ一覧のボタン）
+        self.site_pairs = {}     # 現場の表示名 → {(現場, 設備) の元の値: 行番号}
+        self.category_pairs = {}  # カテゴリの表示名 → {(現場, 設備) の元の値: 行番号}
+        for i, row in enumerate(rows):
+            self.add(i, row)
+
+    @staticmethod
+    def label(column, value):
+        return str(display_value(value, TROUBLE_LABELS[column]))
+
+    def add(self, i, row):
+        site, eq, cat = (row.get(c, '') for c in TROUBLE_LABELS)
+        site_label, eq_label, cat_label = (self.label(c, row.get(c, '')) for c in TROUBLE_LABELS)
+        self.cells.setdefault((site_label, eq_label, cat_label), []).append(i)
+        self.sites.setdefault(site_label, []).append(i)
+        self.categories.setdefault(cat_label, []).append(i)
+        self.raw_categories[str(cat)] = self.raw_categories.get(str(cat), 0) + 1
+        self.site_pairs.setdefault(site_label, {}).setdefault((site, eq), []).append(i)
+        self.category_pairs.setdefault(cat_label, {}).setdefault((site, eq), []).append(i)
+
+    # 行を足した新しい集計を返す（自分は変えない。表示中の古い版の行番号・件数がそのまま使えるように）
+    # 入れ物は浅く写し、足した行が触るキーの分だけ作り直す（ほかのキーの行番号の並びは古い版と共有）
+    def added(self, start, rows):
+        cube = copy.copy(self)
+        cube.cells, cube.sites, cube.categories = dict(self.cells), dict(self.sites), dict(self.categories)
+        cube.raw_categories = dict(self.raw_categories)
+        cube.site_pairs, cube.category_pairs = dict(self.site_pairs), dict(self.category_pairs)
+        for i, row in enumerate(rows, start):
+            site, eq, cat = (row.get(c, '') for c in TROUBLE_LABELS)
+            site_label, eq_label, cat_label = (self.label(c, row.get(c, '')) for c in TROUBLE_LABELS)
+            for table, key in ((cube.cells, (site_label, eq_label, cat_label)), (cube.sites, site_label),
+                               (cube.categories, cat_label)):
+                table[key] = table.get(key, []) + [i]
+            cube.raw_categories[str(cat)] = cube.raw_categories.get(str(cat), 0) + 1
+            for table, label in ((cube.site_pairs, site_label), (cube.category_pairs, cat_label)):
+                pairs = dict(table.get(label, {}))
+                pairs[(site, eq)] = pairs.get((site, eq), []) + [i]
+                table[label] = pairs
+        return cube
+
+    def site_counts(self):
+        return [(site, len(ids)) for site, ids in sorted(self.sites.items())]
+
+    def category_counts(self):
+        return sorted(self.raw_categories.items())
+
+    # (現場, 設備) の元の値で並べた組と行番号
+    def site_groups(self, site_label):
+        return sorted(self.site_pairs.get(site_label, {}).items(), key=lambda item: (str(item[0][0]), str(item[0][1])))
+
+    def category_groups(self, cat_label):
+        return sorted(self.category_pairs.get(cat_label, {}).items(), key=lambda item: (str(item[0][0]), str(item[0][1])))
+
+    def category_rows(self, cat_label):
+        return self.categories.get(str(cat_label), [])
+
+    def cell(self, site_label, eq_label, cat_label):
+        return self.cells.get((str(site_label), str(eq_label), str(cat_label)), [])
+
+
+# -------------------------------
+# 🗃 登録フォームの選択肢（現場 → 設備 → カテゴリ → 詳細機器名）
+# -------------------------------
+OPTION_LEVELS = ['現場名', '設備名', 'カテゴリ', '詳細機器名']
+
+class OptionIndex:
+    def __init__(self, rows):
+        self.children = {}  # 上位の値の組 → {値: 件数}
+        self.counts = {}    # 値の組 → 件数
+        self.values = {c: {} for c in OPTION_LEVELS}  # 列 → {値: 件数}（上位に関係なく）
+        for row in rows:
+            self.add(row)
+
+    # 1行分を反映（作るときだけ。登録した行は added() で新しい版に足す）
+    def add(self, row):
+        path = tuple(str(row.get(c, '')) for c in OPTION_LEVELS)
+        for depth, (column, value) in enumerate(zip(OPTION_LEVELS, path)):
+            children = self.children.setdefault(path[:depth], {})
+            children[value] = children.get(value, 0) + 1
+            self.counts[path[:depth + 1]] = self.counts.get(path[:depth + 1], 0) + 1
+            self.values[column][value] = self.values[column].get(value, 0) + 1
+
+    # 行を足した新しい選択肢を返す（自分は変えない）。足した行が触る組の分だけ作り直す
+    def added(self, rows):
+        index = copy.copy(self)
+        index.children, index.counts = dict(self.children), dict(self.counts)
+        index.values = {c: dict(v) for c, v in self.values.items()}
+        for row in rows:
+            path = tuple(str(row.get(c, '')) for c in OPTION_LEVELS)
+            for depth, (column, value) in enumerate(zip(OPTION_LEVELS, path)):
+                children = index.children[path[:depth]] = dict(index.children.get(path[:depth], {}))
+                children[value] = children.get(value, 0) + 1
+                index.counts[path[:depth + 1]] = index.counts.get(path[:depth + 1], 0) + 1
+                index.values[column][value] = index.values[column].get(value, 0) + 1
+        return index
+
+    # 上位の値を指定したときの次の列の選択肢（空欄は除く）
+    def options(self, *prefix):
+        return sorted(v for v in self.children.get(tuple(str(p) for p in prefix), {}) if v)
+
+    def column_options(self, column):
+        return sorted(v for v in self.values[column] if v)
+
+    def count(self, *prefix):
+        return self.counts.get(tuple(str(p) for p in prefix), 0)
+
+
+# -------------------------------
+# 📋 列ごとの配列から行 dict を必要な分だけ組み立てる
+# -------------------------------
+class AppendedRecords:
+    def __init__(self, base, added):
+        self.base = base    # 全件読み込み時の並び（mmap 上の列でもよい）
+        self.added = added  # その後に追加した分
+
+    @classmethod
+    def extend(cls, records, items):
+        if isinstance(records, cls):
+            return cls(records.base, records.added + list(items))
+        return cls(records, list(items))
+
+    def __len__(self):
+        return len(self.base) + len(self.added)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i < len(self.base):
+            return self.base[i]
+        return self.added[i - len(self.base)]
+
+    def __iter__(self):
+        yield from self.base
+        yield from self.added
+
+
+class LazyRecords:
+    def __init__(self, columns, length):
+        self.columns = columns  # 列名 → 値の並び
+        self.length = length
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(self.length))]
+        if i < 0:
+            i += self.length
+        if not 0 <= i < self.length:
+            raise IndexError(i)
+        return {name: values[i] for name, values in self.columns.items()}
+
+    def __iter__(self):
+        for i in range(self.length):
+            yield self[i]
+
+
+# -------------------------------
+# 📸 スナップショット（読み込み結果＋索引を一式で保持）
+# -------------------------------
+class Snapshot:
+    def __init__(self, category, faqs=None, df=None, workers=None, columns=None):
+        self.category = category
+        self.kind = category_kind(category)
+        self.faqs = faqs
+        self._df = df
+        if columns is not None:  # 列名 → 値の並び（decode_values の結果）
+            self.columns = list(columns)
+            self.rows = LazyRecords(columns, len(next(iter(columns.values()), ())))
+        else:
+            self.columns = list(df.columns) if df is not None else FAQ_COLUMNS
+            self.rows = df.to_dict(orient='records') if df is not None else None
+        self.version = next_version()
+        self.delta_rows = 0  # 全件読み込みのあとに差分で追加した行数
+        self.search_index = None
+        self.search_texts = None
+        self.gojuon = {}
+        self.facets = {}
+        self.synonym_concepts, self.synonym_targets = synonym_columns(self.kind, self.records)
+        if self.kind == "faq":
+            self.suggest = build_suggest_trie(faqs=faqs)
+            self.search_index = build_faq_search_index(faqs, workers)
+            self.gojuon = gojuon_groups(faqs)
+        else:
+            if self.kind == "patrol":
+                texts = parallel_map(patrol_search_text, self.rows, workers)
+                self.search_index = SearchIndex(texts, workers)
+            else:
+                self.search_texts = [trouble_search_text(row) for row in self.rows]
+            self.suggest = build_suggest_trie(
+                rows=self.rows,
+                columns=[c for c in SUGGEST_COLUMNS[self.kind] if c in self.columns],
+                related_column='関連ワード' if '関連ワード' in self.columns else None,
+            )
+            self.facets = facet_counts(self.rows, [c for c in FACET_COLUMNS[self.kind] if c in self.columns])
+
+    # 事前ビルド済みの成果物（snapshot_store）から復元
+    @classmethod
+    def restore(cls, category, version, columns, faqs=None, rows=None, suggest=None, search_index=None,
+                search_texts=None, gojuon=None, facets=None, synonym_concepts=None, synonym_targets=None):
+        snapshot = cls.__new__(cls)
+        snapshot.category = category
+        snapshot.kind = category_kind(category)
+        snapshot.version = version
+        snapshot.delta_rows = 0
+        snapshot.columns = columns
+        snapshot.faqs = faqs
+        snapshot.rows = rows
+        snapshot._df = None
+        snapshot.suggest = suggest
+        snapshot.search_index = search_index
+        snapshot.search_texts = search_texts
+        snapshot.gojuon = gojuon or {}
+        snapshot.facets = facets or {}
+        snapshot.synonym_concepts = synonym_concepts
+        snapshot.synonym_targets = synonym_targets
+        return snapshot
+
+    # 表形式のタブ向け DataFrame（復元時は初回アクセスで組み立て）
+    @property
+    def df(self):
+        if self._df is None and self.rows is not None:
+            self._df = pd.DataFrame(list(self.rows), columns=self.columns)
+        return self._df
+
+    # トラブル事例の集計はスナップショットごとに初回アクセスで1回だけ作る
+    @property
+    def cube(self):
+        if self.kind != "trouble":
+            return None
+        if getattr(self, '_cube', None) is None:
+            self._cube = TroubleCube(self.rows)
+        return self._cube
+
+    @property
+    def options(self):
+        if self.kind != "trouble":
+            return None
+        if getattr(self, '_options', None) is None:
+            self._options = OptionIndex(self.rows)
+        return self._options
+
+    # 類似検索の行列は重いので、初回の類似検索で1回だけ作る（同時に来ても作るのは1回）
+    @property
+    def similarity(self):
+        if self.kind != "faq":
+            return None
+        if getattr(self, '_similarity', None) is None:
+            with _similarity_lock:
+                if getattr(self, '_similarity', None) is None:
+                    self._similarity = build_faq_similarity_index(self.faqs)
+        return self._similarity
+
+    # 重複候補を探すための MinHash 署名（初回に1回だけ）
+    @property
+    def minhash(self):
+        if getattr(self, '_minhash', None) is None:
+            self._minhash = minhash_signatures(duplicate_text(self.kind, r) for r in self.records)
+        return self._minhash
+
+    # 追加された行だけを反映した新しいバージョンを返す（トラブル事例の登録直後）
+    # 照合対象・集計・選択肢・同義語の材料に追記するだけで、入力候補は次の全件読み込みで更新する
+    def appended(self, new_rows):
+        if self.kind != "trouble":
+            raise ValueError(f"{self.category} は差分での追加に対応していません")
+        rows = [{c: row.get(c, '') for c in self.columns} for row in new_rows]
+        start = len(self.rows)
+        snapshot = copy.copy(self)
+        snapshot.version = next_version()
+        snapshot.delta_rows = self.delta_rows + len(rows)
+        snapshot._df = None
+        snapshot.rows = AppendedRecords.extend(self.rows, rows)
+        snapshot.search_texts = AppendedRecords.extend(self.search_texts, [trouble_search_text(r) for r in rows])
+        concepts, targets = synonym_columns(self.kind, rows)
+        snapshot.synonym_concepts = AppendedRecords.extend(self.synonym_concepts, concepts)
+        snapshot.synonym_targets = AppendedRecords.extend(self.synonym_targets, targets)
+        snapshot.facets = {c: dict(counts) for c, counts in self.facets.items()}
+        for row in rows:
+            for c, counts in snapshot.facets.items():
+                counts[str(row.get(c, ''))] = counts.get(str(row.get(c, '')), 0) + 1
+        # 集計と選択肢は足した行の分だけ作り直した写しを新しい版に持たせる（古い版のものは変えない）
+        cube, options = getattr(self, '_cube', None), getattr(self, '_options', None)
+        snapshot._cube = cube.added(start, rows) if cube is not None else None
+        snapshot._options = options.added(rows) if options is not None else None
+        if getattr(self, '_minhash', None) is not None:
+            added = minhash_signatures(duplicate_text(self.kind, r) for r in rows)
+            snapshot._minhash = np.vstack([self._minhash, added])
+        if getattr(self, '_shards', None) is not None:
+            snapshot._shards = self._shards.extended(snapshot.search_texts)  # 追加分は末尾として手元で照合
+        return snapshot
+
+    # 行数の多いパト指摘事項・トラブル事例は、照合対象をシャードに分けてワーカープロセスに持たせる
+    # （SnapshotRefresher が差し替えのあとに裏で呼ぶ。用意できるまでは手元の索引で検索する）
+    def prepare_shards(self, pool, min_rows=SHARD_MIN_ROWS):
+        if self.kind == "faq" or getattr(self, '_shards', None) is not None:
+            return getattr(self, '_shards', None)
+        if self.search_index is not None:
+            engine, texts = "index", self.search_index.texts
+        else:
+            engine, texts = "scan", self.search_texts
+        if len(texts) < min_rows:
+            return None
+        self._shards = ShardedIndex.build(pool, engine, texts, pool.workers)
+        return self._shards
+
+    @property
+    def shard_count(self):
+        sharded = getattr(self, '_shards', None)
+        return len(sharded.shards.placed) if sharded is not None else 0
+
+    def gojuon_faqs(self, initial):
+        return [self.faqs[i] for i in self.gojuon.get(initial, [])]
+
+    @property
+    def records(self):
+        return self.faqs if self.kind == "faq" else self.rows
+
+    # 検索して行番号を返す（各タブの検索・全カテゴリ検索の共通入口）
+    # synonyms があれば、各キーワードを同義語辞書で展開した行もヒットに含める
+    # 類似検索は似ている順（上位 SIMILAR_LIMIT 件）、AND / OR は行番号順
+    # 同じ版・同じ検索語の結果は search_results_cache から返す
+    def search(self, query, search_mode='AND', synonyms=None):
+        if synonyms is not None and synonyms.versions.get(self.category) != self.version:
+            synonyms = None
+        # 同義語辞書は他カテゴリの読み直しでも変わるので、全カテゴリの版をキーに含める
+        synonym_key = tuple(sorted(synonyms.versions.items())) if synonyms is not None else None
+        key = (self.category, self.version, str(query), search_mode, synonym_key)
+        return search_results_cache.get_or_create(key, lambda: tuple(self._search(query, search_mode, synonyms)))
+
+    def _search(self, query, search_mode, synonyms):
+        if search_mode == SIMILAR_MODE and self.kind == "faq":
+            return [i for i, _ in self.similarity.query(query, SIMILAR_LIMIT)] if str(query).strip() else []
+        words = str(query).lower().split()
+        if self.kind != "faq":
+            words = [k for k in words if len(k) >= 2]
+        extra = None
+        if synonyms is not None:
+            extra = [synonyms.expand(k, self.category) for k in words]
+        keywords = query_variants(words) if self.search_index is not None else words
+        sharded = getattr(self, '_shards', None)
+        if sharded is not None:
+            try:
+                return sharded.search(keywords, search_mode, extra)
+            except ShardError:
+                self._shards = None  # ワーカーが使えなくなったら手元の索引に戻す
+        if self.search_index is not None:
+            return self.search_index.search(keywords, search_mode, extra)
+        return KeywordMatcher(words).search(self.search_texts, search_mode, extra)
+
+    # 表示する行の一致位置（列 → [(開始, 終了)]）。照合と同じ語・照合対象から求め、
+    # 読みで一致した部分は元の文字の範囲に戻す（同義語の展開だけで当たった行は空）
+    def match_spans(self, i, query):
+        words = str(query).lower().split()
+        if self.kind != "faq":
+            words = [k for k in words if len(k) >= 2]
+        if self.search_index is not None:
+            text = self.search_index.texts[i]
+            keywords = query_variants(words)
+        else:
+            text = self.search_texts[i]
+            keywords = [(k,) for k in words]
+        return match_spans(text, MATCH_ORIGINS[self.kind](self.records[i], text), keywords)
+
+    def title(self, row):
+        return " / ".join(str(row.get(c, '')).strip() for c in TITLE_COLUMNS[self.kind] if str(row.get(c, '')).strip())
+
+
+# -------------------------------
+# 🌐 全カテゴリ検索（カテゴリごとに並行して検索し、終わった順に返す）
+# -------------------------------
+def _search_category(get_snapshot, category, query, search_mode, synonyms):
+    snapshot = get_snapshot(category)
+    keywords = str(query).lower().split()
+    hits = []
+    for i in snapshot.search(query, search_mode, synonyms):
+        row = snapshot.records[i]
+        title = snapshot.title(row)
+        # 見出し（質問・設備名など）に含まれるキーワードが多いほど上位
+        score = sum(1 for k in keywords if k in title.lower())
+        hits.append({'カテゴリ': category, 'version': snapshot.version, 'row': i, 'title': title, 'score': score})
+    return hits
+
+def search_all_categories(get_snapshot, categories, query, search_mode, executor, synonyms=None):
+    futures = {executor.submit(_search_category, get_snapshot, c, query, search_mode, synonyms): c for c in categories}
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result()
+        except Exception as e:
+            yield futures[future], e
+
+def merge_hits(hits, categories):
+    order = {c: i for i, c in enumerate(categories)}
+    return sorted(hits, key=lambda h: (-h['score'], order[h['カテゴリ']], h['row']))
+
+
+# -------------------------------
+# 🔄 バックグラウンド更新（stale-while-revalidate）
+# -------------------------------
+# ・リクエストは常に手元の最新スナップショットを即座に返し、再構築は別スレッドで行う
+# ・差し替えは参照の付け替えだけ（ロック内）なので、読み手が作りかけの状態を見ることはない
+# ・直近の数世代を残し、画面遷移の途中のセッションは開始時のバージョンで引き続き解決できる
+#   （古い世代はカテゴリごとの容量上限つきキャッシュに入れ、上限・期限を超えたら最新版で表示する。
+#    別カテゴリの登録が続いても、他のカテゴリの世代は追い出されない）
+# ・セッションが入口のページで pin() した版は、最後に使われてから pin_ttl 秒のあいだ
+#   世代数・容量の上限に関係なく残す（登録が続いて版が進んでも、画面遷移の途中で版が変わらない）
+PIN_TTL = 1800
+class SnapshotRefresher:
+    def __init__(self, loader, categories, interval=300, keep_versions=3, reconcile_after=20, pending_rows=None,
+                 history_bytes=None, history_ttl=None, shard_pool=None, shard_min_rows=SHARD_MIN_ROWS, seed=None):
+        self.loader = loader  # カテゴリ → Snapshot
+        self.seed = seed      # カテゴリ → 起動直後だけ使う Snapshot（事前ビルドの成果物。無ければ None）
+        self.pending_rows = pending_rows  # カテゴリ → まだシートに届いていない登録行（書き込みジャーナル）
+        self.categories = list(categories)
+        self.interval = interval
+        self.keep_versions = keep_versions
+        self.reconcile_after = reconcile_after  # 差分の追加がこの行数に達したら全件で読み直す
+        self.lock = threading.Lock()
+        self.current = {}
+        self.history = {  # カテゴリ → (カテゴリ, バージョン) → 最新でなくなった Snapshot
+            c: BoundedCache(f"過去のスナップショット（{c}）", max_bytes=history_bytes,
+                            max_entries=max(0, keep_versions - 1), ttl=history_ttl)
+            for c in self.categories
+        }
+        self.pin_ttl = history_ttl or PIN_TTL
+        self.pins = {}           # (カテゴリ, バージョン) → セッションが最後に使った時刻
+        self.pinned = {}         # (カテゴリ, バージョン) → 使用中のセッションがある古い Snapshot
+        self.sizes = {}          # (カテゴリ, バージョン) → 見積もった大きさ
+        self.load_locks = {c: threading.Lock() for c in self.categories}
+        self.wakeup = threading.Event()
+        self.pending = set()
+        self.errors = {}         # カテゴリ → 直近の更新失敗
+        self.synonyms = SynonymDictionary({})
+        self.synonym_lock = threading.Lock()
+        self.related = RelatedFaqTable()
+        self.duplicates = DuplicateIndex()
+        self.tables_lock = threading.Lock()
+        self.shard_pool = shard_pool  # 大きなカテゴリの検索を分けて持たせるワーカー（None なら分割しない）
+        self.shard_min_rows = shard_min_rows
+        self.thread = None
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="snapshot-refresher", daemon=True)
+            self.thread.start()
+        return self
+
+    def _publish(self, category, snapshot):
+        with self.lock:
+            old = self.current.get(category)
+            self.current[category] = snapshot
+            self._expire_pins()
+            if old is not None and old is not snapshot and (category, old.version) in self.pins:
+                self.pinned[(category, old.version)] = old
+                return
+        if old is not None and old is not snapshot and self.keep_versions > 1:
+            self.history[category].put((category, old.version), old)
+
+    # しばらく使われていない版の印を外す（古い版は参照が無くなれば手放される）
+    def _expire_pins(self):
+        now = time.monotonic()
+        for key in [k for k, used in self.pins.items() if now - used > self.pin_ttl]:
+            del self.pins[key]
+            self.pinned.pop(key, None)
+
+    def _swap(self, category, snapshot):
+        self._publish(category, snapshot)
+        self._rebuild_synonyms()
+        threading.Thread(target=self._update_tables, args=(category, snapshot),
+                         name="snapshot-tables", daemon=True).start()
+
+    # 関連 FAQ の表と重複候補は、読み直したカテゴリの分を計算し直して差し替える（表示は前の表で続ける）
+    # 検索シャードもここで用意する（用意できるまでの検索は手元の索引で行う）
+    def _update_tables(self, category, snapshot):
+        with self.tables_lock:
+            if self.current.get(category) is not snapshot:
+                return  # 待っている間にさらに新しい版が出た
+            if self.shard_pool is not None:
+                try:
+                    snapshot.prepare_shards(self.shard_pool, self.shard_min_rows)
+                except ShardError as e:
+                    self.errors[category] = f"検索シャード: {e}"
+            try:
+                if snapshot.kind == "faq":
+                    self.related = self.related.updated(category, snapshot)
+                self.duplicates = self.duplicates.updated(category, snapshot)
+            except Exception as e:
+                self.errors[category] = f"関連FAQ・重複候補: {type(e).__name__}: {e}"
+
+    # 全カテゴリの関連ワードから同義語辞書を作り直して差し替える
+    def _rebuild_synonyms(self):
+        with self.synonym_lock:
+            with self.lock:
+                current = dict(self.current)
+            self.synonyms = SynonymDictionary(current)
+
+    def _load(self, category):
+        snapshot = None
+        if self.seed is not None and category not in self.current:
+            snapshot = self.seed(category)
+            if snapshot is not None:
+                self.refresh_async(category)  # 成果物は起動を速くするだけ。すぐシートから読み直す
+        if snapshot is None:
+            snapshot = self.loader(category)
+        if self.pending_rows is not None and snapshot.kind == "trouble":
+            rows = self._missing_rows(snapshot, self.pending_rows(category))
+            if rows:
+                snapshot = snapshot.appended(rows)
+        self._swap(category, snapshot)
+        self.errors.pop(category, None)
+        return snapshot
+
+    # 最新を返す。まだ一度も読み込んでいないカテゴリだけは初回読み込みを待つ
+    def get(self, category):
+        snapshot = self.current.get(category)
+        if snapshot is not None:
+            return snapshot
+        with self.load_locks[category]:
+            snapshot = self.current.get(category)
+            return snapshot if snapshot is not None else self._load(category)
+
+    # セッションが入口のページで使う最新版を返し、その版を使用中として印をつける
+    def pin(self, category):
+        snapshot = self.get(category)
+        with self.lock:
+            self.pins[(category, snapshot.version)] = time.monotonic()
+        return snapshot
+
+    # セッションが見始めたバージョンを返す（印が切れ、保持期間も過ぎていれば最新）
+    def get_version(self, category, version):
+        key = (category, version)
+        with self.lock:
+            snapshot = self.current.get(category)
+            if snapshot is None or snapshot.version != version:
+                snapshot = self.pinned.get(key)
+            if snapshot is not None and key in self.pins:
+                self.pins[key] = time.monotonic()
+        if snapshot is None:
+            snapshot = self.history[category].get(key)
+        return snapshot if snapshot is not None else self.get(category)
+
+    # 登録した行を全件の読み直しを待たずに反映する
+    # 全件読み込みがすでに取り込んだ行（末尾と一致するもの）は二重に足さない
+    def apply_rows(self, category, rows):
+        with self.load_locks[category]:
+            base = self.current.get(category)
+            if base is None:
+                return self._load(category)
+            rows = self._missing_rows(base, rows)
+            if not rows:
+                return base
+            snapshot = base.appended(rows)
+            self._publish(category, snapshot)
+        with self.synonym_lock:
+            if self.synonyms.versions.get(category) == base.version:
+                start = len(base.rows)
+                self.synonyms.add_rows(category, snapshot.version, start, snapshot.synonym_targets[start:])
+            else:
+                with self.lock:
+                    current = dict(self.current)
+                self.synonyms = SynonymDictionary(current)
+        if snapshot.delta_rows >= self.reconcile_after:
+            self.refresh_async(category)
+        return snapshot
+
+    # 登録ID のある行は id で、無い行（シートで直接足された行など）は登録ID 以外の列の値で照合する
+    @staticmethod
+    def _missing_rows(snapshot, rows):
+        def key(row):
+            entry_id = str(row.get(JOURNAL_ID_COLUMN, '')).strip()
+            if entry_id:
+                return entry_id
+            return tuple(str(row.get(c, '')).strip() for c in snapshot.columns if c != JOURNAL_ID_COLUMN)
+
+        recent = {key(r) for r in snapshot.rows[max(0, len(snapshot.rows) - len(rows) - 10):]}
+        return [r for r in rows if key(r) not in recent]
+
+    # 次の周期を待たずに更新する（書き込み後など）
+    def refresh_async(self, category):
+        with self.lock:
+            self.pending.add(category)
+        self.wakeup.set()
+
+    def refresh(self, category):
+        try:
+            with self.load_locks[category]:
+                self._load(category)
+        except Exception as e:
+            self.errors[category] = f"{type(e).__name__}: {e}"  # 失敗しても今のスナップショットを使い続ける
+
+    def _run(self):
+        for category in self.categories:  # 起動直後に全カテゴリを温めておく
+            if category not in self.current:
+                self.refresh(category)
+        while True:
+            woken = self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            with self.lock:
+                targets = set(self.pending) if woken else set(self.current) | self.pending
+                self.pending = set()
+            for category in self.categories:
+                if category in targets:
+                    self.refresh(category)
+
+    # 最新版ごとの大きさの見積もり（管理画面用。mmap した成果物の分は含まない）
+    def memory(self):
+        with self.lock:
+            current = dict(self.current)
+        sizes = {}
+        for category, snapshot in current.items():
+            key = (category, snapshot.version)  # 版ごとに1回だけ見積もる（管理画面の再実行のたびに測らない）
+            if key not in self.sizes:
+                self.sizes = {k: v for k, v in self.sizes.items() if k[0] != category}
+                self.sizes[key] = estimate_size(snapshot)
+            sizes[category] = self.sizes[key]
+        return sizes
+
+    def status(self):
+        kept = {c: len(history.keys()) for c, history in self.history.items()}
+        with self.lock:
+            for category, _ in self.pinned:
+                kept[category] = kept.get(category, 0) + 1
+            return {
+                category: {
+                    'version': snapshot.version,
+                    'versions_kept': 1 + kept.get(category, 0),
+                    'pinned_versions': sum(1 for c, _ in self.pins if c == category),
+                    'delta_rows': snapshot.delta_rows,
+                    'shards': snapshot.shard_count,
+                    'related_version': self.related.versions.get(category),
+                    'duplicates_version': self.duplicates.versions.get(category),
+                    'error': self.errors.get(category),
+                }
+                for category, snapshot in self.current.items()
+            }
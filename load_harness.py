@@ -0,0 +1,378 @@
+# -------------------------------
+# 🏋️ 負荷試験（複数セッションでクリック操作を再現して計測）
+# -------------------------------
+# 使い方:
+#   python load_harness.py --sessions 8 --iterations 5
+#   python load_harness.py --sessions 1,4,8,16 --iterations 2   # セッション数ごとの所要時間を並べる
+#   python load_harness.py --sessions 16 --latency 0.2 --error-rate 0.05 --snapshot-dir snapshot
+# ・シートは模擬シート（FAQ_SHEETS_BACKEND=local）に差し替え、認証情報なしで動かす
+# ・各セッションは streamlit.testing の AppTest で、同じプロセス内の共有キャッシュ
+#   （スナップショット・シート API クライアント・ジャーナル）を使う＝1台のサーバーに相当
+# ・AppTest は再実行のたびにグローバルな Runtime を差し替えるので、1プロセス内の再実行は
+#   1つずつ順番に行う（待ち時間も所要時間に含める）。--processes で複数プロセスに分けると
+#   並列に動く（プロセスごとにキャッシュを持つ＝複数台のサーバーに相当）
+# ・1回の再実行（クリック1回分）ごとの所要時間から p50 / p95 / p99 を出す
+# ・--sessions にカンマ区切りで複数の数を渡すと、数ごとに新しいプロセスで計測して並べる
+#   （キャッシュや呼び出し回数を前の計測から引き継がないように）
+# ・シート API の呼び出し回数は管理情報（FAQ_ADMIN=1）の表示から読み取る
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import threading
+import time
+
+from streamlit.logger import get_logger
+from streamlit.runtime.scriptrunner.script_cache import ScriptCache
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "faq_app.py")
+PASSWORD = "load-harness"
+
+
+# -------------------------------
+# 🖱 クリック操作の手順（AppTest を受け取り、1操作ごとに再実行する）
+# -------------------------------
+def click(at, label):
+    for button in at.button:
+        if button.label.startswith(label):
+            button.click()
+            return at.run()
+    return at
+
+
+# key が prefix で始まる最初のボタン（一覧の1件目など）を押す
+def click_first(at, prefix):
+    for button in at.button:
+        if button.key and button.key.startswith(prefix):
+            button.click()
+            return at.run()
+    return at
+
+
+def select_category(at, category):
+    at.selectbox(key="category_select").select(category)
+    return at.run()
+
+
+def faq_search_path(at):
+    yield select_category(at, "工事関係")
+    at.text_input[0].input("安全")
+    yield click(at, "検索")
+    yield click(at, "📋 一覧")
+    at.session_state.page = "home"
+    yield at.run()
+    yield click(at, "🔠 五十音表示")
+
+
+def patrol_path(at):
+    yield select_category(at, "パト指摘事項")
+    at.text_input(key="patrol_query").input("点検")
+    yield click(at, "検索")
+    yield click(at, "📋 カテゴリ一覧")
+
+
+def trouble_path(at):
+    yield select_category(at, "トラブル事例")
+    yield click(at, "📋 現場名一覧")
+    at.session_state.page = "trouble_search"
+    yield at.run()
+    yield click(at, "📋 カテゴリ一覧")
+
+
+# 検索結果から FAQ の詳細を開き、トラブル事例も現場名 → 事例の詳細まで開く
+def detail_path(at):
+    yield select_category(at, "工事関係")
+    at.text_input[0].input("安全")
+    yield click(at, "検索")
+    yield click_first(at, "faq_button_")
+    yield click(at, "🔙 戻る")
+    yield select_category(at, "トラブル事例")
+    yield click(at, "📋 現場名一覧")
+    yield click_first(at, "trouble_site_")
+    yield click_first(at, "trouble_detail_btn_site_")
+
+
+# トラブル事例を1件登録する（ジャーナルへの記録・差分の反映・裏でのシートへの追加を通る）
+def register_path(at):
+    yield select_category(at, "トラブル事例")
+    at.session_state.page = "trouble_search"
+    yield at.run()
+    yield click(at, "📝 登録")
+    at.text_input(key="site_input").input("負荷試験の現場")
+    at.text_input(key="eq_input").input("負荷試験の設備")
+    at.text_input(key="cat_input").input("負荷試験")
+    at.text_area[0].input("負荷試験で登録したトラブル内容")
+    at.text_area[1].input("対処なし")
+    yield click(at, "登録する")
+    yield click(at, "🏠 ホームへ戻る")
+
+
+def global_search_path(at):
+    yield select_category(at, "🌐 全カテゴリ検索")
+    at.text_input[0].input("漏れ")
+    yield click(at, "検索")
+
+
+CLICK_PATHS = {
+    "faq": faq_search_path,
+    "patrol": patrol_path,
+    "trouble": trouble_path,
+    "detail": detail_path,
+    "register": register_path,
+    "global": global_search_path,
+}
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def peak_rss_mib():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # Linux は KiB 単位
+
+
+# AppTest は再実行のたびに ScriptCache を作り直してスクリプトをコンパイルする。
+# 複数スレッドで同時にコンパイルすると失敗することがあるので、実サーバーと同じく
+# コンパイル結果を1つのキャッシュで共有する
+_shared_script_cache = ScriptCache()
+_original_get_bytecode = ScriptCache.get_bytecode
+
+
+def _shared_get_bytecode(self, script_path):
+    return _original_get_bytecode(_shared_script_cache, script_path)
+
+
+_run_lock = threading.Lock()  # 1プロセス内の再実行は1つずつ
+
+
+class Session:
+    def __init__(self, session_id, paths, iterations, timeout):
+        self.session_id = session_id
+        self.paths = paths
+        self.iterations = iterations
+        self.timeout = timeout
+        self.latencies = []
+        self.errors = []
+        self.at = None
+
+    def _timed(self, step):
+        start = time.perf_counter()
+        with _run_lock:
+            at = next(step)
+        self.latencies.append(time.perf_counter() - start)
+        if at.exception:
+            self.errors.append(str(at.exception[0].message))
+
+    def _login(self):
+        at = AppTest.from_file(APP_PATH, default_timeout=self.timeout)
+        at.secrets["password"] = PASSWORD
+        at.run()
+        at.text_input[0].input(PASSWORD)
+        at.button[0].click()
+        yield at.run()
+
+    def run(self):
+        login = self._login()
+        with _run_lock:
+            at = next(login)
+        self.at = at
+        for i in range(self.iterations):
+            for name in self.paths:
+                # 手順の途中の再実行も1回ずつ計る（next() の中で at.run() が呼ばれる）
+                step = CLICK_PATHS[name](at)
+                while True:
+                    try:
+                        self._timed(step)
+                    except StopIteration:
+                        break
+                    except Exception as e:
+                        self.errors.append(f"{name}: {type(e).__name__}: {e}")
+                        break
+                at.session_state.page = "home"
+
+
+def admin_metrics(at):
+    metrics = {}
+    for element in at.sidebar.json if at is not None else []:
+        try:
+            value = json.loads(element.value)
+        except (TypeError, ValueError):
+            continue
+        if 'backend' in value:
+            metrics['backend'] = value
+        elif 'throttle_wait_sec' in value:
+            metrics['client'] = value
+        elif 'pending' in value:
+            metrics['journal'] = value
+    return metrics
+
+
+# 1プロセス分のセッションを流す（--processes のときは子プロセスで呼ばれる）
+def run_sessions(session_ids, paths, iterations, timeout):
+    ScriptCache.get_bytecode = _shared_get_bytecode
+    # セッションのスレッドから操作するたびに出る「ScriptRunContext が無い」警告を抑える
+    get_logger("streamlit.runtime.scriptrunner_utils.script_run_context").disabled = True
+    # 起動時の読み込みを先に済ませ、その時間は別に出す
+    start = time.perf_counter()
+    Session(-1, [], 0, timeout).run()
+    warmup_sec = time.perf_counter() - start
+
+    sessions = [Session(i, paths, iterations, timeout) for i in session_ids]
+    threads = [threading.Thread(target=s.run, name=f"session-{s.session_id}") for s in sessions]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+
+    last = next((s.at for s in reversed(sessions) if s.at is not None), None)
+    if last is not None:
+        last.run()  # 最後に管理情報を描画し直して呼び出し回数を読む
+    return {
+        'latencies': [x for s in sessions for x in s.latencies],
+        'errors': [e for s in sessions for e in s.errors],
+        'elapsed_sec': elapsed,
+        'warmup_sec': warmup_sec,
+        'peak_rss_mib': peak_rss_mib(),
+        'metrics': admin_metrics(last),
+    }
+
+
+def _run_worker(job):
+    return run_sessions(*job)
+
+
+# ジャーナルはプロセスごとに別のファイルにする（1ファイル1プロセスの前提）
+def _init_worker(work_dir):
+    os.environ["FAQ_JOURNAL_DIR"] = os.path.join(work_dir, f"journal_{os.getpid()}")
+
+
+# プロセスごとの数値を足し合わせる（RSS はプロセスごとの最大値）
+def merge_metrics(results):
+    merged = {}
+    for result in results:
+        for name, values in result['metrics'].items():
+            total = merged.setdefault(name, {})
+            for key, value in values.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total[key] = total.get(key, 0) + value
+    return merged
+
+
+# セッション数 sessions で1回計測する。fresh=True なら1プロセスでも子プロセスで流す
+def measure(sessions, paths, args, work_dir, fresh=False):
+    processes = max(1, min(args.processes, sessions))
+    jobs = [(list(range(sessions))[p::processes], paths, args.iterations, args.timeout)
+            for p in range(processes)]
+    if processes == 1 and not fresh:
+        results = [_run_worker(jobs[0])]
+    else:
+        with multiprocessing.get_context("spawn").Pool(processes, initializer=_init_worker,
+                                                         initargs=(work_dir,)) as pool:
+            results = pool.map(_run_worker, jobs)
+
+    latencies = sorted(x for r in results for x in r['latencies'])
+    errors = [e for r in results for e in r['errors']]
+    elapsed = max(r['elapsed_sec'] for r in results)
+    return {
+        'sessions': sessions,
+        'processes': processes,
+        'paths': paths,
+        'reruns': len(latencies),
+        'elapsed_sec': round(elapsed, 3),
+        'warmup_sec': round(max(r['warmup_sec'] for r in results), 3),
+        'throughput_reruns_per_sec': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'latency_ms': {
+            'p50': round(percentile(latencies, 50) * 1000, 1),
+            'p95': round(percentile(latencies, 95) * 1000, 1),
+            'p99': round(percentile(latencies, 99) * 1000, 1),
+            'max': round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        },
+        'peak_rss_mib': round(max(r['peak_rss_mib'] for r in results), 1),
+        'errors': len(errors),
+        'error_samples': errors[:5],
+        'metrics': merge_metrics(results),
+    }
+
+
+def print_report(report):
+    print(f"セッション数: {report['sessions']}（{report['processes']}プロセス）  手順: {', '.join(report['paths'])}")
+    print(f"再実行: {report['reruns']}回 / {report['elapsed_sec']}s（{report['throughput_reruns_per_sec']} 回/秒）"
+          f"  起動時の読み込み: {report['warmup_sec']}s")
+    lat = report['latency_ms']
+    print(f"再実行の所要時間: p50 {lat['p50']}ms  p95 {lat['p95']}ms  p99 {lat['p99']}ms  最大 {lat['max']}ms")
+    print(f"最大 RSS（1プロセスあたり）: {report['peak_rss_mib']} MiB  エラー: {report['errors']}件")
+    for sample in report['error_samples']:
+        print(f"  - {sample}")
+    backend = report['metrics'].get('backend', {})
+    client = report['metrics'].get('client', {})
+    journal = report['metrics'].get('journal', {})
+    print(f"模擬シートの呼び出し: 読み込み {backend.get('read', 0)}回  書き込み {backend.get('write', 0)}回"
+          f"  429 {backend.get('quota_errors', 0)}回  タイムアウト {backend.get('timeouts', 0)}回")
+    if client:
+        print(f"API クライアント: リクエスト {client.get('requests', 0)}回  相乗り {client.get('coalesced', 0)}回"
+              f"  再試行 {client.get('retries', 0)}回")
+    if journal:
+        print(f"ジャーナル: 記録 {journal.get('appended', 0)}件  送信済み {journal.get('sent', 0)}件"
+              f"  未送信 {journal.get('pending', 0)}件")
+
+
+# セッション数ごとの所要時間を1行ずつ並べる
+def print_sweep(reports):
+    print(f"手順: {', '.join(reports[0]['paths'])}")
+    print(f"{'セッション数':>6}  {'再実行':>6}  {'回/秒':>8}  {'p50':>8}  {'p95':>8}  {'p99':>8}  {'最大':>6}  エラー")
+    for report in reports:
+        lat = report['latency_ms']
+        print(f"{report['sessions']:>12}  {report['reruns']:>9}  {report['throughput_reruns_per_sec']:>10}"
+              f"  {lat['p50']:>8}  {lat['p95']:>8}  {lat['p99']:>8}  {lat['max']:>8}  {report['errors']}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="複数セッションでアプリを操作して負荷を計測する")
+    parser.add_argument("--sessions", default="4", help="セッション数（カンマ区切りで複数渡すと数ごとに計測）")
+    parser.add_argument("--iterations", type=int, default=3)
+    parser.add_argument("--processes", type=int, default=1, help="セッションを分けて流すプロセス数")
+    parser.add_argument("--paths", default=",".join(CLICK_PATHS), help="カンマ区切り: " + ",".join(CLICK_PATHS))
+    parser.add_argument("--latency", type=float, default=0.0, help="模擬シートの応答遅延（秒）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模擬シートが 429 を返す割合")
+    parser.add_argument("--quota", type=int, default=None, help="模擬シートの1分あたりの上限")
+    parser.add_argument("--snapshot-dir", default=None, help="事前ビルド済みスナップショット（省略時は模擬シートから読む）")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--json", action="store_true", help="結果を JSON で出力")
+    args = parser.parse_args(argv)
+
+    paths = [p for p in args.paths.split(",") if p]
+    sweep = [int(n) for n in args.sessions.split(",") if n]
+    work_dir = tempfile.mkdtemp(prefix="faq_load_")
+    os.environ.update({
+        "FAQ_SHEETS_BACKEND": "local",
+        "FAQ_EMULATOR_LATENCY": str(args.latency),
+        "FAQ_EMULATOR_ERROR_RATE": str(args.error_rate),
+        "FAQ_SNAPSHOT_DIR": args.snapshot_dir or os.path.join(work_dir, "snapshot"),
+        "FAQ_JOURNAL_DIR": os.path.join(work_dir, "journal"),
+        "FAQ_ADMIN": "1",
+    })
+    if args.quota:
+        os.environ["FAQ_EMULATOR_QUOTA"] = str(args.quota)
+
+    reports = [measure(n, paths, args, work_dir, fresh=len(sweep) > 1) for n in sweep]
+
+    if args.json:
+        print(json.dumps(reports[0] if len(reports) == 1 else reports, ensure_ascii=False, indent=2))
+        return
+    if len(reports) == 1:
+        print_report(reports[0])
+    else:
+        print_sweep(reports)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
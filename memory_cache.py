@@ -0,0 +1,201 @@
+import mmap
+import os
+import sys
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from itertools import islice
+
+import numpy as np
+from scipy import sparse
+
+# -------------------------------
+# 🧠 容量上限つきキャッシュ（バイト数の見積もり＋LRU / TTL で追い出す）
+# -------------------------------
+# ・キャッシュごとにバイト数の上限（max_bytes）と件数の上限（max_entries）、有効期限（ttl 秒）を持つ
+# ・入れるときに大きさを見積もり、上限を超えたら最後に使ってから長いものから追い出す
+# ・期限切れは引いたときと追加のときに捨てる
+# ・作成したキャッシュは一覧（cache_stats）に載り、管理画面で中身の大きさを確認できる
+SAMPLE_ITEMS = 64  # 要素がこれより多い入れ物は、この数だけ見積もって全体を推定する
+MAX_VISITS = 50000  # 1回の見積もりで中まで見るオブジェクト数（深い木でも時間が一定になるように）
+
+_caches = weakref.WeakSet()
+
+
+def env_megabytes(name, default):
+    try:
+        return int(float(os.getenv(name, "") or default) * 1024 * 1024)
+    except ValueError:
+        return int(default * 1024 * 1024)
+
+
+def env_seconds(name, default):
+    try:
+        return float(os.getenv(name, "") or default)
+    except ValueError:
+        return float(default)
+
+
+# -------------------------------
+# 📏 大きさの見積もり
+# -------------------------------
+# 大きな入れ物は一部の要素だけを測って件数倍する（100k 行でも数ミリ秒で終わるように）。
+# mmap した成果物の上の memoryview はページキャッシュで共有されるので数えない
+def estimate_size(obj, _seen=None):
+    seen = {} if _seen is None else _seen
+    if id(obj) in seen:
+        return 0
+    if len(seen) >= MAX_VISITS:
+        return sys.getsizeof(obj)
+    seen[id(obj)] = obj  # 測り終えるまで参照を持つ（一時的なタプルの id が使い回されないように）
+    if isinstance(obj, (str, bytes, int, float, bool, type(None))):
+        return sys.getsizeof(obj)
+    if isinstance(obj, np.ndarray):
+        return 0 if isinstance(obj.base, (memoryview, mmap.mmap)) else obj.nbytes
+    if isinstance(obj, memoryview):
+        return 0
+    if sparse.issparse(obj):
+        return sum(getattr(obj, name).nbytes for name in ('data', 'indices', 'indptr') if hasattr(obj, name))
+    # 入れ物は中身を一度に写してから測る（裏のスレッドが属性・要素を足しても途中で崩れない）
+    if isinstance(obj, dict):
+        items = list(obj.items())
+        return sys.getsizeof(obj) + _sampled(items, len(items), seen)
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        items = obj if isinstance(obj, (list, tuple)) else list(obj)
+        return sys.getsizeof(obj) + _sampled(items, len(items), seen)
+    if isinstance(obj, (threading.Thread, type(threading.Lock()))):
+        return 0
+    state = getattr(obj, '__dict__', None)
+    if state is None:
+        return sys.getsizeof(obj)
+    items = list(state.items())
+    return sys.getsizeof(obj) + _sampled(items, len(items), seen)
+
+
+def _sampled(items, count, seen):
+    if count == 0:
+        return 0
+    if count <= SAMPLE_ITEMS:
+        return sum(estimate_size(item, seen) for item in items)
+    if isinstance(items, (list, tuple)):
+        step = count // SAMPLE_ITEMS
+        sample = items[::step][:SAMPLE_ITEMS]
+    else:
+        sample = list(islice(items, SAMPLE_ITEMS))
+    return int(sum(estimate_size(item, seen) for item in sample) * count / len(sample))
+
+
+# -------------------------------
+# 🗄 キャッシュ本体
+# -------------------------------
+class BoundedCache:
+    def __init__(self, name, max_bytes=None, max_entries=None, ttl=None, sizeof=estimate_size, clock=time.monotonic):
+        self.name = name
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()  # キー → (値, 大きさ, 入れた時刻)。末尾ほど最近使った
+        self.bytes = 0
+        self.building = {}            # キー → 作成中の Lock（同じキーを同時に作らない）
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'rejected': 0}
+        _caches.add(self)
+
+    def _expired(self, stored_at):
+        return self.ttl is not None and self.clock() - stored_at > self.ttl
+
+    def _drop(self, key, counter=None):
+        value, size, _ = self.entries.pop(key)
+        self.bytes -= size
+        if counter:
+            self.counters[counter] += 1
+
+    def get(self, key, default=None, count=True):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self._expired(entry[2]):
+                self._drop(key, 'expirations')
+                entry = None
+            if entry is None:
+                if count:
+                    self.counters['misses'] += 1
+                return default
+            self.entries.move_to_end(key)
+            if count:
+                self.counters['hits'] += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        with self.lock:
+            if key in self.entries:
+                self._drop(key)
+            if self.max_bytes is not None and size > self.max_bytes:
+                self.counters['rejected'] += 1  # 1件で上限を超えるものは入れない
+                return value
+            self.entries[key] = (value, size, self.clock())
+            self.bytes += size
+            self._evict()
+        return value
+
+    def _evict(self):
+        if self.ttl is not None:
+            for key in [k for k, (_, _, stored_at) in self.entries.items() if self._expired(stored_at)]:
+                self._drop(key, 'expirations')
+        while self.entries and ((self.max_bytes is not None and self.bytes > self.max_bytes)
+                                or (self.max_entries is not None and len(self.entries) > self.max_entries)):
+            self._drop(next(iter(self.entries)), 'evictions')
+
+    # 無ければ factory() で作って入れる。同じキーを同時に頼まれても作るのは1回
+    def get_or_create(self, key, factory):
+        missing = object()
+        value = self.get(key, missing)
+        if value is not missing:
+            return value
+        with self.lock:
+            building = self.building.setdefault(key, threading.Lock())
+        with building:
+            value = self.get(key, missing, count=False)  # 待っている間に他のスレッドが作った
+            if value is missing:
+                value = self.put(key, factory())
+        with self.lock:
+            self.building.pop(key, None)
+        return value
+
+    def pop(self, key, default=None):
+        with self.lock:
+            if key not in self.entries:
+                return default
+            value = self.entries[key][0]
+            self._drop(key)
+            return value
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self.lock:
+            self._evict()
+            stats = {
+                'name': self.name,
+                'entries': len(self.entries),
+                'bytes': self.bytes,
+                'max_bytes': self.max_bytes,
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+            }
+            stats.update(self.counters)
+        return stats
+
+
+def cache_stats():
+    return sorted((cache.stats() for cache in list(_caches)), key=lambda s: s['name'])
@@ -0,0 +1,309 @@
+# -------------------------------
+# 📉 検索ヒットなしの集計（ログを前回の続きから読み、小さな要約だけを保存する）
+# -------------------------------
+# 使い方:
+#   python miss_analytics.py                 # 続きを集計して上位を表示（アプリは裏で同じ集計を定期的に行う）
+#   python miss_analytics.py --limit 20
+# ・読み取り元はシート "log"（行番号）と logs/unmatched_queries.log（バイト位置）。
+#   読んだ位置は要約に保存し、次回はその続きだけを読む（全件のダウンロードはしない）
+# ・クエリは NFKC・小文字・読み（ひらがな・濁音正規化）に揃えて数える（バルブ／ばるぶ／ﾊﾞﾙﾌﾞ は同じ）
+# ・カテゴリごとの件数は MISS_KEEP 件まで残し、超えたら少ないものから捨てる（裾の件数は近似）
+# ・日ごとの件数を MISS_BUCKET_DAYS 日分持つ（日時の無い行は読んだ日に数える）
+# ・件数の多い MISS_CHECK 件を最新のスナップショットで引き直し、今はヒットするものに印をつける
+# 要約は1つの JSON（logs/miss_summary.json）。管理画面はメモリ上の要約をそのまま表示する
+# 要約のファイルは1つのアプリのプロセスだけが書く前提（ジャーナルと同じ）
+import argparse
+import copy
+import json
+import os
+import sys
+import threading
+import time
+import unicodedata
+from datetime import datetime, timedelta
+from functools import lru_cache
+
+from faq_index import to_reading
+from faq_snapshot import ALL_CATEGORIES
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SUMMARY_FORMAT = 1
+MISS_KEEP = 500
+MISS_BUCKET_DAYS = 90
+MISS_CHECK = 50
+SHEET_FIRST_ROW = 2    # 1行目は見出し
+SHEET_READ_ROWS = 5000  # 1回に読むシートの行数
+UNKNOWN_CATEGORY = "（不明）"
+
+
+def summary_path():
+    return os.getenv("FAQ_MISS_SUMMARY", os.path.join(BASE_DIR, "logs", "miss_summary.json"))
+
+
+def log_file_path():
+    return os.getenv("FAQ_MISS_LOG_FILE", os.path.join(BASE_DIR, "logs", "unmatched_queries.log"))
+
+
+# 同じ語が何度も出てくるので、語ごとの読みは覚えておく
+@lru_cache(maxsize=8192)
+def word_reading(word):
+    return to_reading(word)
+
+
+def normalize_query(query):
+    words = unicodedata.normalize('NFKC', str(query)).lower().split()
+    return ' '.join(word_reading(w) for w in words)
+
+
+def empty_summary():
+    return {
+        'format': SUMMARY_FORMAT,
+        'updated_at': None,
+        'offsets': {'sheet': SHEET_FIRST_ROW, 'file': 0},
+        'categories': {},  # カテゴリ → {'total': 件数, 'misses': {正規化したクエリ: [件数, 最後の表記, 最後の日時]}}
+        'days': {},        # カテゴリ → {日付: 件数}
+        'answered': {},    # カテゴリ → 今はヒットする正規化したクエリ
+        'checked_versions': {},
+    }
+
+
+def load_summary(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return empty_summary()
+    if summary.get('format') != SUMMARY_FORMAT:
+        return empty_summary()
+    return summary
+
+
+def save_summary(summary, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(summary, f, ensure_ascii=False, separators=(',', ':'))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# シート "log" の start 行目から SHEET_READ_ROWS 行（アプリでは API クライアントを通して呼ぶ）
+def read_log_rows(backend, client, start):
+    ws = backend.worksheet("log")
+    return client.call(lambda: ws.get_values(f"A{start}:C{start + SHEET_READ_ROWS - 1}"))
+
+
+class MissAnalytics:
+    def __init__(self, read_sheet_rows=None, log_file=None, get_snapshot=None, get_synonyms=None, path=None,
+                 keep=MISS_KEEP, bucket_days=MISS_BUCKET_DAYS, check=MISS_CHECK, clock=time.time):
+        self.read_sheet_rows = read_sheet_rows  # 開始行 → 行のリスト（[カテゴリ, クエリ, 日時]）
+        self.log_file = log_file
+        self.get_snapshot = get_snapshot        # カテゴリ → 最新の Snapshot（今はヒットするかの確認用）
+        self.get_synonyms = get_synonyms
+        self.path = path or summary_path()
+        self.keep = keep
+        self.bucket_days = bucket_days
+        self.check = check
+        self.clock = clock
+        self.lock = threading.Lock()
+        self.run_lock = threading.Lock()  # 集計は1つずつ
+        self.summary = load_summary(self.path)
+        self.counters = {'runs': 0, 'ingested': 0, 'failures': 0}
+        self.last_error = None
+        self.thread = None
+
+    def _today(self):
+        return datetime.fromtimestamp(self.clock()).strftime('%Y-%m-%d')
+
+    def ingest(self, summary, entries):
+        count = 0
+        today = self._today()
+        for category, query, stamp in entries:
+            key = normalize_query(query)
+            if not key:
+                continue
+            category = category or UNKNOWN_CATEGORY
+            stamp = str(stamp or '').strip()
+            day = stamp[:10] if len(stamp) >= 10 and stamp[4] == '-' else today
+            stats = summary['categories'].setdefault(category, {'total': 0, 'misses': {}})
+            stats['total'] += 1
+            miss = stats['misses'].setdefault(key, [0, '', ''])
+            miss[0] += 1
+            miss[1] = str(query).strip()
+            miss[2] = stamp or today
+            days = summary['days'].setdefault(category, {})
+            days[day] = days.get(day, 0) + 1
+            count += 1
+        self._prune(summary)
+        return count
+
+    def _prune(self, summary):
+        for stats in summary['categories'].values():
+            misses = stats['misses']
+            if len(misses) > 2 * self.keep:
+                top = sorted(misses.items(), key=lambda item: (-item[1][0], item[0]))[:self.keep]
+                stats['misses'] = dict(top)
+        oldest = (datetime.fromtimestamp(self.clock()) - timedelta(days=self.bucket_days)).strftime('%Y-%m-%d')
+        for days in summary['days'].values():
+            for day in [d for d in days if d < oldest]:
+                del days[day]
+
+    def _consume_sheet(self, summary):
+        offsets = summary['offsets']
+        total = 0
+        while True:
+            rows = self.read_sheet_rows(offsets['sheet'])
+            if not any(rows):  # gspread は空の範囲を [[]] で返す
+                return total
+            total += self.ingest(summary, [(row + ['', '', ''])[:3] for row in rows])
+            offsets['sheet'] += len(rows)
+            if len(rows) < SHEET_READ_ROWS:
+                return total
+
+    # 改行で終わった行だけ読む（書きかけの最後の行は次回に回す）。ファイルが縮んだら最初から
+    def _consume_file(self, summary):
+        offsets = summary['offsets']
+        try:
+            size = os.path.getsize(self.log_file)
+        except OSError:
+            return 0
+        if size < offsets['file']:
+            offsets['file'] = 0
+        with open(self.log_file, "rb") as f:
+            f.seek(offsets['file'])
+            data = f.read()
+        end = data.rfind(b'\n') + 1
+        entries = []
+        for line in data[:end].decode('utf-8', errors='replace').splitlines():
+            fields = line.split('\t')
+            # 「カテゴリ<TAB>クエリ<TAB>日時」か、クエリだけの行
+            entries.append((fields + ['', ''])[:3] if len(fields) > 1 else ('', fields[0], ''))
+        offsets['file'] += end
+        return self.ingest(summary, entries)
+
+    def _answered(self, snapshots, query, synonyms):
+        for snapshot in snapshots:
+            if snapshot.search(query, 'AND', synonyms):
+                return True
+        return False
+
+    # 件数の多いクエリを今の索引で引き直す。全カテゴリ・不明のログはどれかのカテゴリでヒットすれば印をつける
+    def _mark_answered(self, summary):
+        snapshots = {}
+        for category in ALL_CATEGORIES:
+            try:
+                snapshots[category] = self.get_snapshot(category)
+            except Exception:
+                continue
+        synonyms = self.get_synonyms() if self.get_synonyms is not None else None
+        answered = {}
+        for category, stats in summary['categories'].items():
+            targets = [snapshots[category]] if category in snapshots else list(snapshots.values())
+            top = sorted(stats['misses'].items(), key=lambda item: (-item[1][0], item[0]))[:self.check]
+            answered[category] = [key for key, miss in top if self._answered(targets, miss[1], synonyms)]
+        summary['answered'] = answered
+        summary['checked_versions'] = {c: s.version for c, s in snapshots.items()}
+
+    # 要約の写しに足し込んでから差し替える（集計中も管理画面はすぐ読める）
+    def run_once(self):
+        with self.run_lock:
+            with self.lock:
+                summary = copy.deepcopy(self.summary)
+            ingested = 0
+            errors = []
+            # 片方の読み取り元が失敗しても、もう片方は進める（読めた分だけ位置を進める）
+            for name, consume in (("log", self._consume_sheet if self.read_sheet_rows else None),
+                                  ("file", self._consume_file if self.log_file else None)):
+                if consume is None:
+                    continue
+                try:
+                    ingested += consume(summary)
+                except Exception as e:
+                    errors.append(f"{name}: {type(e).__name__}: {e}")
+            if self.get_snapshot is not None:
+                self._mark_answered(summary)
+            summary['updated_at'] = datetime.fromtimestamp(self.clock()).strftime('%Y-%m-%d %H:%M:%S')
+            save_summary(summary, self.path)
+            with self.lock:
+                self.summary = summary
+                self.counters['runs'] += 1
+                self.counters['ingested'] += ingested
+                self.counters['failures'] += bool(errors)
+                self.last_error = "; ".join(errors) or self.last_error
+        return ingested
+
+    def start(self, interval):
+        if self.thread is None and interval > 0:
+            self.thread = threading.Thread(target=self._run, args=(interval,), name="miss-analytics", daemon=True)
+            self.thread.start()
+        return self
+
+    def _run(self, interval):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                with self.lock:
+                    self.counters['failures'] += 1
+                    self.last_error = f"{type(e).__name__}: {e}"
+            time.sleep(interval)
+
+    # カテゴリごとの上位（件数の多い順）
+    def top_misses(self, limit=10):
+        with self.lock:
+            rows = []
+            for category in sorted(self.summary['categories']):
+                answered = set(self.summary['answered'].get(category, []))
+                misses = self.summary['categories'][category]['misses']
+                top = sorted(misses.items(), key=lambda item: (-item[1][0], item[0]))[:limit]
+                rows.extend({'カテゴリ': category, 'クエリ': miss[1], '件数': miss[0], '最終': miss[2],
+                             '今は見つかる': key in answered} for key, miss in top)
+            return rows
+
+    # 直近 days 日の日ごとの件数（カテゴリ → {日付: 件数}、件数の無い日は 0）
+    def trend(self, days=30):
+        today = datetime.fromtimestamp(self.clock())
+        dates = [(today - timedelta(days=n)).strftime('%Y-%m-%d') for n in range(days - 1, -1, -1)]
+        with self.lock:
+            return {category: {d: counts.get(d, 0) for d in dates}
+                    for category, counts in sorted(self.summary['days'].items())}
+
+    def status(self):
+        with self.lock:
+            status = dict(self.counters)
+            status['updated_at'] = self.summary['updated_at']
+            status['offsets'] = dict(self.summary['offsets'])
+            status['totals'] = {c: s['total'] for c, s in self.summary['categories'].items()}
+            status['last_error'] = self.last_error
+        return status
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="検索ヒットなしのログを前回の続きから集計する")
+    parser.add_argument("--summary", default=summary_path())
+    parser.add_argument("--log-file", default=log_file_path())
+    parser.add_argument("--no-sheet", action="store_true", help="シート \"log\" を読まない")
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    from snapshot_store import load_snapshot_artifact
+
+    read_sheet_rows = None
+    if not args.no_sheet:
+        from faq_app import get_backend, get_sheets_client
+
+        read_sheet_rows = lambda start: read_log_rows(get_backend(), get_sheets_client(), start)
+    snapshots = load_snapshot_artifact() or {}
+    analytics = MissAnalytics(read_sheet_rows, args.log_file, snapshots.__getitem__ if snapshots else None,
+                              path=args.summary)
+    start = time.perf_counter()
+    ingested = analytics.run_once()
+    print(f"✅ {ingested}件を集計しました（{time.perf_counter() - start:.2f}s）→ {args.summary}")
+    for row in analytics.top_misses(args.limit):
+        mark = " ✅今は見つかる" if row['今は見つかる'] else ""
+        print(f"- [{row['カテゴリ']}] {row['クエリ']}: {row['件数']}件（最終 {row['最終']}）{mark}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,703 @@
+import json
+import os
+import random
+import re
+import threading
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import deque
+from datetime import datetime, timedelta
+from functools import partial
+
+import gspread
+import openpyxl
+from google.auth.transport.requests import AuthorizedSession
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+
+from faq_snapshot import JOURNAL_ID_COLUMN, JOURNAL_KINDS, SHEET_SCHEMAS, category_kind
+from memory_cache import BoundedCache
+
+# -------------------------------
+# 🔌 ワークシートの取得先（Googleスプレッドシート / ローカルの模擬シート）
+# -------------------------------
+# アプリが使うのは worksheet(シート名) が返すオブジェクトの get_all_values() と append_rows() だけ。
+# 取得先を差し替えられるようにして、認証情報の無い環境でも同じ経路（クライアント・ジャーナル・
+# スナップショット）を通して動かせるようにする
+#   FAQ_SHEETS_BACKEND=gspread（既定）… 従来どおり Googleスプレッドシート
+#   FAQ_SHEETS_BACKEND=local        … 同梱の .xlsx を種にしたメモリ上の模擬シート
+#   FAQ_SHEETS_BACKEND=xlsx         … FAQ_XLSX_DIR の .xlsx を読み書きする（ネットワーク無しの本番運用）
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# カテゴリ → ローカルのブック（無いものは空として扱う）
+LOCAL_WORKBOOKS = {
+    "工事関係": "faq.xlsx",
+    "事務関係": "faq2.xlsx",
+    "その他": "other_faq.xlsx",
+    "パト指摘事項": "patrol.xlsx",
+    "トラブル事例": "trouble.xlsx",
+}
+
+# 検索ヒットなしのログ（シート名 "log"）の見出し
+LOG_HEADER = ['カテゴリ', 'クエリ', '日時']
+
+
+# ブックが無いシートの見出し（アプリから行を足すシートには登録ID の列も付ける）
+def seed_header(sheet_name):
+    if sheet_name == "log":
+        return LOG_HEADER + [JOURNAL_ID_COLUMN]
+    kind = category_kind(sheet_name)
+    if kind is None:
+        raise KeyError(f"シート「{sheet_name}」はありません")
+    return SHEET_SCHEMAS[kind] + ([JOURNAL_ID_COLUMN] if kind in JOURNAL_KINDS else [])
+
+
+# "{最初の列}{開始行}:{最後の列}{最後の行}" の範囲を (開始位置, 終了位置, 最初の列の位置, 最後の列の位置の次) に
+# する（最後の行は省略可）。模擬シート・.xlsx の get_values が受け付けるのはこの形だけ
+def parse_range(range_name):
+    match = re.fullmatch(r'([A-Z]+)(\d+):([A-Z]+)(\d*)', range_name)
+    if match is None:
+        raise ValueError(f"対応していない範囲です: {range_name}")
+    return (int(match.group(2)) - 1, int(match.group(4)) if match.group(4) else None,
+            column_number(match.group(1)) - 1, column_number(match.group(3)))
+
+
+def column_number(letters):
+    number = 0
+    for letter in letters:
+        number = number * 26 + ord(letter) - ord('A') + 1
+    return number
+
+
+def column_letter(number):
+    letters = ''
+    while number:
+        number, rest = divmod(number - 1, 26)
+        letters = chr(ord('A') + rest) + letters
+    return letters
+
+
+def slice_range(values, range_name):
+    start, end, first, last = parse_range(range_name)
+    return [list(row[first:last]) for row in values[start:end]]
+
+
+# append_rows の応答（シート API と同じく、追加した範囲を updates.updatedRange に入れる）
+def append_response(title, first_row, rows):
+    width = max((len(row) for row in rows), default=1)
+    last_row = first_row + len(rows) - 1
+    return {'updates': {'updatedRange': f"'{title}'!A{first_row}:{column_letter(width)}{last_row}",
+                        'updatedRows': len(rows)}}
+
+
+# 応答から追加した最後の行番号を取り出す（分からなければ None）
+def appended_end_row(response):
+    try:
+        updated = response['updates']['updatedRange']
+    except (KeyError, TypeError):
+        return None
+    match = re.search(r'(\d+)$', updated)
+    return int(match.group(1)) if match else None
+
+
+def cell_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+# -------------------------------
+# 📖 .xlsx の読み込み（ZIP 内の XML を行ごとに流し読み）
+# -------------------------------
+# openpyxl の read_only より軽く速い。読むのは1枚目のシートの値だけで、
+# 共有文字列のふりがな（rPh）は除き、日付の書式のセルは日時の文字列にする
+XLSX_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+XLSX_REL_NS = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+PKG_REL_NS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+DATE_FORMAT_IDS = set(range(14, 23)) | {45, 46, 47}
+EXCEL_EPOCH = datetime(1899, 12, 30)
+
+
+def _first_sheet_path(zf):
+    workbook = ET.fromstring(zf.read('xl/workbook.xml'))
+    sheet = workbook.find(f'{XLSX_NS}sheets/{XLSX_NS}sheet')
+    rel_id = sheet.get(f'{XLSX_REL_NS}id')
+    rels = ET.fromstring(zf.read('xl/_rels/workbook.xml.rels'))
+    for rel in rels.iter(f'{PKG_REL_NS}Relationship'):
+        if rel.get('Id') == rel_id:
+            target = rel.get('Target')
+            return target.lstrip('/') if target.startswith('/') else 'xl/' + target
+    return 'xl/worksheets/sheet1.xml'
+
+def _rich_text(elem):
+    # <t> 直下と書式付きの部分 <r><t> だけを連結（<rPh> のふりがなは含めない）
+    return ''.join(child.text or '' for child in elem if child.tag == f'{XLSX_NS}t') + \
+        ''.join(t.text or '' for r in elem.iter(f'{XLSX_NS}r') for t in r.iter(f'{XLSX_NS}t'))
+
+def _shared_strings(zf):
+    if 'xl/sharedStrings.xml' not in zf.namelist():
+        return []
+    strings = []
+    for _, elem in ET.iterparse(zf.open('xl/sharedStrings.xml')):
+        if elem.tag == f'{XLSX_NS}si':
+            strings.append(_rich_text(elem))
+            elem.clear()
+    return strings
+
+# 書式の番号（cellXfs の並び）→ 日付の書式か
+def _date_styles(zf):
+    if 'xl/styles.xml' not in zf.namelist():
+        return []
+    styles = ET.fromstring(zf.read('xl/styles.xml'))
+    custom = {}
+    for fmt in styles.iter(f'{XLSX_NS}numFmt'):
+        code = re.sub(r'"[^"]*"|\[[^\]]*\]|\\.', '', fmt.get('formatCode', '')).lower()
+        custom[int(fmt.get('numFmtId'))] = bool(re.search(r'[ymdhs]', code))
+    xfs = styles.find(f'{XLSX_NS}cellXfs')
+    if xfs is None:
+        return []
+    flags = []
+    for xf in xfs.iter(f'{XLSX_NS}xf'):
+        fmt_id = int(xf.get('numFmtId', 0))
+        flags.append(fmt_id in DATE_FORMAT_IDS or custom.get(fmt_id, False))
+    return flags
+
+def _column_index(ref):
+    n = 0
+    for ch in ref:
+        if not ch.isalpha():
+            break
+        n = n * 26 + ord(ch.upper()) - 64
+    return n - 1
+
+def _number_text(text, is_date):
+    value = float(text)
+    if is_date:
+        return str(EXCEL_EPOCH + timedelta(days=value))
+    return cell_text(value) if value.is_integer() else text
+
+def iter_xlsx_rows(path):
+    with zipfile.ZipFile(path) as zf:
+        strings = _shared_strings(zf)
+        date_styles = _date_styles(zf)
+        next_row = 1
+        for _, elem in ET.iterparse(zf.open(_first_sheet_path(zf))):
+            if elem.tag != f'{XLSX_NS}row':
+                continue
+            row_number = int(elem.get('r', next_row))
+            while next_row < row_number:  # 値の無い行も空行として返す
+                yield []
+                next_row += 1
+            cells = []
+            for c in elem.iter(f'{XLSX_NS}c'):
+                pos = _column_index(c.get('r')) if c.get('r') else len(cells)
+                kind = c.get('t', 'n')
+                v = c.find(f'{XLSX_NS}v')
+                if kind == 'inlineStr':
+                    is_elem = c.find(f'{XLSX_NS}is')
+                    text = _rich_text(is_elem) if is_elem is not None else ''
+                elif v is None or v.text is None:
+                    text = ''
+                elif kind == 's':
+                    text = strings[int(v.text)]
+                elif kind == 'b':
+                    text = 'True' if v.text == '1' else 'False'
+                elif kind == 'n':
+                    style = int(c.get('s', 0))
+                    text = _number_text(v.text, style < len(date_styles) and date_styles[style])
+                else:  # str（数式の文字列結果）・e（エラー値）
+                    text = v.text
+                cells.extend([''] * (pos - len(cells)))
+                cells.append(text.strip())
+            elem.clear()
+            next_row = row_number + 1
+            yield cells
+
+# 1枚目のシートのセルを文字列の行のリストで返す（シートの get_all_values と同じ形）
+def read_xlsx_values(path):
+    return list(iter_xlsx_rows(path))
+
+
+# -------------------------------
+# 🔑 Googleスプレッドシートへの接続（全シート・全スプレッドシートで1つを共有）
+# -------------------------------
+# ・認証情報と HTTP のセッション（keep-alive の接続プール）はプロセスに1つだけ作る
+# ・スプレッドシートは ID ごとに1回だけ開き、ワークシートはそこから引く（どちらも期限つきで持つ）
+# ・部署ごとに別のスプレッドシートを使うときも同じセッションを通す
+#   （宛先のホストは同じなので、ID が増えても接続は増えない）
+# ・トークンの更新は1スレッドだけが行い、待っていたスレッドは更新後のトークンをそのまま使う
+SHEETS_SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive",
+]
+
+
+class SharedCredentials(Credentials):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.refresh_lock = threading.Lock()
+        self.refreshes = 0
+
+    def refresh(self, request):
+        stale = self.token
+        with self.refresh_lock:
+            if self.token is not stale and self.valid:
+                return  # 待っている間に他のスレッドが更新した
+            super().refresh(request)
+            self.refreshes += 1
+
+
+class SpreadsheetPool:
+    # load_credentials() → (認証情報, 既定のスプレッドシート ID, 部署 → ID, シート名 → 部署)。
+    # 最初にシートを引くときに1回だけ呼ぶ（スナップショットだけで動くときは認証情報を読まない）
+    def __init__(self, load_credentials, pool_size=10, ttl=None):
+        self.load_credentials = load_credentials
+        self.pool_size = pool_size
+        self.spreadsheets = BoundedCache("スプレッドシート", max_entries=16, ttl=ttl)
+        self.worksheets = BoundedCache("ワークシート", max_entries=64, ttl=ttl)
+        self.lock = threading.Lock()
+        self.connect_lock = threading.Lock()
+        self.connected = False
+        self.counters = {'spreadsheets_opened': 0, 'worksheets_opened': 0}
+
+    def _connect(self):
+        with self.connect_lock:
+            if self.connected:
+                return
+            creds_info, spreadsheet_id, units, sheet_units = self.load_credentials()
+            self.spreadsheet_id = spreadsheet_id        # 既定のスプレッドシート
+            self.units = dict(units or {})              # 部署 → スプレッドシート ID
+            self.sheet_units = dict(sheet_units or {})  # シート名 → 部署（既定以外に置いたシート）
+            self.credentials = SharedCredentials.from_service_account_info(creds_info, scopes=SHEETS_SCOPES)
+            self.session = AuthorizedSession(self.credentials)
+            self.adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+            self.session.mount("https://", self.adapter)
+            self.client = gspread.authorize(None, session=self.session)
+            self.connected = True
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def spreadsheet_id_for(self, sheet_name, unit=None):
+        unit = unit or self.sheet_units.get(sheet_name)
+        if unit is None:
+            return self.spreadsheet_id
+        if unit not in self.units:
+            raise KeyError(f"部署「{unit}」のスプレッドシートIDが設定されていません")
+        return self.units[unit]
+
+    def _open_spreadsheet(self, spreadsheet_id):
+        self._count('spreadsheets_opened')
+        return self.client.open_by_key(spreadsheet_id)
+
+    def _open_worksheet(self, spreadsheet_id, sheet_name):
+        spreadsheet = self.spreadsheets.get_or_create(spreadsheet_id, partial(self._open_spreadsheet, spreadsheet_id))
+        self._count('worksheets_opened')
+        return spreadsheet.worksheet(sheet_name)
+
+    def worksheet(self, sheet_name, unit=None):
+        self._connect()
+        spreadsheet_id = self.spreadsheet_id_for(sheet_name, unit)
+        return self.worksheets.get_or_create((spreadsheet_id, sheet_name),
+                                             partial(self._open_worksheet, spreadsheet_id, sheet_name))
+
+    # 実際に張った接続の数（urllib3 の接続プールごとの合計）
+    def connections(self):
+        pools = self.adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in list(pools.keys()))
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counters)
+        metrics['connected'] = self.connected
+        if not self.connected:
+            return metrics
+        metrics['spreadsheets'] = 1 + len(self.units)
+        metrics['token_refreshes'] = self.credentials.refreshes
+        metrics['connections'] = self.connections()
+        return metrics
+
+
+class GspreadBackend:
+    def __init__(self, pool):
+        self.pool = pool  # 全シートで共有する SpreadsheetPool
+
+    def worksheet(self, sheet_name):
+        return self.pool.worksheet(sheet_name)
+
+    def metrics(self):
+        metrics = self.pool.metrics()
+        metrics['backend'] = 'gspread'
+        return metrics
+
+
+# -------------------------------
+# 🧪 模擬シート
+# -------------------------------
+# ・latency 秒（± jitter）待ってから応答する
+# ・quota_per_minute を超えた呼び出しと、error_rate の割合の呼び出しは 429 で失敗する
+# ・timeout_rate の割合の呼び出しは timeout 秒待って TimeoutError。書き込みは反映したあとで
+#   失敗させる（応答だけが失われた状態。ジャーナルの重複防止の確認用）
+# 書き込みはメモリ上だけで、.xlsx には書き戻さない
+class EmulatedAPIError(Exception):
+    def __init__(self, status_code, message):
+        super().__init__(f"{status_code}: {message}")
+        self.response = type('Response', (), {'status_code': status_code})()
+
+
+class EmulatedWorksheet:
+    def __init__(self, backend, title, values):
+        self.backend = backend
+        self.title = title
+        self.values = values
+
+    def get_all_values(self):
+        def read():
+            width = max((len(row) for row in self.values), default=0)
+            return [list(row) + [''] * (width - len(row)) for row in self.values]
+
+        return self.backend._call('read', read)
+
+    def get_values(self, range_name):
+        return self.backend._call('read', lambda: slice_range(self.values, range_name))
+
+    def append_rows(self, rows, **kwargs):
+        def append():
+            first_row = len(self.values) + 1
+            self.values.extend([str(v) for v in row] for row in rows)
+            return append_response(self.title, first_row, rows)
+
+        return self.backend._call('write', append)
+
+    def append_row(self, row, **kwargs):
+        return self.append_rows([row])
+
+
+class LocalSheetBackend:
+    def __init__(self, base_dir=BASE_DIR, latency=0.0, jitter=0.0, quota_per_minute=None, error_rate=0.0,
+                 timeout_rate=0.0, timeout=30.0, seed=None, clock=time.monotonic, sleep=time.sleep):
+        self.base_dir = base_dir
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.random = random.Random(seed)
+        self.clock = clock
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.sheets = {}
+        self.recent = deque()  # 直近1分の呼び出し時刻
+        self.counters = {'read': 0, 'write': 0, 'quota_errors': 0, 'timeouts': 0}
+
+    def _seed(self, sheet_name):
+        path = os.path.join(self.base_dir, LOCAL_WORKBOOKS.get(sheet_name, ''))
+        if sheet_name in LOCAL_WORKBOOKS and os.path.exists(path):
+            return read_xlsx_values(path)
+        return [seed_header(sheet_name)]
+
+    def worksheet(self, sheet_name):
+        with self.lock:
+            if sheet_name not in self.sheets:
+                self.sheets[sheet_name] = EmulatedWorksheet(self, sheet_name, self._seed(sheet_name))
+            return self.sheets[sheet_name]
+
+    def _call(self, op, fn):
+        with self.lock:
+            self.counters[op] += 1
+            now = self.clock()
+            while self.recent and now - self.recent[0] >= 60:
+                self.recent.popleft()
+            self.recent.append(now)
+            over_quota = self.quota_per_minute is not None and len(self.recent) > self.quota_per_minute
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if delay:
+            self.sleep(delay)
+        if over_quota or roll < self.error_rate:
+            self._count('quota_errors')
+            raise EmulatedAPIError(429, "Quota exceeded")
+        if roll < self.error_rate + self.timeout_rate:
+            self._count('timeouts')
+            if op == 'write':
+                with self.lock:
+                    fn()
+            self.sleep(self.timeout)
+            raise TimeoutError(f"模擬シートの{op}がタイムアウトしました")
+        with self.lock:
+            return fn()
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics['backend'] = 'local'
+            metrics['rows'] = {name: len(ws.values) for name, ws in self.sheets.items()}
+        return metrics
+
+
+# -------------------------------
+# 🗄 ローカルの .xlsx を正とする運用（ネットワークの無い現場向け）
+# -------------------------------
+# ・読み込みは流し読み（iter_xlsx_rows）で、更新時刻と大きさが変わっていなければ前回の結果を返す
+# ・書き込み（ジャーナルからの送信）はブックの隣の追記ファイル（"<ブック>.rows.jsonl"）に1行ずつ
+#   追記して fsync するだけにする。読み込みはブックの行のあとに追記ファイルの行を続けて返す
+# ・追記ファイルの行は、XLSX_MERGE_ROWS 行たまったとき、または最後の追記から XLSX_MERGE_SEC 秒たったとき
+#   （watch() の周期で確認）にまとめてブックへ移す。openpyxl はブック全体を読み込んで保存し直すので
+#   （行数に比例して重い）、1回の送信ごとには行わない。移したあとで落ちたときは、起動時にブックの末尾が
+#   追記ファイルの行と同じなら移し済みとして扱う
+# ・watch() はブックの更新を見張り、変わったシートを on_change(シート名, 値, 追加分の開始位置) で知らせる。
+#   既存の行がそのままで末尾に行が増えただけなら開始位置を渡す（それ以外は None＝全件読み直し）
+XLSX_MERGE_ROWS = int(os.getenv("FAQ_XLSX_MERGE_ROWS", "500"))
+XLSX_MERGE_SEC = float(os.getenv("FAQ_XLSX_MERGE_SEC", "60"))
+
+
+def side_file_path(path):
+    return path + ".rows.jsonl"
+
+
+# 追記ファイルの行（書きかけで落ちた最後の行は読み飛ばす）
+def read_side_rows(path):
+    rows = []
+    try:
+        with open(side_file_path(path), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except json.JSONDecodeError:
+                    continue
+    except FileNotFoundError:
+        pass
+    return rows
+
+
+# ブックの末尾がすでに追記ファイルの行と同じか（移したあと、追記ファイルを空にする前に落ちた）。
+# ブックから読んだセルは前後の空白を除いてあるので、そろえて比べる
+def already_merged(values, side):
+    return bool(side) and values[-len(side):] == [[str(v).strip() for v in row] for row in side]
+
+
+# ブックの行のあとに、まだブックへ移していない追記ファイルの行を続ける
+def read_workbook_values(path):
+    values = read_xlsx_values(path) if os.path.exists(path) else []
+    side = read_side_rows(path)
+    return values if already_merged(values, side) else values + side
+
+
+class XlsxWorksheet:
+    def __init__(self, backend, title, path):
+        self.backend = backend
+        self.title = title
+        self.path = path
+        self.side_path = side_file_path(path)
+        self.lock = threading.Lock()
+        self.stamp = None
+        self.values = None
+        self.book_stamp = None
+        self.book_values = None
+        self.side = None        # 追記ファイルの行（最初に使うときに読む）
+        self.side_file = None
+        self.last_append = 0.0
+
+    def _book_stamp(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _stamp(self):
+        with self.lock:
+            return (self._book_stamp(), len(self.side or ()))
+
+    def _load_side(self):
+        if self.side is not None:
+            return
+        self.side = read_side_rows(self.path)
+        if self.side and os.path.exists(self.path) and already_merged(read_xlsx_values(self.path), self.side):
+            self.side = []
+            self._clear_side()
+        self.side_file = open(self.side_path, "a", encoding="utf-8")
+
+    def _clear_side(self):
+        if self.side_file is not None:
+            self.side_file.close()
+        with open(self.side_path, "w", encoding="utf-8"):
+            pass
+        self.side_file = open(self.side_path, "a", encoding="utf-8")
+
+    # (更新時刻と大きさ・追記ファイルの行数, 値) を返す（変わっていなければ前回の結果）
+    def _read(self):
+        with self.lock:
+            self._load_side()
+            book_stamp = self._book_stamp()
+            if self.book_values is None or book_stamp != self.book_stamp:
+                if book_stamp is None:
+                    self.book_values = self.backend._seed_values(self.title)
+                else:
+                    self.book_values = read_xlsx_values(self.path)
+                    self.backend._count('parsed')
+                self.book_stamp = book_stamp
+            stamp = (book_stamp, len(self.side))
+            if self.values is None or stamp != self.stamp:
+                self.values = self.book_values + self.side
+                self.stamp = stamp
+            return self.stamp, self.values
+
+    def get_all_values(self):
+        self.backend._count('read')
+        return [list(row) for row in self._read()[1]]
+
+    def get_values(self, range_name):
+        self.backend._count('read')
+        return slice_range(self._read()[1], range_name)
+
+    def append_rows(self, rows, **kwargs):
+        self.backend._count('write')
+        rows = [[str(v) for v in row] for row in rows]
+        self._read()
+        with self.lock:
+            first_row = len(self.book_values) + len(self.side) + 1
+            for row in rows:
+                self.side_file.write(json.dumps(row, ensure_ascii=False) + "\n")
+            self.side_file.flush()
+            os.fsync(self.side_file.fileno())
+            self.side.extend(rows)
+            self.last_append = time.monotonic()
+            due = len(self.side) >= self.backend.merge_rows
+        if due:
+            try:
+                self.merge()
+            except OSError:
+                pass  # 追記ファイルには残っているので、次の機会に移す
+        return append_response(self.title, first_row, rows)
+
+    def append_row(self, row, **kwargs):
+        return self.append_rows([row])
+
+    # 追記ファイルの行をまとめてブックに移す（一時ファイルから差し替え、そのあと追記ファイルを空にする）
+    def merge(self):
+        with self.lock:
+            self._load_side()
+            if not self.side:
+                return 0
+            if os.path.exists(self.path):
+                wb = openpyxl.load_workbook(self.path)
+                ws = wb.worksheets[0]
+            else:
+                wb = openpyxl.Workbook()
+                ws = wb.active
+                ws.append(self.backend._seed_values(self.title)[0])
+            for row in self.side:
+                ws.append(row)
+            tmp_path = self.path + ".tmp"
+            wb.save(tmp_path)
+            os.replace(tmp_path, self.path)
+            merged = len(self.side)
+            self.side = []
+            self._clear_side()
+        self.backend._count('merged')
+        return merged
+
+    def merge_if_idle(self, idle_sec):
+        with self.lock:
+            due = bool(self.side) and time.monotonic() - self.last_append >= idle_sec
+        return self.merge() if due else 0
+
+
+class XlsxSheetBackend:
+    def __init__(self, data_dir=BASE_DIR, merge_rows=XLSX_MERGE_ROWS, merge_sec=XLSX_MERGE_SEC):
+        self.data_dir = data_dir
+        self.merge_rows = merge_rows
+        self.merge_sec = merge_sec
+        self.lock = threading.Lock()
+        self.sheets = {}
+        self.counters = {'read': 0, 'parsed': 0, 'write': 0, 'merged': 0, 'changes': 0}
+        self.thread = None
+
+    def _seed_values(self, sheet_name):
+        return [seed_header(sheet_name)]
+
+    def worksheet(self, sheet_name):
+        with self.lock:
+            if sheet_name not in self.sheets:
+                file_name = LOCAL_WORKBOOKS.get(sheet_name, f"{sheet_name}.xlsx")
+                self.sheets[sheet_name] = XlsxWorksheet(self, sheet_name, os.path.join(self.data_dir, file_name))
+            return self.sheets[sheet_name]
+
+    def _count(self, name):
+        with self.lock:
+            self.counters[name] += 1
+
+    def watch(self, on_change, sheet_names, interval=5.0):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._watch, args=(on_change, list(sheet_names), interval),
+                                           name="xlsx-watcher", daemon=True)
+            self.thread.start()
+        return self
+
+    def _watch(self, on_change, sheet_names, interval):
+        seen = {}  # シート名 → 最後に知らせた (更新時刻と大きさ, 値)
+        for name in sheet_names:
+            try:
+                seen[name] = self.worksheet(name)._read()
+            except Exception:
+                seen[name] = (None, [])
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                opened = list(self.sheets.values())
+            for ws in opened:
+                try:
+                    ws.merge_if_idle(self.merge_sec)
+                except Exception:
+                    pass  # ブックが開かれているなどで保存できなければ次の周期にもう一度
+            for name in sheet_names:
+                ws = self.worksheet(name)
+                if ws._stamp() == seen[name][0]:
+                    continue
+                try:
+                    stamp, values = ws._read()
+                except Exception:
+                    continue  # 保存途中などで読めなければ次の周期にもう一度
+                old = seen[name][1]
+                seen[name] = (stamp, values)
+                if values == old:
+                    continue  # 追記ファイルの行をブックへ移しただけ
+                appended = len(values) >= len(old) and values[:len(old)] == old
+                self._count('changes')
+                try:
+                    on_change(name, values, len(old) if appended else None)
+                except Exception:
+                    pass
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics['backend'] = 'xlsx'
+            metrics['data_dir'] = self.data_dir
+        return metrics
+
+
+def backend_from_env(pool):
+    backend = os.getenv("FAQ_SHEETS_BACKEND", "gspread")
+    if backend == "xlsx":
+        return XlsxSheetBackend(os.getenv("FAQ_XLSX_DIR", BASE_DIR))
+    if backend != "local":
+        return GspreadBackend(pool)
+    quota = os.getenv("FAQ_EMULATOR_QUOTA")
+    return LocalSheetBackend(
+        latency=float(os.getenv("FAQ_EMULATOR_LATENCY", "0")),
+        jitter=float(os.getenv("FAQ_EMULATOR_JITTER", "0")),
+        quota_per_minute=int(quota) if quota else None,
+        error_rate=float(os.getenv("FAQ_EMULATOR_ERROR_RATE", "0")),
+        timeout_rate=float(os.getenv("FAQ_EMULATOR_TIMEOUT_RATE", "0")),
+        timeout=float(os.getenv("FAQ_EMULATOR_TIMEOUT", "30")),
+    )
@@ -0,0 +1,155 @@
+import os
+import random
+import threading
+import time
+
+# -------------------------------
+# 🚦 Googleスプレッドシート API 呼び出しの共通窓口
+# -------------------------------
+# ・同じシートの同時読み込みは1回のリクエストにまとめる（single-flight）
+# ・トークンバケットで1分あたりのリクエスト数を割り当て内に抑える
+# ・429 / 5xx は指数バックオフ（ジッター付き）で再試行
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+
+
+def error_status(e):
+    response = getattr(e, 'response', None)
+    status = getattr(response, 'status_code', None) or getattr(e, 'status_code', None) or getattr(e, 'code', None)
+    try:
+        return int(status)
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    def __init__(self, rate_per_minute, burst, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.clock = clock
+        self.sleep = sleep
+        self.updated = clock()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # トークンが取れるまで待つ。待った秒数を返す
+    def acquire(self):
+        waited = 0.0
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                wait = (1 - self.tokens) / self.rate
+            self.sleep(wait)
+            waited += wait
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SheetsClient:
+    def __init__(self, rate_per_minute=60, burst=10, max_retries=5, base_delay=1.0, max_delay=32.0,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.bucket = TokenBucket(rate_per_minute, burst, clock=clock, sleep=sleep)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.sleep = sleep
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.counters = {
+            'requests': 0,        # 実際に API を呼んだ回数（再試行を含む）
+            'coalesced': 0,       # 実行中の同じ読み込みに相乗りした回数
+            'retries': 0,
+            'quota_errors': 0,    # 429
+            'failures': 0,        # 再試行しても失敗した回数
+            'throttle_wait_sec': 0.0,
+            'backoff_wait_sec': 0.0,
+        }
+
+    def _count(self, name, value=1):
+        with self.lock:
+            self.counters[name] += value
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counters)
+            metrics['in_flight'] = len(self.flights)
+        return metrics
+
+    def _backoff(self, attempt):
+        # フルジッター: 0 〜 min(上限, 基準 × 2^試行回数) の一様乱数
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    # idempotent=False（行の追加など）は 429 のときだけ再試行する（未反映が確実なため）
+    def _with_retry(self, fn, idempotent):
+        attempt = 0
+        while True:
+            self._count('throttle_wait_sec', self.bucket.acquire())
+            self._count('requests')
+            try:
+                return fn()
+            except Exception as e:
+                status = error_status(e)
+                if status == 429:
+                    self._count('quota_errors')
+                retryable = status == 429 or (idempotent and status in RETRYABLE_STATUS)
+                if not retryable or attempt >= self.max_retries:
+                    self._count('failures')
+                    raise
+                delay = self._backoff(attempt)
+                self._count('retries')
+                self._count('backoff_wait_sec', delay)
+                self.sleep(delay)
+                attempt += 1
+
+    # key が同じ呼び出しが実行中なら、その結果を共有する
+    def call(self, fn, key=None, idempotent=True):
+        if key is None:
+            return self._with_retry(fn, idempotent)
+        with self.lock:
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = _Flight()
+            else:
+                self.counters['coalesced'] += 1
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = self._with_retry(fn, idempotent)
+            return flight.result
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+
+    def read(self, sheet_name, fn):
+        return self.call(fn, key=('read', sheet_name))
+
+    def write(self, fn):
+        return self.call(fn, idempotent=False)
+
+
+def client_from_env():
+    return SheetsClient(
+        rate_per_minute=float(os.getenv("SHEETS_REQUESTS_PER_MINUTE", "60")),
+        burst=int(os.getenv("SHEETS_BURST", "10")),
+        max_retries=int(os.getenv("SHEETS_MAX_RETRIES", "5")),
+    )
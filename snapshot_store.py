@@ -0,0 +1,308 @@
+import json
+import mmap
+import os
+import sys
+import time
+from array import array
+from bisect import bisect_left
+
+from faq_index import FlatSuggestTrie, SearchIndex
+from faq_snapshot import LazyRecords, Snapshot, category_kind, next_version
+
+# -------------------------------
+# 💾 事前ビルド済みスナップショット（mmap で複数プロセスから共有）
+# -------------------------------
+# snapshot/manifest.json … 形式・バージョン・各カテゴリの列や件数・各セクションの位置
+# snapshot/snapshot_<version>.bin … 列データ・照合対象・転置索引・入力候補・五十音グループの配列
+# snapshot/stale.json … 成果物より新しいデータがシート側にあるカテゴリ（→ 成果物のバージョン）
+SNAPSHOT_FORMAT = 2
+MANIFEST_NAME = "manifest.json"
+STALE_NAME = "stale.json"
+KEEP_BUILDS = 2  # 古いワーカーがまだ mmap しているかもしれないので1世代残す
+
+
+def snapshot_dir():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "snapshot")
+    return os.getenv("FAQ_SNAPSHOT_DIR", default)
+
+
+# -------------------------------
+# ✏️ 書き出し
+# -------------------------------
+class ArtifactWriter:
+    def __init__(self, f):
+        self.f = f
+        self.sections = {}
+
+    def _write(self, name, typecode, data):
+        self.f.write(b'\0' * (-self.f.tell() % 8))  # memoryview.cast 用に8バイト境界へ揃える
+        self.sections[name] = [self.f.tell(), len(data), typecode]
+        self.f.write(data)
+
+    def add_array(self, name, typecode, values):
+        self._write(name, typecode, array(typecode, values).tobytes())
+
+    def add_strings(self, name, values):
+        blob = bytearray()
+        offsets = array('Q', [0])
+        for value in values:
+            blob += str(value).encode('utf-8')
+            offsets.append(len(blob))
+        self._write(name + '.blob', 'B', bytes(blob))
+        self._write(name + '.offsets', 'Q', offsets.tobytes())
+
+    # キー → 行番号リスト（キーは並べ替えて二分探索できるようにする）
+    def add_groups(self, name, groups):
+        keys = sorted(groups)
+        offsets = array('Q', [0])
+        ids = array('I')
+        for key in keys:
+            ids.extend(groups[key])
+            offsets.append(len(ids))
+        self.add_strings(name + '.keys', keys)
+        self._write(name + '.offsets', 'Q', offsets.tobytes())
+        self._write(name + '.ids', 'I', ids.tobytes())
+
+
+def write_snapshot_artifact(snapshots, out_dir=None, source=""):
+    out_dir = out_dir or snapshot_dir()
+    os.makedirs(out_dir, exist_ok=True)
+    version = next_version()
+    file_name = f"snapshot_{version}.bin"
+    manifest = {
+        'format': SNAPSHOT_FORMAT,
+        'version': version,
+        'byteorder': sys.byteorder,
+        'source': source,
+        'built_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'file': file_name,
+        'categories': {},
+    }
+
+    tmp_path = os.path.join(out_dir, file_name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        writer = ArtifactWriter(f)
+        for category, snapshot in snapshots.items():
+            prefix = category + "/"
+            records = snapshot.faqs if snapshot.kind == "faq" else snapshot.rows
+            for col in snapshot.columns:
+                writer.add_strings(prefix + "col." + col, (r.get(col, '') for r in records))
+            if snapshot.search_index is not None:
+                writer.add_strings(prefix + "texts", snapshot.search_index.texts)
+                writer.add_groups(prefix + "postings", snapshot.search_index.postings)
+            elif snapshot.search_texts is not None:
+                writer.add_strings(prefix + "texts", snapshot.search_texts)
+            trie = snapshot.suggest.flatten()
+            writer.add_strings(prefix + "suggest.terms", trie.pop('terms'))
+            for name, values in trie.items():
+                writer.add_array(prefix + "suggest." + name, 'I', values)
+            if snapshot.gojuon:
+                writer.add_groups(prefix + "gojuon", snapshot.gojuon)
+            writer.add_strings(prefix + "synonym.concepts", snapshot.synonym_concepts)
+            writer.add_strings(prefix + "synonym.targets", snapshot.synonym_targets)
+            manifest['categories'][category] = {
+                'rows': len(records),
+                'columns': snapshot.columns,
+                'facets': snapshot.facets,
+                'has_index': snapshot.search_index is not None,
+                'has_texts': snapshot.search_texts is not None,
+                'has_gojuon': bool(snapshot.gojuon),
+            }
+        manifest['sections'] = writer.sections
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(out_dir, file_name))
+
+    # manifest の差し替えで公開（読み手は常に完全な成果物だけを見る）
+    manifest_tmp = os.path.join(out_dir, MANIFEST_NAME + ".tmp")
+    with open(manifest_tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(manifest_tmp, os.path.join(out_dir, MANIFEST_NAME))
+
+    builds = sorted(n for n in os.listdir(out_dir) if n.startswith("snapshot_") and n.endswith(".bin"))
+    for name in builds[:-KEEP_BUILDS]:
+        os.remove(os.path.join(out_dir, name))
+    return version
+
+
+# -------------------------------
+# 📖 読み込み（mmap 上の配列をそのまま参照）
+# -------------------------------
+class StrColumn:
+    def __init__(self, blob, offsets):
+        self.blob = blob
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        return str(self.blob[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+
+class MappedGroups:
+    def __init__(self, keys, offsets, ids):
+        self._keys = keys
+        self.offsets = offsets
+        self.ids = ids
+
+    def _find(self, key):
+        pos = bisect_left(self._keys, key)
+        if pos < len(self._keys) and self._keys[pos] == key:
+            return pos
+        return None
+
+    def get(self, key, default=None):
+        pos = self._find(key)
+        if pos is None:
+            return default
+        return self.ids[self.offsets[pos]:self.offsets[pos + 1]]
+
+    def __contains__(self, key):
+        return self._find(key) is not None
+
+    def __len__(self):
+        return len(self._keys)
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def keys(self):
+        return list(self._keys)
+
+    def items(self):
+        return [(key, self.get(key)) for key in self._keys]
+
+
+class ArtifactReader:
+    def __init__(self, path, sections):
+        with open(path, "rb") as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.view = memoryview(self.mm)
+        self.sections = sections
+
+    def has(self, name):
+        return name in self.sections or name + '.blob' in self.sections
+
+    def array(self, name):
+        offset, length, typecode = self.sections[name]
+        return self.view[offset:offset + length].cast(typecode)
+
+    def strings(self, name):
+        return StrColumn(self.array(name + '.blob'), self.array(name + '.offsets'))
+
+    def groups(self, name):
+        return MappedGroups(self.strings(name + '.keys'), self.array(name + '.offsets'), self.array(name + '.ids'))
+
+
+def read_manifest(directory=None):
+    path = os.path.join(directory or snapshot_dir(), MANIFEST_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+    if manifest.get('format') != SNAPSHOT_FORMAT or manifest.get('byteorder') != sys.byteorder:
+        return None
+    return manifest
+
+
+def restore_snapshot(reader, category, info, version):
+    prefix = category + "/"
+    columns = {col: reader.strings(prefix + "col." + col) for col in info['columns']}
+    records = LazyRecords(columns, info['rows'])
+    search_index = search_texts = None
+    if info['has_index']:
+        search_index = SearchIndex.mapped(reader.strings(prefix + "texts"), reader.groups(prefix + "postings"))
+    elif info.get('has_texts'):
+        search_texts = reader.strings(prefix + "texts")
+    suggest = FlatSuggestTrie({
+        'terms': reader.strings(prefix + "suggest.terms"),
+        'edge_chars': reader.array(prefix + "suggest.edge_chars"),
+        'child_start': reader.array(prefix + "suggest.child_start"),
+        'child_len': reader.array(prefix + "suggest.child_len"),
+        'top_start': reader.array(prefix + "suggest.top_start"),
+        'top_ids': reader.array(prefix + "suggest.top_ids"),
+    })
+    is_faq = category_kind(category) == "faq"
+    return Snapshot.restore(
+        category, version, info['columns'],
+        faqs=records if is_faq else None,
+        rows=None if is_faq else records,
+        suggest=suggest,
+        search_index=search_index,
+        search_texts=search_texts,
+        gojuon=reader.groups(prefix + "gojuon") if info['has_gojuon'] else None,
+        facets=info['facets'],
+        synonym_concepts=reader.strings(prefix + "synonym.concepts"),
+        synonym_targets=reader.strings(prefix + "synonym.targets"),
+    )
+
+
+_mapped = {}  # version → {カテゴリ: Snapshot}
+
+
+def load_snapshot_artifact(directory=None):
+    directory = directory or snapshot_dir()
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return None
+    version = manifest['version']
+    if version not in _mapped:
+        reader = ArtifactReader(os.path.join(directory, manifest['file']), manifest['sections'])
+        _mapped.clear()  # 古い世代の参照を手放す（使用中のセッションが持つ分は残る）
+        _mapped[version] = {
+            category: restore_snapshot(reader, category, info, version)
+            for category, info in manifest['categories'].items()
+        }
+    return _mapped[version]
+
+
+def read_stale(directory=None):
+    path = os.path.join(directory or snapshot_dir(), STALE_NAME)
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+
+
+# 成果物があり、かつそのカテゴリが古くなっていなければ mmap 版を返す
+# （起動直後の種として使うだけで、SnapshotRefresher はこのあとすぐシートから読み直す）
+def load_mapped_snapshot(category, directory=None):
+    snapshots = load_snapshot_artifact(directory)
+    if not snapshots or category not in snapshots:
+        return None
+    snapshot = snapshots[category]
+    if snapshot.version <= read_stale(directory).get(category, 0):
+        return None
+    return snapshot
+
+# 書き込みなどで成果物より新しいデータがあるカテゴリは、次のビルドまで成果物を使わない。
+# 印はマニフェストの隣のファイルに残す（再起動したプロセス・別のワーカーも同じ印を見る）
+def mark_stale(category, directory=None):
+    directory = directory or snapshot_dir()
+    manifest = read_manifest(directory)
+    if manifest is None:
+        return
+    stale = read_stale(directory)
+    if stale.get(category, 0) >= manifest['version']:
+        return
+    stale[category] = manifest['version']
+    tmp_path = os.path.join(directory, f"{STALE_NAME}.{os.getpid()}.tmp")
+    try:
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(stale, f, ensure_ascii=False)
+        os.replace(tmp_path, os.path.join(directory, STALE_NAME))
+    except OSError:
+        pass  # 書けない場所なら印は残せないが、読み直し自体はシートから行われる
@@ -0,0 +1,72 @@
+import copy
+
+from faq_snapshot import SHEET_SCHEMAS, records_from_values, snapshot_from_values
+
+# -------------------------------
+# 🧪 差分で足した版（Snapshot.appended）が全件から作り直した版と同じになり、元の版を変えないこと
+# -------------------------------
+CATEGORY = "トラブル事例"
+HEADER = SHEET_SCHEMAS['trouble']
+
+
+def trouble_values(rows):
+    return [list(HEADER)] + [[site, eq, content, '対処', detail, cat, ''] for site, eq, content, detail, cat in rows]
+
+
+BASE = [
+    ('A現場', 'ポンプ', '異音がする', 'P-1', '機械'),
+    ('A現場', 'ポンプ', '漏れがある', 'P-2', '機械'),
+    ('B現場', '盤', '停電した', '', '電気'),
+    ('', '弁', '固着', 'V-1', ''),
+]
+ADDED = [
+    ('A現場', 'ポンプ', '異音が再発', 'P-1', '機械'),  # 既にある組
+    ('C現場', 'ファン', '振動が大きい', 'F-1', '機械'),   # 新しい現場
+    ('', '', '原因不明の停止', '', '電気'),              # 空欄の現場・設備
+]
+
+
+def cube_state(cube):
+    return {name: copy.deepcopy(getattr(cube, name)) for name in
+            ('cells', 'sites', 'categories', 'raw_categories', 'site_pairs', 'category_pairs')}
+
+
+def options_state(options):
+    return copy.deepcopy((options.children, options.counts, options.values))
+
+
+def test_appended_matches_full_rebuild():
+    base = snapshot_from_values(CATEGORY, trouble_values(BASE))
+    base.cube, base.options  # 集計と選択肢を作ってから足す（画面が使ったあとの状態）
+    values = trouble_values(BASE + ADDED)
+    appended = base.appended(records_from_values(values, "trouble", len(BASE) + 1))
+    full = snapshot_from_values(CATEGORY, values)
+
+    assert list(appended.rows) == list(full.rows)
+    assert list(appended.search_texts) == list(full.search_texts)
+    assert appended.facets == full.facets
+    assert cube_state(appended.cube) == cube_state(full.cube)
+    assert appended.cube.site_counts() == full.cube.site_counts()
+    assert options_state(appended.options) == options_state(full.options)
+    assert appended.options.options('A現場') == full.options.options('A現場') == ['ポンプ']
+    for query in ('ポンプ', '異音', '機械 現場', '停止'):
+        assert list(appended.search(query)) == list(full.search(query))
+
+
+def test_appended_leaves_base_version_unchanged():
+    base = snapshot_from_values(CATEGORY, trouble_values(BASE))
+    cube, options = base.cube, base.options
+    before = (cube_state(cube), options_state(options), copy.deepcopy(base.facets), list(base.rows),
+              list(base.search('ポンプ')))
+
+    values = trouble_values(BASE + ADDED)
+    appended = base.appended(records_from_values(values, "trouble", len(BASE) + 1))
+    appended.appended(records_from_values(trouble_values(BASE + ADDED + ADDED), "trouble", len(BASE + ADDED) + 1))
+
+    assert base.cube is cube and base.options is options
+    assert appended.cube is not cube and appended.options is not options
+    after = (cube_state(cube), options_state(options), base.facets, list(base.rows), list(base.search('ポンプ')))
+    assert after == before
+    assert len(base.rows) == len(BASE)
+    assert cube.cell('A現場', 'ポンプ', '機械') == [0, 1]
+    assert appended.cube.cell('A現場', 'ポンプ', '機械') == [0, 1, 4]
@@ -0,0 +1,131 @@
+import threading
+
+import pytest
+
+import sheets_client
+from sheet_backend import EmulatedAPIError, LocalSheetBackend
+from sheets_client import SheetsClient
+
+# -------------------------------
+# 🧪 シート API の共通クライアント（模擬シート LocalSheetBackend を相手に確認）
+# -------------------------------
+# 時間は FakeClock で進める（待ち時間を実際には待たず、待った秒数をそのまま確かめる）
+SHEET = "パト指摘事項"  # base_dir に .xlsx が無いので見出し行だけのシートになる
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture
+def max_backoff(monkeypatch):
+    # フルジッターの乱数を上限に固定して、待ち時間を決まった値にする
+    monkeypatch.setattr(sheets_client.random, "uniform", lambda low, high: high)
+
+
+def test_concurrent_reads_share_one_call(tmp_path):
+    backend = LocalSheetBackend(base_dir=str(tmp_path), latency=0.3)
+    client = SheetsClient(rate_per_minute=6000, burst=100)
+    ws = backend.worksheet(SHEET)
+    start = threading.Barrier(8)
+    results = []
+
+    def read():
+        start.wait()
+        results.append(client.read(SHEET, ws.get_all_values))
+
+    threads = [threading.Thread(target=read) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert backend.metrics()['read'] == 1
+    assert client.metrics()['requests'] == 1
+    assert client.metrics()['coalesced'] == 7
+    assert all(r == results[0] for r in results) and len(results) == 8
+
+
+def test_different_sheets_are_not_coalesced(tmp_path):
+    backend = LocalSheetBackend(base_dir=str(tmp_path))
+    client = SheetsClient(rate_per_minute=6000, burst=100)
+    client.read(SHEET, backend.worksheet(SHEET).get_all_values)
+    client.read("トラブル事例", backend.worksheet("トラブル事例").get_all_values)
+    assert backend.metrics()['read'] == 2
+    assert client.metrics()['coalesced'] == 0
+
+
+def test_bucket_throttles_burst(tmp_path, clock):
+    backend = LocalSheetBackend(base_dir=str(tmp_path), clock=clock, sleep=clock.sleep)
+    client = SheetsClient(rate_per_minute=60, burst=3, clock=clock, sleep=clock.sleep)
+    ws = backend.worksheet(SHEET)
+    for _ in range(6):
+        client.call(ws.get_all_values)
+
+    # 3件までは即座に、残り3件は 1件/秒 の補充を待つ
+    assert backend.metrics()['read'] == 6
+    assert clock.now == pytest.approx(3.0)
+    assert client.metrics()['throttle_wait_sec'] == pytest.approx(3.0)
+
+
+def test_quota_error_is_retried_with_backoff(tmp_path, clock, max_backoff):
+    backend = LocalSheetBackend(base_dir=str(tmp_path), quota_per_minute=3, clock=clock, sleep=clock.sleep)
+    client = SheetsClient(rate_per_minute=6000, burst=100, max_retries=5, base_delay=30, max_delay=120,
+                          clock=clock, sleep=clock.sleep)
+    ws = backend.worksheet(SHEET)
+    for _ in range(3):
+        client.call(ws.get_all_values)
+    values = client.call(ws.get_all_values)  # 4件目は 429 → 30秒 → 429 → 60秒 → 1分の枠が空いて成功
+
+    assert values == ws.values
+    assert clock.sleeps == [30, 60]
+    metrics = client.metrics()
+    assert metrics['quota_errors'] == 2
+    assert metrics['retries'] == 2
+    assert metrics['failures'] == 0
+    assert metrics['backoff_wait_sec'] == pytest.approx(90)
+
+
+def test_quota_error_surfaces_after_retries(tmp_path, clock, max_backoff):
+    backend = LocalSheetBackend(base_dir=str(tmp_path), quota_per_minute=1, clock=clock, sleep=clock.sleep)
+    client = SheetsClient(rate_per_minute=6000, burst=100, max_retries=3, base_delay=1, max_delay=32,
+                          clock=clock, sleep=clock.sleep)
+    ws = backend.worksheet(SHEET)
+    client.call(ws.get_all_values)
+    with pytest.raises(EmulatedAPIError):
+        client.call(ws.get_all_values)
+
+    # 待ち時間は 1, 2, 4 秒と倍になり、再試行を使い切ったら呼び出し元へ 429 を返す
+    assert clock.sleeps == [1, 2, 4]
+    metrics = client.metrics()
+    assert metrics['requests'] == 5
+    assert metrics['quota_errors'] == 4
+    assert metrics['retries'] == 3
+    assert metrics['failures'] == 1
+
+
+def test_write_is_not_resent_after_lost_response(tmp_path, clock):
+    # 模擬シートのタイムアウトは、書き込みを反映したあとで応答だけを失う
+    backend = LocalSheetBackend(base_dir=str(tmp_path), timeout_rate=1.0, timeout=5, clock=clock, sleep=clock.sleep)
+    client = SheetsClient(rate_per_minute=6000, burst=100, clock=clock, sleep=clock.sleep)
+    ws = backend.worksheet(SHEET)
+    with pytest.raises(TimeoutError):
+        client.write(lambda: ws.append_rows([["設備", "指摘"]]))
+
+    assert backend.metrics()['write'] == 1
+    assert ws.values[-1] == ["設備", "指摘"] and len(ws.values) == 2
+    assert client.metrics()['retries'] == 0
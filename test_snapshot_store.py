@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from faq_snapshot import SHEET_SCHEMAS, snapshot_from_values
+from sheet_backend import BASE_DIR, read_xlsx_values
+from snapshot_store import load_mapped_snapshot, load_snapshot_artifact, mark_stale, write_snapshot_artifact
+
+# -------------------------------
+# 🧪 mmap の成果物から戻したスナップショットが、メモリ上で作った版と同じ結果を返すこと
+# -------------------------------
+# 文字列の列（StrColumn）・行（LazyRecords）・索引・入力候補・五十音の各区画を通して比べる
+PATROL = [
+    ['給水ポンプ', '異音あり', '軸受交換', '機械', 'ポンプ,ぽんぷ'],
+    ['分電盤', '表示灯の球切れ', '交換済み', '電気', ''],
+    ['', '足場の手すり欠落', '是正', '安全', 'てすり'],
+    ['冷却塔', '漏水（ドレン）', '', '機械', '冷却'],
+]
+TROUBLE = [
+    ['A現場', 'ポンプ', '異音がする', '軸受交換', 'P-1', '機械', ''],
+    ['', '盤', '停電した', '復旧', '', '電気', '夜間'],
+    ['B現場', '弁', '固着した😅', '', 'V-1', '', ''],
+]
+QUERIES = {
+    "工事関係": ['安全', 'ばるぶ', 'バルブ 安全', 'あんぜん', '存在しない語'],
+    "パト指摘事項": ['ポンプ', '交換', 'ぽんぷ', '漏水 機械'],
+    "トラブル事例": ['ポンプ', '停電', '固着', '現場 異音'],
+}
+PREFIXES = ['安', 'あ', 'ば', 'ポ', '']
+
+
+@pytest.fixture(scope="module")
+def built(tmp_path_factory):
+    faq_values = read_xlsx_values(os.path.join(BASE_DIR, "faq.xlsx"))
+    snapshots = {
+        "工事関係": snapshot_from_values("工事関係", faq_values),
+        "パト指摘事項": snapshot_from_values("パト指摘事項", [SHEET_SCHEMAS['patrol']] + PATROL),
+        "トラブル事例": snapshot_from_values("トラブル事例", [SHEET_SCHEMAS['trouble']] + TROUBLE),
+    }
+    directory = str(tmp_path_factory.mktemp("snapshot"))
+    write_snapshot_artifact(snapshots, out_dir=directory, source="test")
+    return snapshots, load_snapshot_artifact(directory), directory
+
+
+@pytest.mark.parametrize("category", list(QUERIES))
+def test_mapped_snapshot_matches_memory_build(built, category):
+    snapshots, mapped, _ = built
+    memory, restored = snapshots[category], mapped[category]
+
+    assert restored.columns == memory.columns
+    assert list(restored.records) == list(memory.records)
+    assert restored.facets == memory.facets
+    if memory.search_index is not None:
+        assert list(restored.search_index.texts) == list(memory.search_index.texts)
+    else:
+        assert list(restored.search_texts) == list(memory.search_texts)
+    assert list(restored.synonym_targets) == list(memory.synonym_targets)
+    for query in QUERIES[category]:
+        for mode in ('AND', 'OR'):
+            assert list(restored.search(query, mode)) == list(memory.search(query, mode)), (query, mode)
+        hits = list(memory.search(query, 'OR'))
+        for i in hits[:5]:
+            assert restored.match_spans(i, query) == memory.match_spans(i, query)
+    for prefix in PREFIXES:
+        assert list(restored.suggest.lookup(prefix)) == list(memory.suggest.lookup(prefix)), prefix
+
+
+def test_mapped_gojuon_matches_memory_build(built):
+    snapshots, mapped, _ = built
+    memory, restored = snapshots["工事関係"], mapped["工事関係"]
+    assert memory.gojuon
+    assert sorted(restored.gojuon.keys()) == sorted(memory.gojuon.keys())
+    for initial, ids in memory.gojuon.items():
+        assert list(restored.gojuon.get(initial)) == list(ids)
+
+
+def test_stale_category_is_not_seeded(built):
+    _, mapped, directory = built
+    assert load_mapped_snapshot("パト指摘事項", directory) is mapped["パト指摘事項"]
+    mark_stale("パト指摘事項", directory)
+    assert load_mapped_snapshot("パト指摘事項", directory) is None
+    assert load_mapped_snapshot("工事関係", directory) is mapped["工事関係"]
@@ -0,0 +1,86 @@
+from functools import partial
+
+from faq_snapshot import JOURNAL_ID_COLUMN, SnapshotRefresher, records_from_values, snapshot_from_values
+from sheet_backend import LocalSheetBackend, XlsxSheetBackend
+from sheets_client import SheetsClient
+from write_journal import WriteJournal, send_journal_rows
+
+# -------------------------------
+# 🧪 書き込みジャーナル → シート → スナップショットで、登録が1回だけ反映されること
+# -------------------------------
+SHEET = "トラブル事例"
+VALUES = ['A現場', 'ポンプ', '異音', '交換', 'P-1', '機械']  # アプリが書く列（faq_app の TROUBLE_SHEET_COLUMNS の順）
+COLUMNS = ['現場名', '設備名', 'トラブル内容', '対処', '詳細機器名', 'カテゴリ']
+
+
+def make_journal(backend, tmp_path):
+    client = SheetsClient(rate_per_minute=6000, burst=100)
+    return WriteJournal(partial(send_journal_rows, backend, client, {}), path=str(tmp_path / "writes.jsonl"))
+
+
+def data_rows(ws):
+    return ws.get_all_values()[1:]
+
+
+def test_id_goes_past_the_schema(tmp_path):
+    backend = LocalSheetBackend(base_dir=str(tmp_path))
+    journal = make_journal(backend, tmp_path)
+    entry_id = journal.append(SHEET, VALUES)
+    assert journal.flush()
+
+    ws = backend.worksheet(SHEET)
+    header = ws.get_all_values()[0]
+    row = data_rows(ws)[0]
+    assert row[header.index('備考')] == ''
+    assert row[header.index(JOURNAL_ID_COLUMN)] == entry_id
+    record = records_from_values(ws.get_all_values(), "trouble")[0]
+    assert record['備考'] == '' and record[JOURNAL_ID_COLUMN] == entry_id
+
+
+def test_register_flush_and_watcher_echo_give_one_row(tmp_path):
+    backend = XlsxSheetBackend(str(tmp_path))
+    ws = backend.worksheet(SHEET)
+    refresher = SnapshotRefresher(lambda c: snapshot_from_values(c, backend.worksheet(c).get_all_values()), [SHEET])
+    before = ws.get_all_values()
+    assert len(refresher.get(SHEET).rows) == 0
+
+    # 登録画面: ジャーナルに記録し、差分としてすぐ反映する
+    journal = make_journal(backend, tmp_path)
+    entry_id = journal.append(SHEET, VALUES)
+    refresher.apply_rows(SHEET, [dict(zip(COLUMNS, VALUES), **{JOURNAL_ID_COLUMN: entry_id})])
+    # 送信スレッド → ブック、ブックの見張り → 追加分を差分として知らせる
+    assert journal.flush()
+    values = ws.get_all_values()
+    refresher.apply_rows(SHEET, records_from_values(values, "trouble", len(before)))
+
+    rows = list(refresher.get(SHEET).rows)
+    assert len(rows) == 1
+    assert rows[0]['備考'] == '' and rows[0][JOURNAL_ID_COLUMN] == entry_id
+
+
+def test_replay_after_timeout_does_not_duplicate(tmp_path):
+    backend = LocalSheetBackend(base_dir=str(tmp_path), timeout=0)
+    journal = make_journal(backend, tmp_path)
+    journal.append(SHEET, VALUES)
+    assert journal.flush()
+
+    # 模擬シートのタイムアウトは、書き込みを反映したあとで応答だけを失う
+    backend.timeout_rate = 1.0
+    journal.append(SHEET, VALUES)
+    journal.append(SHEET, VALUES)  # 同じ内容の2件はどちらも残す
+    assert not journal.flush()
+    assert backend.metrics()['write'] == 2 and len(backend.worksheet(SHEET).values) == 1 + 3
+    assert journal.status()['uncertain'] == [SHEET]
+
+    backend.timeout_rate = 0.0
+    journal.append(SHEET, VALUES)
+    assert journal.flush()
+
+    rows = data_rows(backend.worksheet(SHEET))
+    assert len(rows) == 4
+    assert len({row[-1] for row in rows}) == 4
+    assert journal.status()['ends'] == {SHEET: 5}
+
+    # 再起動後も最後に送れた行を引き継ぐ
+    restarted = make_journal(backend, tmp_path)
+    assert restarted.ends == {SHEET: 5} and not restarted.pending
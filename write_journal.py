@@ -0,0 +1,199 @@
+import json
+import os
+import threading
+import time
+import uuid
+
+from faq_snapshot import SHEET_SCHEMAS, find_header, journal_id_position
+from sheet_backend import LOG_HEADER, appended_end_row, column_letter
+from sheets_client import error_status
+
+# -------------------------------
+# 📓 書き込みジャーナル（先にローカルへ確実に記録し、シートへは後からまとめて送る）
+# -------------------------------
+# ・append は1行の JSON をファイル末尾に追記して fsync した時点で完了（画面はすぐ次へ進める）
+# ・送信スレッドがシートごとに未送信分をまとめて送り、送れた id を "done" として追記する
+#   （送り手が返した「追加した最後の行番号」も一緒に残す）
+# ・起動時はファイルを読み直し、done の無い記録を未送信として引き継ぐ（プロセスが落ちても失われない）
+# ・結果の分からない失敗（タイムアウトなど）のあとは、最後に送れた行番号を verify_from として渡す。
+#   送り手はその行より後ろにすでにある id を除いてから追加する（id ごとに1回だけ反映されるように。
+#   行番号が分からないときは 0）
+# ジャーナルのファイルは1つのアプリのプロセスだけが持つ前提
+JOURNAL_NAME = "writes.jsonl"
+COMPACT_BYTES = 1024 * 1024  # 未送信が無く、これより大きくなったら空にする
+
+
+def journal_dir():
+    default = os.path.join(os.path.dirname(os.path.abspath(__file__)), "journal")
+    return os.getenv("FAQ_JOURNAL_DIR", default)
+
+
+class WriteJournal:
+    def __init__(self, sender, path=None, batch_size=50, interval=2.0, max_delay=60.0):
+        self.sender = sender  # (シート名, (id, 行) のリスト, verify_from) → 追加した最後の行番号。送れなければ例外
+        self.path = path or os.path.join(journal_dir(), JOURNAL_NAME)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.pending = {}       # id → 記録（追記順）
+        self.uncertain = set()  # 前回の送信結果が分からないシート
+        self.ends = {}          # シート → 最後に送れた行番号
+        self.wakeup = threading.Event()
+        self.counters = {'appended': 0, 'sent': 0, 'batches': 0, 'failures': 0}
+        self.last_error = None
+        self.thread = None
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._replay()
+        self.f = open(self.path, "a", encoding="utf-8")
+
+    def _replay(self):
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return
+        for line in lines:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # 書きかけで落ちた最後の行
+            if record.get('op') == 'append':
+                self.pending[record['id']] = record
+            elif record.get('op') == 'done':
+                for entry_id in record['ids']:
+                    self.pending.pop(entry_id, None)
+                if record.get('end'):
+                    self.ends[record['sheet']] = record['end']
+            elif record.get('op') == 'ends':
+                self.ends.update(record['ends'])
+        # 再起動前に送りかけていた分は、反映済みかどうか分からない
+        self.uncertain = {record['sheet'] for record in self.pending.values()}
+
+    def _write(self, record):
+        self.f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    # ローカルに記録できた時点で id を返す（シートへの送信は待たない）
+    def append(self, sheet, values):
+        record = {
+            'op': 'append',
+            'id': uuid.uuid4().hex,
+            'ts': time.time(),
+            'sheet': sheet,
+            'values': ['' if v is None else str(v) for v in values],
+        }
+        with self.lock:
+            self._write(record)
+            self.pending[record['id']] = record
+            self.counters['appended'] += 1
+        self.wakeup.set()
+        return record['id']
+
+    # まだシートに送れていない行（全件読み込みのあとに重ねて表示するため）
+    def pending_entries(self, sheet):
+        with self.lock:
+            return [(record['id'], record['values']) for record in self.pending.values() if record['sheet'] == sheet]
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name="write-journal", daemon=True)
+            self.thread.start()
+        return self
+
+    # シートごとに1まとまりずつ送る。送れなかったシートがあれば False
+    def flush(self):
+        with self.lock:
+            batches = {}
+            for record in self.pending.values():
+                batch = batches.setdefault(record['sheet'], [])
+                if len(batch) < self.batch_size:
+                    batch.append(record)
+        ok = True
+        for sheet, records in batches.items():
+            verify_from = self.ends.get(sheet, 0) if sheet in self.uncertain else None
+            try:
+                end = self.sender(sheet, [(record['id'], record['values']) for record in records], verify_from)
+            except Exception as e:
+                ok = False
+                with self.lock:
+                    self.counters['failures'] += 1
+                    self.last_error = f"{sheet}: {type(e).__name__}: {e}"
+                    if error_status(e) != 429:  # 429 は未反映が確実、それ以外は反映された可能性がある
+                        self.uncertain.add(sheet)
+                continue
+            with self.lock:
+                if end:
+                    self.ends[sheet] = end
+                self._write({'op': 'done', 'ids': [record['id'] for record in records], 'sheet': sheet, 'end': end})
+                for record in records:
+                    self.pending.pop(record['id'], None)
+                self.uncertain.discard(sheet)
+                self.counters['sent'] += len(records)
+                self.counters['batches'] += 1
+        self._compact()
+        return ok
+
+    def _compact(self):
+        with self.lock:
+            if self.pending or self.f.tell() < COMPACT_BYTES:
+                return
+            self.f.close()
+            self.f = open(self.path, "w", encoding="utf-8")
+            if self.ends:
+                self._write({'op': 'ends', 'ends': self.ends})  # 行番号は空にしたあとも引き継ぐ
+
+    def _run(self):
+        failures = 0
+        while True:
+            if failures:
+                time.sleep(min(self.max_delay, self.interval * (2 ** failures)))
+            else:
+                self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+            if not self.pending:
+                failures = 0
+                continue
+            failures = 0 if self.flush() else failures + 1
+            if not failures and self.pending:
+                self.wakeup.set()  # 1回で送り切れなかった分は続けて送る
+
+    def status(self):
+        with self.lock:
+            status = dict(self.counters)
+            status['pending'] = len(self.pending)
+            status['uncertain'] = sorted(self.uncertain)
+            status['ends'] = dict(self.ends)
+            status['last_error'] = self.last_error
+        return status
+
+
+# -------------------------------
+# 📤 シートへの送り手（WriteJournal の sender。backend・client・id_positions は partial で渡す）
+# -------------------------------
+# ・各行の id は、見出しの「登録ID」の列（無ければ見出しとスキーマのどちらよりも右の列）に入れる。
+#   列の位置はシートの先頭 HEADER_SCAN_ROWS 行を1回だけ読んで決め、id_positions に覚える
+# ・verify_from があるときは、その行より後ろの id の列だけを読み、すでにある id の行を送らない
+JOURNAL_SHEETS = {"トラブル事例": SHEET_SCHEMAS['trouble'], "log": LOG_HEADER}  # シート → 見出しの列名
+HEADER_SCAN_ROWS = 10
+
+
+def send_journal_rows(backend, client, id_positions, sheet_name, entries, verify_from):
+    ws = backend.worksheet(sheet_name)
+    if sheet_name not in id_positions:
+        names = JOURNAL_SHEETS[sheet_name]
+        top = client.call(lambda: ws.get_values(f"A1:ZZ{HEADER_SCAN_ROWS}"))
+        header_at = find_header(top, names)
+        id_positions[sheet_name] = journal_id_position(top[header_at] if header_at is not None else [], names)
+    position = id_positions[sheet_name]
+    if verify_from is not None:
+        column = column_letter(position + 1)
+        tail = client.call(lambda: ws.get_values(f"{column}{verify_from + 1}:{column}"))
+        sent = {row[0]: verify_from + 1 + i for i, row in enumerate(tail) if row}
+        found = [sent[entry_id] for entry_id, _ in entries if entry_id in sent]
+        entries = [(entry_id, values) for entry_id, values in entries if entry_id not in sent]
+        if not entries:
+            return max(found)
+    rows = [list(values) + [''] * (position - len(values)) + [entry_id] for entry_id, values in entries]
+    return appended_end_row(client.write(lambda: ws.append_rows(rows)))